@@ -0,0 +1,42 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from . import models
+from .outbox import wake
+
+
+def retry_messages(modeladmin, request, queryset):
+    queryset.update(
+        status=models.OutboxMessage.STATUS_PENDING,
+        attempts=0, next_attempt=timezone.now()
+    )
+    wake()
+retry_messages.short_description = 'Reintentar mensajes seleccionado/s'
+
+
+@admin.register(models.OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('chat_id', 'status', 'attempts', 'created', 'sent', 'last_error')
+    list_filter = ('status',)
+    actions = (retry_messages,)
+
+
+class RoomPresenceInline(admin.TabularInline):
+    model = models.RoomPresence
+    raw_id_fields = ('user',)
+    extra = 0
+
+
+@admin.register(models.Room)
+class RoomAdmin(admin.ModelAdmin):
+    list_display = ('command', 'name', 'permission', 'active')
+    list_filter = ('active',)
+    inlines = (RoomPresenceInline,)
+
+
+@admin.register(models.RoomEvent)
+class RoomEventAdmin(admin.ModelAdmin):
+    list_display = ('date', 'room', 'user', 'kind')
+    list_filter = ('room', 'kind')
+    raw_id_fields = ('user',)
+    date_hierarchy = 'date'
@@ -0,0 +1,186 @@
+'''
+Protection of the bot against a slow or unavailable Telegram API: every
+method has its own timeout and a circuit breaker fails the calls right away
+while the API keeps failing, so the handler threads are not blocked.
+'''
+
+import logging
+import threading
+
+from time import monotonic
+
+from telegram.error import BadRequest, NetworkError, TelegramError
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Read timeout (in seconds) of the API methods
+METHOD_TIMEOUTS = {
+    'answerCallbackQuery': 2,
+    'getChat': 3,
+    'getChatMember': 3,
+    'getMe': 3,
+    'editMessageText': 4,
+    'sendMessage': 4,
+    'exportChatInviteLink': 5,
+}
+
+DEFAULT_TIMEOUT = 5
+
+# Long polling has its own timeout and is retried by the updater
+UNPROTECTED_METHODS = ('getUpdates',)
+
+
+class CircuitOpen(NetworkError):
+    '''The API call was not made because the API is failing'''
+
+    def __init__(self, retry_after):
+        super().__init__('Telegram API unavailable, retry in {:.0f}s'.format(retry_after))
+        self.retry_after = retry_after
+
+
+class CircuitBreaker():
+    '''
+    Opens after `failure_threshold` consecutive failures and rejects the
+    calls for `reset_timeout` seconds. Then a single call is let through:
+    the circuit closes if it works and opens again if it fails.
+    '''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+
+        self._opened_at = 0
+        self._trial = False
+        self._lock = threading.Lock()
+
+        self._publish()
+
+    def _publish(self):
+        metrics.set_value(
+            'bot_api_circuit_state', self.STATE_VALUES[self.state],
+            'State of the Telegram API circuit breaker (0 closed, 1 open, 2 half-open)'
+        )
+        metrics.set_value(
+            'bot_api_circuit_opened_total', self.opened,
+            'Times the Telegram API circuit breaker has opened', 'counter'
+        )
+        metrics.set_value(
+            'bot_api_circuit_rejected_total', self.rejected,
+            'Telegram API calls rejected by the open circuit breaker', 'counter'
+        )
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning('Telegram API circuit breaker %s', state)
+
+            if state == self.OPEN:
+                self.opened += 1
+                self._opened_at = monotonic()
+
+            self.state = state
+
+        self._publish()
+
+    def before_call(self):
+        '''Raises CircuitOpen if the call must not be made'''
+
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+
+            retry_after = self._opened_at + self.reset_timeout - monotonic()
+
+            if self.state == self.OPEN and retry_after <= 0:
+                self._set_state(self.HALF_OPEN)
+
+            if self.state == self.HALF_OPEN and not self._trial:
+                self._trial = True
+                return
+
+            self.rejected += 1
+            self._publish()
+
+        raise CircuitOpen(max(retry_after, 1))
+
+    def success(self):
+        with self._lock:
+            self._trial = False
+
+            if self.failures or self.state != self.CLOSED:
+                self.failures = 0
+                self._set_state(self.CLOSED)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+
+    def __str__(self):
+        return '{} ({} consecutive failures, opened {} times, {} calls rejected)'.format(
+            self.state, self.failures, self.opened, self.rejected
+        )
+
+
+class ProtectedRequest(metrics.MetricsRequest):
+    '''Telegram API request with timeouts per method and a circuit breaker'''
+
+    def __init__(self, *args, breaker=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.breaker = breaker or get_breaker()
+
+    def post(self, url, data, timeout=None):
+        method = url.rsplit('/', 1)[-1]
+
+        if method in UNPROTECTED_METHODS:
+            return super().post(url, data, timeout)
+
+        self.breaker.before_call()
+
+        try:
+            result = super().post(
+                url, data, timeout or METHOD_TIMEOUTS.get(method, DEFAULT_TIMEOUT)
+            )
+        except NetworkError as e:
+            if isinstance(e, BadRequest):
+                # The API answered, the request was wrong
+                self.breaker.success()
+            else:
+                self.breaker.failure()
+
+            raise
+        except TelegramError:
+            self.breaker.success()
+            raise
+
+        self.breaker.success()
+
+        return result
+
+
+_breaker = None
+
+def get_breaker():
+    '''Circuit breaker of the bot API requests, shared by all of them'''
+
+    global _breaker
+
+    if not _breaker:
+        _breaker = CircuitBreaker()
+
+    return _breaker
@@ -0,0 +1,174 @@
+'''
+Drain of the updates received while the bot was stopped. They are fetched
+in large batches before polling starts and the stale ones are dropped, so
+the bot does not spend minutes answering questions nobody is waiting for.
+'''
+
+import logging
+
+from datetime import datetime, timedelta
+
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of updates returned by getUpdates
+BATCH_SIZE = 100
+
+# Updates older than this are dropped
+MAX_AGE = timedelta(minutes=10)
+
+# Button presses older than this are dropped. Their age is the one of the
+# message with the buttons, and nobody waits long for a button
+CALLBACK_MAX_AGE = timedelta(minutes=2)
+
+# Answer to the dropped button presses, so they stop loading in the client
+DROPPED_CALLBACK_MSG = 'Estaba desconectado, vuelve a pulsar el botón ⏳'
+
+
+class BacklogStats():
+    def __init__(self):
+        self.received = 0
+        self.stale = 0
+        self.callbacks = 0
+        self.answered = 0
+        self.coalesced = 0
+        self.queued = 0
+
+    def __str__(self):
+        return (
+            '{} pending updates: {} queued, {} too old, {} old button presses '
+            '({} answered), {} repeated queries'
+        ).format(
+            self.received, self.queued, self.stale, self.callbacks, self.answered,
+            self.coalesced
+        )
+
+
+def route(router, update):
+    '''Handler class, command and arguments of the update, None if not routed'''
+
+    from .handlers.handlers import LazyHandler
+
+    check = router.check_update(update)
+
+    if check and isinstance(check[0], LazyHandler):
+        # Lazy handler, the module is needed to know how to drain its updates
+        check[0].load()
+        check = router.check_update(update)
+
+    return check
+
+def filter_backlog(updates, router, max_age=MAX_AGE, now=None, stats=None,
+                   callback_max_age=CALLBACK_MAX_AGE):
+    '''
+    Returns the updates of the backlog that have to be handled, in order:
+
+    - Updates older than `max_age` are dropped.
+    - Button presses older than `callback_max_age` are dropped, the users
+      gave up waiting for them.
+    - Only the last query of every chat is kept for the handlers whose
+      queries without arguments just show the current state (for example
+      the room members).
+    '''
+
+    # Telegram dates are naive UTC datetimes
+    now = now or datetime.utcnow()
+    stats = stats or BacklogStats()
+
+    kept = []
+    latest = {}
+
+    for update in updates:
+        stats.received += 1
+
+        message = update.effective_message
+
+        if update.callback_query:
+            # Messages sent in inline mode are not included, they are kept
+            if message and message.date and now - message.date > callback_max_age:
+                stats.callbacks += 1
+            else:
+                kept.append(update)
+
+            continue
+
+        if message and message.date and now - message.date > max_age:
+            stats.stale += 1
+            continue
+
+        check = route(router, update)
+
+        if check and not check[2] and getattr(check[0], 'backlog_coalesce', False):
+            key = (message.chat_id, check[1])
+
+            if key in latest:
+                stats.coalesced += 1
+                kept[latest[key]] = None
+
+            latest[key] = len(kept)
+
+        kept.append(update)
+
+    kept = [update for update in kept if update]
+    stats.queued += len(kept)
+
+    return kept
+
+def drain_backlog(updater, router, max_age=MAX_AGE):
+    '''
+    Fetches the pending updates and queues the ones that still have to be
+    handled in the dispatcher. Polling continues after the last one.
+    '''
+
+    bot = updater.bot
+    stats = BacklogStats()
+
+    offset = 0
+    updates = []
+
+    try:
+        # Pending updates cannot be fetched while a webhook is set
+        bot.delete_webhook()
+
+        while True:
+            batch = bot.get_updates(offset, limit=BATCH_SIZE, timeout=0)
+
+            if not batch:
+                break
+
+            updates.extend(batch)
+            offset = batch[-1].update_id + 1
+    except TelegramError as e:
+        logger.warning('Could not fetch the pending updates: %s', e)
+
+    if not updates:
+        return stats
+
+    # Coalesced across batches, a query can be repeated in a later one
+    kept = filter_backlog(updates, router, max_age, stats=stats)
+
+    for update in kept:
+        updater.dispatcher.update_queue.put(update)
+
+    updater.last_update_id = offset
+
+    answer_dropped_callbacks(updates, kept, stats)
+
+    return stats
+
+def answer_dropped_callbacks(updates, kept, stats):
+    '''Answers the dropped button presses, the recent ones still show it'''
+
+    kept_ids = {update.update_id for update in kept}
+
+    for update in updates:
+        if not update.callback_query or update.update_id in kept_ids:
+            continue
+
+        try:
+            update.callback_query.answer(DROPPED_CALLBACK_MSG)
+            stats.answered += 1
+        except TelegramError as e:
+            # Telegram only accepts answers for a while after the press
+            logger.debug('Could not answer a dropped button press: %s', e)
@@ -0,0 +1,75 @@
+'''
+Measures the broadcast throughput against a local fake Bot API.
+
+Usage: python -m bot.benchmarks.broadcast [--chats N] [--latency SECONDS]
+'''
+
+import argparse
+
+from time import monotonic
+
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.utils.request import Request
+
+from .. import ratelimit
+from ..broadcast import Broadcast
+from .fake_api import FakeBotAPI
+
+TOKEN = '1000:benchmark'
+
+
+def create_bot(api, workers):
+    return Bot(TOKEN, base_url=api.base_url, request=Request(con_pool_size=workers + 2))
+
+def run_sequential(bot, chat_ids, text):
+    start = monotonic()
+    sent = 0
+
+    for chat_id in chat_ids:
+        try:
+            bot.send_message(chat_id, text)
+            sent += 1
+        except TelegramError:
+            pass
+
+    return sent, monotonic() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Broadcast benchmark')
+    parser.add_argument('--chats', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=Broadcast.workers)
+    parser.add_argument('--global-rate', type=float, default=ratelimit.GLOBAL_RATE)
+    parser.add_argument('--api-rate', type=float, default=None,
+                        help='simulate flood control above this rate')
+    args = parser.parse_args()
+
+    ratelimit.global_bucket.rate = args.global_rate
+    ratelimit.global_bucket.capacity = args.global_rate
+
+    chat_ids = [-100000 - i for i in range(args.chats)]
+    text = 'Benchmark message'
+
+    with FakeBotAPI(latency=args.latency, rate_limit=args.api_rate) as api:
+        bot = create_bot(api, args.workers)
+
+        sent, elapsed = run_sequential(bot, chat_ids, text)
+        print('Sequential: {}/{} sent in {:.2f}s ({:.1f} msg/s)'.format(
+            sent, len(chat_ids), elapsed, sent / elapsed
+        ))
+
+        api.rejected = 0
+
+        # Every chat just got a message, use new ones for the engine
+        chat_ids = [chat_id - args.chats for chat_id in chat_ids]
+
+        broadcast = Broadcast(bot, chat_ids, text)
+        broadcast.workers = args.workers
+
+        report = broadcast.run()
+        print('Broadcast:  {}'.format(report))
+        print('Flood control errors returned by the API: {}'.format(api.rejected))
+
+if __name__ == '__main__':
+    main()
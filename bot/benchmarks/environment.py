@@ -0,0 +1,115 @@
+import itertools
+import tempfile
+
+from os import environ, path
+from time import time
+
+_ids = itertools.count(1)
+
+
+def setup_django():
+    '''Sets up Django with an empty test database'''
+
+    environ.setdefault('DJANGO_SETTINGS_MODULE', 'website.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+
+    if connection.vendor == 'sqlite':
+        # The shared in-memory database locks its tables when the handler
+        # threads write at the same time, a file handles it properly
+        connection.settings_dict['TEST']['NAME'] = path.join(
+            tempfile.mkdtemp(), 'benchmark.sqlite3'
+        )
+
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+
+    return old_name
+
+def teardown_django(old_name):
+    from django.db import connection
+    from django.test.utils import teardown_test_environment
+
+    connection.creation.destroy_test_db(old_name, verbosity=0)
+    teardown_test_environment()
+
+def create_updater(api, workers=8):
+    '''Creates an updater with all the bot handlers using the fake API'''
+
+    from telegram import Bot
+    from telegram.ext import Updater
+    from telegram.utils.request import Request
+
+    from ..bot import load_handlers
+
+    bot = Bot(
+        '1000:benchmark', base_url=api.base_url,
+        request=Request(con_pool_size=workers + 4)
+    )
+
+    updater = Updater(bot=bot, use_context=True, workers=workers)
+    load_handlers(updater.dispatcher)
+
+    return updater
+
+def telegram_user(user_id):
+    return {
+        'id': user_id,
+        'is_bot': False,
+        'first_name': 'User {}'.format(user_id),
+        'username': 'user{}'.format(user_id),
+    }
+
+def telegram_chat(chat_id, user_id):
+    if chat_id == user_id:
+        return {'id': chat_id, 'type': 'private', 'first_name': 'User {}'.format(user_id)}
+
+    return {'id': chat_id, 'type': 'group', 'title': 'Group {}'.format(chat_id)}
+
+def message_update(text, user_id, chat_id=None):
+    '''Creates the data of an update with a message'''
+
+    chat_id = chat_id or user_id
+
+    message = {
+        'message_id': next(_ids),
+        'date': int(time()),
+        'chat': telegram_chat(chat_id, user_id),
+        'from': telegram_user(user_id),
+        'text': text,
+    }
+
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [
+            {'type': 'bot_command', 'offset': 0, 'length': len(command)}
+        ]
+
+    return {'message': message}
+
+def callback_update(data, user_id, chat_id=None):
+    '''Creates the data of an update with a callback query'''
+
+    chat_id = chat_id or user_id
+
+    return {
+        'callback_query': {
+            'id': str(next(_ids)),
+            'from': telegram_user(user_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': next(_ids),
+                'date': int(time()),
+                'chat': telegram_chat(chat_id, user_id),
+                'from': {'id': 1000, 'is_bot': True, 'first_name': 'DAFI Bot'},
+                'text': 'Message',
+            },
+        }
+    }
@@ -0,0 +1,192 @@
+import json
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import monotonic, sleep, time
+
+from ..ratelimit import TokenBucket
+
+BOT_USER = {
+    'id': 1000,
+    'is_bot': True,
+    'first_name': 'DAFI Bot',
+    'username': 'dafi_bot',
+}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that timed out close the connection before the answer
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class FakeBotAPI():
+    '''
+    Local stand-in for the Telegram Bot API. Answers the methods used by the
+    bot, records every call and can simulate latency and flood control.
+    '''
+
+    def __init__(self, latency=0, rate_limit=None, retry_after=1, port=0):
+        self.latency = latency
+        self.retry_after = retry_after
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+
+        self.calls = []
+        self.rejected = 0
+
+        self._updates = []
+        self._update_id = 0
+        self._message_id = 0
+        self._lock = threading.Lock()
+        self._new_update = threading.Condition(self._lock)
+        self._listeners = []
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+
+                try:
+                    params = json.loads(body.decode()) if body else {}
+                except ValueError:
+                    params = {}
+
+                method = self.path.rstrip('/').rsplit('/', 1)[-1]
+                status, data = api.handle(method, params)
+
+                payload = json.dumps(data).encode()
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        '''URL to use as the `base_url` of a `telegram.Bot`'''
+
+        return 'http://127.0.0.1:{}/bot'.format(self.server.server_address[1])
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def add_listener(self, listener):
+        '''Calls `listener(method, params)` after every answered call'''
+
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def add_update(self, update):
+        '''Queues an update to be returned by getUpdates'''
+
+        with self._lock:
+            self._update_id += 1
+            update = dict(update, update_id=self._update_id)
+            self._updates.append(update)
+            self._new_update.notify_all()
+
+        return update
+
+    def count(self, method):
+        return sum(1 for m, _, _ in self.calls if m == method)
+
+    def _message(self, params):
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+
+        chat_id = params.get('chat_id', 0)
+
+        return {
+            'message_id': message_id,
+            'date': int(time()),
+            'chat': {
+                'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0,
+                'type': 'group' if str(chat_id).startswith('-') else 'private',
+            },
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        deadline = monotonic() + timeout
+
+        with self._lock:
+            self._updates = [u for u in self._updates if u['update_id'] >= offset]
+
+            while not self._updates and monotonic() < deadline:
+                self._new_update.wait(deadline - monotonic())
+
+            return self._updates[:limit]
+
+    def handle(self, method, params):
+        if self.latency:
+            sleep(self.latency)
+
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': self._get_updates(params)}
+
+        if self.bucket and self.bucket.consume():
+            with self._lock:
+                self.rejected += 1
+
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests: retry after {}'.format(self.retry_after),
+                'parameters': {'retry_after': self.retry_after},
+            }
+
+        if method in ('sendMessage', 'editMessageText'):
+            result = self._message(params)
+        elif method == 'getMe':
+            result = BOT_USER
+        elif method == 'getChat':
+            result = {'id': int(params.get('chat_id', 0)), 'type': 'group'}
+        elif method == 'getChatMember':
+            result = {'user': BOT_USER, 'status': 'administrator'}
+        elif method == 'exportChatInviteLink':
+            result = 'https://t.me/joinchat/fake'
+        else:
+            result = True
+
+        with self._lock:
+            self.calls.append((method, params, monotonic()))
+
+        for listener in self._listeners:
+            listener(method, params)
+
+        return 200, {'ok': True, 'result': result}
@@ -0,0 +1,157 @@
+'''
+Measures the end-to-end latency of the bot (from an update being sent until
+the bot answers it) using polling and webhook modes against a fake Bot API.
+
+Usage: python -m bot.benchmarks.latency [--updates N] [--file UPDATES.json] [--mode MODE]
+
+The file must contain a JSON list of recorded updates. If it is not given,
+synthetic /dafi commands and button presses are used.
+'''
+
+import argparse
+import json
+import socket
+import threading
+import urllib.request
+
+from time import monotonic
+
+from .environment import (
+    callback_update, create_updater, message_update, setup_django, teardown_django
+)
+from .fake_api import FakeBotAPI
+
+# Methods called by the bot that are not an answer to an update
+IGNORED_METHODS = ('getUpdates', 'getMe', 'setWebhook', 'deleteWebhook')
+
+
+def synthetic_updates(count):
+    updates = []
+
+    for i in range(count):
+        user_id = 5000 + i
+
+        if i % 2:
+            updates.append(callback_update('main:okey', user_id))
+        else:
+            updates.append(message_update('/dafi', user_id))
+
+    return updates
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for_port(port, timeout=5):
+    deadline = monotonic() + timeout
+
+    while monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            return
+        except OSError:
+            pass
+
+    raise Exception('Webhook server did not start')
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def measure(api, mode, updates, timeout=5):
+    from ..bot import start_webhook
+
+    answered = threading.Event()
+
+    def listener(method, params):
+        if method not in IGNORED_METHODS:
+            answered.set()
+
+    api.add_listener(listener)
+
+    updater = create_updater(api)
+
+    if mode == 'webhook':
+        port = free_port()
+        url = 'http://127.0.0.1:{}'.format(port)
+        start_webhook(updater, url, 'benchmark', '127.0.0.1', port)
+        wait_for_port(port)
+
+        def send(update):
+            update = dict(update, update_id=0)
+
+            request = urllib.request.Request(
+                '{}/benchmark'.format(url), json.dumps(update).encode(),
+                {'Content-Type': 'application/json'}
+            )
+
+            urllib.request.urlopen(request).read()
+    else:
+        updater.start_polling(poll_interval=0, timeout=2)
+        send = api.add_update
+
+    latencies = []
+    lost = 0
+
+    try:
+        for update in updates:
+            answered.clear()
+            start = monotonic()
+
+            send(update)
+
+            if answered.wait(timeout):
+                latencies.append(monotonic() - start)
+            else:
+                lost += 1
+    finally:
+        updater.stop()
+        api.remove_listener(listener)
+
+    return latencies, lost
+
+def main():
+    parser = argparse.ArgumentParser(description='Polling vs webhook latency benchmark')
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--file', help='JSON file with recorded updates')
+    parser.add_argument('--mode', choices=('polling', 'webhook', 'both'), default='both')
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file) as f:
+            updates = json.load(f)
+    else:
+        updates = synthetic_updates(args.updates)
+
+    modes = ('polling', 'webhook') if args.mode == 'both' else (args.mode,)
+
+    old_name = setup_django()
+
+    from .. import persistence, workers
+    from ..persistence import DatabaseBackend
+
+    persistence.load(DatabaseBackend())
+    workers.start_executor(8, 200)
+
+    try:
+        with FakeBotAPI() as api:
+            for mode in modes:
+                latencies, lost = measure(api, mode, updates)
+
+                if not latencies:
+                    print('{}: no update was answered'.format(mode))
+                    continue
+
+                print('{:8} {} answered, {} lost: mean {:.1f}ms, p50 {:.1f}ms, p99 {:.1f}ms'.format(
+                    mode, len(latencies), lost,
+                    1000 * sum(latencies) / len(latencies),
+                    1000 * percentile(latencies, 0.5),
+                    1000 * percentile(latencies, 0.99),
+                ))
+    finally:
+        workers.stop_executor()
+        teardown_django(old_name)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+'''
+Compares building a user list message by string concatenation (as it was
+done before the message builder) with the chunked message builder.
+
+Usage: python -m bot.benchmarks.messages [--users N] [--repeat N]
+'''
+
+import argparse
+
+from timeit import default_timer
+
+from ..utils import MAX_MESSAGE_LENGTH, create_users_messages
+
+
+class StubUser():
+    def __init__(self, i):
+        self.first_name = 'Usuario_{}'.format(i)
+        self.last_name = 'Apellido *{}*'.format(i)
+        self.telegram_id = 100000 + i
+
+    def get_full_name(self):
+        return '{} {}'.format(self.first_name, self.last_name)
+
+
+def concatenated_users_list(users):
+    msg = ''
+
+    for user in users:
+        msg += '\n[{}](tg://user?id={})'.format(
+            user.get_full_name(), user.telegram_id
+        )
+
+    return msg
+
+def measure(func, repeat):
+    best = None
+
+    for _ in range(repeat):
+        start = default_timer()
+        result = func()
+        elapsed = default_timer() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='User list message benchmark')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    users = [StubUser(i) for i in range(args.users)]
+    header = '*Usuarios en el grupo benchmark*:\n'
+
+    concat_time, msg = measure(lambda: header + concatenated_users_list(users), args.repeat)
+    builder_time, chunks = measure(lambda: create_users_messages(users, header), args.repeat)
+
+    longest = max(len(chunk) for chunk in chunks)
+
+    print('{} users, best of {}'.format(args.users, args.repeat))
+    print('concatenation: {:8.2f}ms, 1 message of {} characters{}'.format(
+        1000 * concat_time, len(msg),
+        ' (rejected by Telegram)' if len(msg) > MAX_MESSAGE_LENGTH else ''
+    ))
+    print('builder:       {:8.2f}ms, {} messages of up to {} characters'.format(
+        1000 * builder_time, len(chunks), longest
+    ))
+
+if __name__ == '__main__':
+    main()
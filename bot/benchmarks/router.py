@@ -0,0 +1,113 @@
+'''
+Compares the cost of finding the handler of an update with the router and
+with one python-telegram-bot handler per command and callback prefix.
+
+Usage: python -m bot.benchmarks.router [--updates N]
+'''
+
+import argparse
+import random
+
+from os import environ
+from timeit import default_timer
+
+from .environment import callback_update, message_update
+
+SIZES = (10, 50, 200, 1000)
+
+
+class StubBot():
+    username = 'dafi_bot'
+
+
+def create_classes(count):
+    from ..handlers.handlers import BasicBotHandler
+
+    return [
+        type('Handler{}'.format(i), (BasicBotHandler,), {
+            'cmd': 'cmd{}'.format(i),
+            'query_prefix': 'prefix{}'.format(i),
+        })
+        for i in range(count)
+    ]
+
+def create_linear_handlers(classes):
+    '''Handlers as registered before the router: checked one by one'''
+
+    from telegram.ext import CallbackQueryHandler, CommandHandler
+
+    handlers = []
+
+    for cls in classes:
+        handlers.append(CommandHandler(cls.cmd, lambda u, c: None))
+        handlers.append(CallbackQueryHandler(lambda u, c: None, pattern=cls.query_prefix))
+
+    return handlers
+
+def find_linear(handlers, update):
+    for handler in handlers:
+        check = handler.check_update(update)
+
+        if check is not None and check is not False:
+            return handler
+
+def create_updates(count, size):
+    from telegram import Update
+
+    bot = StubBot()
+    updates = []
+
+    for i in range(count):
+        n = random.randrange(size)
+
+        if i % 2:
+            data = callback_update('prefix{}:action:1'.format(n), 1)
+        else:
+            data = message_update('/cmd{} arg'.format(n), 1)
+
+        updates.append(Update.de_json(dict(data, update_id=i), bot))
+
+    return updates
+
+def measure(func, updates):
+    start = default_timer()
+
+    for update in updates:
+        func(update)
+
+    return (default_timer() - start) / len(updates)
+
+def main():
+    parser = argparse.ArgumentParser(description='Update routing benchmark')
+    parser.add_argument('--updates', type=int, default=5000)
+    args = parser.parse_args()
+
+    environ.setdefault('DJANGO_SETTINGS_MODULE', 'website.settings')
+
+    import django
+    django.setup()
+
+    from ..handlers.handlers import HandlerRouter
+
+    print('{:>9} {:>14} {:>14}'.format('handlers', 'router (us)', 'linear (us)'))
+
+    for size in SIZES:
+        classes = create_classes(size)
+        updates = create_updates(args.updates, size)
+
+        router = HandlerRouter()
+
+        for cls in classes:
+            router.add(cls)
+
+        linear = create_linear_handlers(classes)
+
+        router_time = measure(router.check_update, updates)
+        linear_time = measure(lambda u: find_linear(linear, u), updates)
+
+        print('{:>9} {:>14.2f} {:>14.2f}'.format(
+            size, router_time * 1e6, linear_time * 1e6
+        ))
+
+if __name__ == '__main__':
+    main()
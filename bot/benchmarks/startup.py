@@ -0,0 +1,112 @@
+'''
+Measures the time the bot process takes since it is started until it answers
+its first update, with the handler modules loaded lazily and eagerly.
+
+Usage: python -m bot.benchmarks.startup [--repeat N] [--mode lazy|eager ...]
+
+The bot runs in a subprocess against a local fake Bot API and a temporary
+SQLite database, so the import time of all its modules is included.
+'''
+
+import argparse
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+
+from os import environ, path
+from time import monotonic
+
+from .environment import message_update
+from .fake_api import FakeBotAPI
+
+USER_ID = 10000
+
+MODES = {
+    'lazy': '1',
+    'eager': '0',
+}
+
+
+def get_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def create_database():
+    '''Creates a migrated SQLite database, returns its URL'''
+
+    db_url = 'sqlite:///' + path.join(tempfile.mkdtemp(), 'startup.sqlite3')
+
+    subprocess.run(
+        [sys.executable, 'manage.py', 'migrate', '-v', '0'],
+        env=dict(environ, DB_URL=db_url), check=True
+    )
+
+    return db_url
+
+def measure_startup(db_url, lazy=True, timeout=30):
+    '''
+    Starts the bot and returns the seconds until it answers the first update,
+    None if it does not answer before `timeout`.
+    '''
+
+    answered = threading.Event()
+
+    def listener(method, params):
+        if method == 'sendMessage' and str(params.get('chat_id')) == str(USER_ID):
+            answered.set()
+
+    with FakeBotAPI() as api:
+        api.add_listener(listener)
+        api.add_update(message_update('/dafi', USER_ID))
+
+        env = dict(
+            environ,
+            BOT_TOKEN='1000:benchmark',
+            BOT_API_URL=api.base_url,
+            BOT_LAZY_HANDLERS=MODES['lazy' if lazy else 'eager'],
+            BOT_OUTBOX_PORT=str(get_free_port()),
+            DB_URL=db_url,
+        )
+
+        start = monotonic()
+
+        process = subprocess.Popen(
+            [sys.executable, '-W', 'ignore', '-m', 'bot.bot'],
+            env=env, stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+
+        try:
+            elapsed = monotonic() - start if answered.wait(timeout) else None
+        finally:
+            # The database is thrown away, so there is nothing to save
+            process.terminate()
+            process.wait()
+            process.stdin.close()
+
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot startup benchmark')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--mode', nargs='+', choices=sorted(MODES), default=sorted(MODES))
+    args = parser.parse_args()
+
+    db_url = create_database()
+
+    print('{:6} {:>12} {:>12}'.format('mode', 'best (ms)', 'worst (ms)'))
+
+    for mode in args.mode:
+        times = [measure_startup(db_url, mode == 'lazy') for _ in range(args.repeat)]
+
+        if None in times:
+            print('{:6} {:>12} {:>12}'.format(mode, '-', 'timeout'))
+            continue
+
+        print('{:6} {:>12.1f} {:>12.1f}'.format(mode, 1000 * min(times), 1000 * max(times)))
+
+if __name__ == '__main__':
+    main()
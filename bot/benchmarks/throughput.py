@@ -0,0 +1,360 @@
+'''
+Replays synthetic update streams through the real updater and handlers
+against a fake Bot API and measures the throughput of the bot, the latency
+of the answers and the database queries run per update.
+
+Usage: python -m bot.benchmarks.throughput [--updates N] [--scenario NAME ...]
+       [--rate UPDATES_PER_SECOND] [--latency SECONDS] [--output FILE.json]
+       [--compare OLD.json]
+
+The updates are sent all at once unless a rate is given. An update is
+answered when the bot sends or edits a message in the chat of the update.
+'''
+
+import argparse
+import itertools
+import json
+import platform
+import threading
+
+from collections import OrderedDict
+from datetime import datetime
+from time import monotonic, sleep
+
+from ..broadcast import stop_fan_out
+from .environment import (
+    callback_update, create_updater, message_update, setup_django, teardown_django
+)
+from .fake_api import FakeBotAPI
+from .latency import percentile
+
+# Telegram IDs of the users sending the updates, one private chat per update
+FIRST_USER_ID = 10000
+
+# Telegram ID of the user that requests to be a delegate in the elections
+CANDIDATE_ID = 9000
+
+# Users that receive the group broadcasts
+RECIPIENTS = 20
+
+MAIN_GROUP_ID = -100
+
+ANSWER_METHODS = ('sendMessage', 'editMessageText')
+
+
+def dafi_update(i, user_id):
+    return message_update(('/dafi', '/dafi on', '/dafi off')[i % 3], user_id)
+
+def callbacks_update(i, user_id):
+    data = ('main:okey', 'dafi:notify:{}'.format(user_id), 'dafi:omw')[i % 3]
+    return callback_update(data, user_id)
+
+def groups_update(i, user_id):
+    return message_update('/grupos', user_id)
+
+def election_request(n):
+    '''Query of the n-th request of the recipients, the first 160 are all different'''
+
+    candidate = CANDIDATE_ID + n % RECIPIENTS
+    year = 1 + n // RECIPIENTS % 4
+    is_delegate = n // (RECIPIENTS * 4) % 2
+
+    return '{}:{}.1:{}'.format(candidate, year, is_delegate)
+
+def elections_update(i, user_id):
+    if i % 2:
+        # Every answer is for a different request, an answered one is not applied again
+        action = ('deny', 'request')[i // 2 % 2]
+        data = 'elections:{}:{}'.format(action, election_request(i // 2))
+        return callback_update(data, user_id)
+
+    return message_update('/soydelegado 1.1', user_id)
+
+def broadcast_update(i, user_id):
+    # Every recipient gets every broadcast at most once per second, so only
+    # some of the updates are broadcasts and the rest are group lookups
+    if i % 20:
+        return message_update('/veracceso alumnos', user_id)
+
+    return message_update('/broadcastgrupo alumnos Hola {}'.format(i), user_id)
+
+SCENARIOS = {
+    'dafi': dafi_update,
+    'callbacks': callbacks_update,
+    'grupos': groups_update,
+    'elections': elections_update,
+    'broadcast': broadcast_update,
+}
+
+def mixed_update(i, user_id):
+    scenarios = sorted(SCENARIOS)
+    return SCENARIOS[scenarios[i % len(scenarios)]](i // len(scenarios), user_id)
+
+SCENARIOS['mixed'] = mixed_update
+
+
+class QueryCounter():
+    '''Counts the queries run by every database connection'''
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = monotonic()
+
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = monotonic() - start
+
+            with self._lock:
+                self.count += 1
+                self.time += elapsed
+
+    def install(self):
+        from django.db import connections
+        from django.db.backends.signals import connection_created
+
+        # Connections opened later by the handler threads
+        connection_created.connect(self._connection_created, weak=False)
+
+        for connection in connections.all():
+            connection.execute_wrappers.append(self)
+
+    def _connection_created(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.time = 0
+
+
+def create_fixtures(updates):
+    '''Creates the users, groups and configuration used by the scenarios'''
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group, Permission
+
+    from heart.models import Group as StudentsGroup
+    from main.models import Config
+
+    User = get_user_model()
+
+    managers = Group.objects.create(name='gestores')
+    managers.permissions.set(Permission.objects.filter(content_type__app_label='bot'))
+
+    User.objects.bulk_create(
+        User(username='user{}'.format(i), first_name='User {}'.format(i), telegram_id=i)
+        for i in range(FIRST_USER_ID, FIRST_USER_ID + updates)
+    )
+
+    managers.user_set.set(User.objects.filter(telegram_id__gte=FIRST_USER_ID))
+
+    User.objects.bulk_create(
+        User(username='recipient{}'.format(i), telegram_id=i)
+        for i in range(CANDIDATE_ID, CANDIDATE_ID + RECIPIENTS)
+    )
+
+    students = Group.objects.create(name='alumnos')
+    students.user_set.set(User.objects.filter(telegram_id__lt=FIRST_USER_ID))
+
+    StudentsGroup.objects.bulk_create(
+        StudentsGroup(
+            name='Grupo {}.{}'.format(year, number), year=year, number=number,
+            subgroups=2, telegram_group_link='https://t.me/joinchat/{}{}'.format(year, number)
+        )
+        for year, number in itertools.product(range(1, 5), range(1, 8))
+    )
+
+    Config.objects.create(key=Config.MAIN_GROUP_ID, value=str(MAIN_GROUP_ID), name='Grupo')
+
+def reset_state(count):
+    from .. import persistence
+    from ..handlers.elections import ELECTIONS_KEY, ELECTIONS_PENDING_KEY
+
+    persistence.flush()
+    persistence.set_item(ELECTIONS_KEY, True)
+    persistence.set_item(ELECTIONS_PENDING_KEY, OrderedDict(
+        (election_request(n), None) for n in range(count)
+    ))
+
+def run_scenario(api, queries, create_update, count, rate=None, timeout=10):
+    '''Replays the updates and returns the results of the scenario'''
+
+    updates = [create_update(i, FIRST_USER_ID + i) for i in range(count)]
+
+    sent = {}
+    answered = {}
+    last_answer = [None]
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def listener(method, params):
+        if method not in ANSWER_METHODS:
+            return
+
+        try:
+            chat_id = int(params.get('chat_id'))
+        except (TypeError, ValueError):
+            return
+
+        now = monotonic()
+
+        with lock:
+            if chat_id in sent and chat_id not in answered:
+                answered[chat_id] = now - sent[chat_id]
+                last_answer[0] = now
+
+                if len(answered) == count:
+                    finished.set()
+
+    reset_state(count)
+
+    api.add_listener(listener)
+    api_calls = len(api.calls)
+
+    updater = create_updater(api)
+    updater.start_polling(poll_interval=0, timeout=2)
+
+    queries.reset()
+    start = monotonic()
+
+    try:
+        for i, update in enumerate(updates):
+            if rate:
+                delay = start + i / rate - monotonic()
+
+                if delay > 0:
+                    sleep(delay)
+
+            with lock:
+                sent[FIRST_USER_ID + i] = monotonic()
+
+            api.add_update(update)
+
+        finished.wait(timeout)
+        elapsed = (last_answer[0] or monotonic()) - start
+    finally:
+        updater.stop()
+
+        # Background deliveries started by the handlers
+        stop_fan_out()
+
+        api.remove_listener(listener)
+
+    latencies = list(answered.values())
+    query_count = queries.count
+
+    return {
+        'updates': count,
+        'answered': len(latencies),
+        'lost': count - len(latencies),
+        'elapsed': elapsed,
+        'updates_per_second': len(latencies) / elapsed if elapsed else 0,
+        'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+        'latency_p50': percentile(latencies, 0.5) if latencies else None,
+        'latency_p99': percentile(latencies, 0.99) if latencies else None,
+        'queries': query_count,
+        'queries_per_update': query_count / count,
+        'query_time': queries.time,
+        'api_calls_per_update': (len(api.calls) - api_calls) / count,
+    }
+
+def format_ms(value):
+    return '{:.1f}'.format(1000 * value) if value is not None else '-'
+
+def print_results(results, previous=None):
+    print('{:10} {:>9} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+        'scenario', 'answered', 'lost', 'upd/s', 'p50 (ms)', 'p99 (ms)', 'queries'
+    ))
+
+    for name, result in results.items():
+        print('{:10} {:>9} {:>6} {:>9.1f} {:>9} {:>9} {:>9.1f}'.format(
+            name, result['answered'], result['lost'], result['updates_per_second'],
+            format_ms(result['latency_p50']), format_ms(result['latency_p99']),
+            result['queries_per_update'],
+        ))
+
+        old = (previous or {}).get(name)
+
+        if old:
+            print('{:10} {:>9} {:>6} {:>+9.1f} {:>9} {:>9} {:>+9.1f}'.format(
+                '  (diff)', '', '',
+                result['updates_per_second'] - old['updates_per_second'],
+                format_ms(
+                    result['latency_p50'] - old['latency_p50']
+                    if result['latency_p50'] is not None and old['latency_p50'] is not None else None
+                ),
+                format_ms(
+                    result['latency_p99'] - old['latency_p99']
+                    if result['latency_p99'] is not None and old['latency_p99'] is not None else None
+                ),
+                result['queries_per_update'] - old['queries_per_update'],
+            ))
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end bot throughput benchmark')
+    parser.add_argument('--updates', type=int, default=300, help='updates per scenario')
+    parser.add_argument('--scenario', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--rate', type=float, help='updates per second (default: all at once)')
+    parser.add_argument('--latency', type=float, default=0, help='latency of the fake API')
+    parser.add_argument('--workers', type=int, default=8, help='handler workers')
+    parser.add_argument('--output', help='JSON file to save the results')
+    parser.add_argument('--compare', help='JSON file with the results of a previous run')
+    args = parser.parse_args()
+
+    previous = None
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+
+    old_name = setup_django()
+
+    from .. import persistence, workers
+    from ..persistence import DatabaseBackend
+
+    create_fixtures(args.updates)
+
+    queries = QueryCounter()
+    queries.install()
+
+    persistence.load(DatabaseBackend())
+    workers.start_executor(args.workers, max(200, args.updates))
+
+    results = {}
+
+    try:
+        with FakeBotAPI(latency=args.latency) as api:
+            for name in args.scenario:
+                results[name] = run_scenario(
+                    api, queries, SCENARIOS[name], args.updates, args.rate
+                )
+    finally:
+        workers.stop_executor()
+        teardown_django(old_name)
+
+    print_results(results, previous)
+
+    if args.output:
+        import telegram
+        import django
+
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'python-telegram-bot': telegram.__version__,
+                'options': vars(args),
+                'results': results,
+            }, f, indent=2)
+
+        print('Results saved to', args.output)
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,60 @@
 import logging
-import schedule
 
+from hashlib import sha256
 from importlib import import_module
 from os import environ, getenv
 
 from django import setup as django_setup
 
+from telegram import Bot
 from telegram.ext import Updater, CommandHandler
 
-from .jobs import SchedulerThread, load_jobs
+from . import metrics
+from .api import ProtectedRequest
+from .backlog import drain_backlog
+from .broadcast import stop_fan_out
+from .jobs import load_jobs, start_scheduler, stop_scheduler
+from .outbox import start_outbox, stop_outbox
+from .startup import start_profile
+from .workers import start_executor, stop_executor
 
 from .cli import BotCLI
 
+def load_handlers(dispatcher, lazy=False):
+    '''
+    Adds all the bot handlers to the dispatcher. If `lazy`, the handler
+    modules are routed from the manifest and imported on their first update.
+    '''
+
+    from . import handlers
+
+    if lazy:
+        handlers.load_manifest()
+    else:
+        handlers.load_modules()
+
+    for group, handler in handlers.get_handlers():
+        dispatcher.add_handler(handler, group)
+
+def start_webhook(updater, url, secret=None, listen=None, port=None):
+    '''
+    Starts a local HTTP server that receives the updates sent by Telegram
+    to `url`/`secret` and puts them in the dispatcher queue.
+    '''
+
+    if not secret:
+        secret = sha256(updater.bot.token.encode()).hexdigest()
+
+    updater.start_webhook(
+        listen=listen or '127.0.0.1',
+        port=port or 8443,
+        url_path=secret,
+        webhook_url='{}/{}'.format(url.rstrip('/'), secret)
+    )
+
 def main():
+    profile = start_profile()
+
     logging.basicConfig(
         format='%(asctime)s - %(levelname)s - %(message)s',
         level=logging.WARNING
@@ -22,44 +64,122 @@ def main():
 
     print('Setting up Django...')
 
-    django_setup()
+    with profile.step('django setup'):
+        django_setup()
 
     token = getenv('BOT_TOKEN')
 
     if not token:
         raise Exception('Bot token not found')
 
-    updater = Updater(token=token, use_context=True)
+    mode = getenv('BOT_MODE', 'polling')
+    webhook_url = getenv('BOT_WEBHOOK_URL')
+
+    if mode == 'webhook' and not webhook_url:
+        raise Exception('Webhook URL not found')
+
+    workers = int(getenv('BOT_WORKERS', 8))
+    # Importing the handlers on first use did not start the bot any sooner
+    # (see bot.benchmarks.startup), so it is only done when asked for
+    lazy = getenv('BOT_LAZY_HANDLERS', '0') == '1'
+
+    with profile.step('updater'):
+        metrics.install()
+
+        # Handler workers, background deliveries and the updater share the pool
+        bot = Bot(
+            token, base_url=getenv('BOT_API_URL') or None,
+            request=ProtectedRequest(con_pool_size=workers + 8)
+        )
+        updater = Updater(bot=bot, use_context=True)
+
+    print('Starting handler workers...')
+
+    with profile.step('handler workers'):
+        start_executor(workers, int(getenv('BOT_QUEUE_SIZE', 200)))
+
+    metrics_port = getenv('BOT_METRICS_PORT')
+
+    if metrics_port:
+        print('Starting metrics exporter...')
+        metrics.start_exporter(int(metrics_port))
 
     print('Loading handlers...')
 
-    from . import handlers, persistence
+    with profile.step('handlers (lazy)' if lazy else 'handlers'):
+        from main.models import Config
+
+        from . import handlers, persistence
 
-    for handler in handlers.get_handlers():
-        updater.dispatcher.add_handler(handler)
+        load_handlers(updater.dispatcher, lazy)
 
     print('Loading persistent data...')
-    persistence.load()
+
+    with profile.step('persistent data'):
+        persistence.load()
+
+    print('Loading configuration...')
+
+    with profile.step('configuration'):
+        Config.preload()
+
+    with profile.step('start updates'):
+        if mode == 'webhook':
+            print('Starting webhook...')
+            start_webhook(
+                updater, webhook_url, getenv('BOT_WEBHOOK_SECRET'),
+                getenv('BOT_WEBHOOK_LISTEN'), int(getenv('BOT_WEBHOOK_PORT', 8443))
+            )
+        else:
+            if getenv('BOT_DRAIN_BACKLOG', '1') != '0':
+                print('Draining pending updates...')
+                print(drain_backlog(updater, handlers.get_router()))
+
+            print('Starting polling...')
+            updater.start_polling()
+
+    profile.set_ready()
+
+    # The rest of the modules are imported once the bot is already receiving
+    # updates, their jobs are registered when they are imported
+    with profile.step('handler modules'):
+        handlers.load_modules()
 
     print('Loading scheduled jobs...')
-    load_jobs(updater.bot)
+
+    with profile.step('scheduled jobs'):
+        load_jobs(updater.bot)
 
     print('Starting scheduler thread...')
-    thread = SchedulerThread()
-    thread.start()
+    start_scheduler()
+
+    print('Starting outbox sender...')
+    start_outbox(updater.bot)
+
+    print('Bot ready in {:.2f}s'.format(profile.ready))
 
-    print('Starting polling...')
-    updater.start_polling()
+    if getenv('BOT_PROFILE_STARTUP'):
+        print(profile)
 
     BotCLI().cmdloop()
 
     print('Stopping scheduler thread...')
-    thread.stopper.set()
-    thread.join()
+    stop_scheduler()
 
-    print('Stopping polling...')
+    print('Stopping updates...')
     updater.stop()
 
+    print('Stopping handler workers...')
+    stop_executor()
+
+    print('Waiting for pending notifications...')
+    stop_fan_out()
+
+    print('Stopping outbox sender...')
+    stop_outbox()
+
+    metrics.stop_exporter()
+
     print('Saving persistent data...')
     persistence.close()
 
@@ -0,0 +1,227 @@
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+from telegram.error import BadRequest, ChatMigrated, NetworkError, RetryAfter, TelegramError, Unauthorized
+
+from .api import CircuitOpen
+from .ratelimit import chat_bucket, global_bucket
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryReport():
+    '''Result of a message delivery to many chats'''
+
+    def __init__(self, total):
+        self.total = total
+
+        self.sent = []
+        self.failed = {}
+        self.migrated = {}
+        self.retries = 0
+
+        self.started = monotonic()
+        self.finished = None
+
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return len(self.sent) + len(self.failed)
+
+    @property
+    def elapsed(self):
+        return (self.finished or monotonic()) - self.started
+
+    @property
+    def rate(self):
+        '''Delivered messages per second'''
+
+        elapsed = self.elapsed
+        return len(self.sent) / elapsed if elapsed else 0
+
+    def add_sent(self, chat_id):
+        with self._lock:
+            self.sent.append(chat_id)
+
+    def add_failed(self, chat_id, error):
+        with self._lock:
+            self.failed[chat_id] = str(error)
+
+    def add_migrated(self, chat_id, new_chat_id):
+        with self._lock:
+            self.migrated[chat_id] = new_chat_id
+
+    def add_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def __str__(self):
+        return '{}/{} sent, {} failed, {} retries in {:.2f}s ({:.1f} msg/s)'.format(
+            len(self.sent), self.total, len(self.failed),
+            self.retries, self.elapsed, self.rate
+        )
+
+
+class Broadcast():
+    '''
+    Sends a message to many chats concurrently, keeping under the Telegram
+    rate limits and honouring the flood control errors.
+    '''
+
+    workers = 8
+    max_retries = 3
+    backoff = 1
+
+    progress_interval = 5
+
+    def __init__(self, bot, chat_ids, text, parse_mode=None, progress=None, **kwargs):
+        self.bot = bot
+        self.chat_ids = list(chat_ids)
+        self.text = text
+        self.parse_mode = parse_mode
+        self.kwargs = kwargs
+
+        self.progress = progress
+        self.report = DeliveryReport(len(self.chat_ids))
+
+        self._last_progress = 0
+        self._progress_lock = threading.Lock()
+
+    def send(self, chat_id):
+        return self.bot.send_message(
+            chat_id, self.text, self.parse_mode, **self.kwargs
+        )
+
+    def deliver(self, chat_id):
+        '''Delivers the message to a single chat, retrying when possible'''
+
+        original_id = chat_id
+        error = None
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.report.add_retry()
+
+            global_bucket.acquire()
+            chat_bucket(chat_id).acquire()
+
+            try:
+                self.send(chat_id)
+                self.report.add_sent(original_id)
+                break
+            except RetryAfter as e:
+                # Flood control is global, so every sender has to wait
+                global_bucket.pause(e.retry_after)
+                error = e
+            except ChatMigrated as e:
+                chat_id = e.new_chat_id
+                self.report.add_migrated(original_id, chat_id)
+                error = e
+            except CircuitOpen as e:
+                # The API is failing, wait until the next call is allowed
+                error = e
+                sleep(e.retry_after)
+            except (BadRequest, Unauthorized) as e:
+                error = e
+                self.report.add_failed(original_id, e)
+                break
+            except NetworkError as e:
+                error = e
+                sleep(self.backoff * 2 ** attempt)
+            except TelegramError as e:
+                error = e
+                self.report.add_failed(original_id, e)
+                break
+        else:
+            logger.warning('Could not deliver message to %s: %s', original_id, error)
+            self.report.add_failed(original_id, error)
+
+        self.notify_progress()
+
+    def notify_progress(self, force=False):
+        if not self.progress:
+            return
+
+        with self._progress_lock:
+            now = monotonic()
+
+            if not force and now - self._last_progress < self.progress_interval:
+                return
+
+            self._last_progress = now
+
+        try:
+            self.progress(self.report)
+        except TelegramError:
+            # Progress is just informative, never stop the delivery for it
+            pass
+
+    def run(self):
+        '''Delivers the message to all the chats and returns the report'''
+
+        self._last_progress = monotonic()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            for _ in executor.map(self.deliver, self.chat_ids):
+                pass
+
+        self.report.finished = monotonic()
+        self.notify_progress(force=True)
+
+        return self.report
+
+
+_fan_out_executor = None
+_fan_out_lock = threading.Lock()
+
+# Broadcasts delivered at the same time, each one uses its own workers
+FAN_OUT_WORKERS = 2
+
+
+def _run_fan_out(broadcast, done):
+    report = broadcast.run()
+
+    if report.failed:
+        logger.info('Fan-out finished with failures: %s', report)
+
+    if done:
+        try:
+            done(report)
+        except Exception:
+            logger.exception('Error in fan-out callback')
+
+    return report
+
+def fan_out(bot, chat_ids, text, parse_mode=None, done=None, **kwargs):
+    '''
+    Delivers a message to many chats in the background and returns right
+    away. `done` is called with the delivery report once it has finished.
+    Returns a future with the report.
+    '''
+
+    global _fan_out_executor
+
+    broadcast = Broadcast(bot, chat_ids, text, parse_mode, **kwargs)
+
+    with _fan_out_lock:
+        if not _fan_out_executor:
+            _fan_out_executor = ThreadPoolExecutor(
+                FAN_OUT_WORKERS, thread_name_prefix='fan-out'
+            )
+
+        return _fan_out_executor.submit(_run_fan_out, broadcast, done)
+
+def stop_fan_out():
+    '''Waits for the pending fan-out deliveries to finish'''
+
+    global _fan_out_executor
+
+    with _fan_out_lock:
+        executor, _fan_out_executor = _fan_out_executor, None
+
+    if executor:
+        executor.shutdown(wait=True)
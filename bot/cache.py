@@ -0,0 +1,102 @@
+import threading
+
+from collections import OrderedDict
+from time import monotonic
+
+_caches = []
+
+
+class TTLCache():
+    '''Thread safe dictionary whose entries expire, evicting the least recently used'''
+
+    def __init__(self, name, ttl=300, maxsize=1024):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+        _caches.append(self)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return bool(entry) and entry[1] > monotonic()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry and entry[1] > monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            if entry:
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def get_or_set(self, key, loader, ttl=None):
+        '''Gets a value, loading and storing it with `loader()` if needed'''
+
+        sentinel = object()
+        value = self.get(key, sentinel)
+
+        if value is sentinel:
+            value = loader()
+            self.set(key, value, ttl)
+
+        return value
+
+    def set(self, key, value, ttl=None):
+        expires = monotonic() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_if(self, predicate):
+        '''Removes the entries for which `predicate(key, value)` is true'''
+
+        with self._lock:
+            keys = [k for k, (v, _) in self._data.items() if predicate(k, v)]
+
+            for key in keys:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def __str__(self):
+        return '{}: {}/{} entries, {} hits, {} misses ({:.1%}), {} evictions'.format(
+            self.name, len(self), self.maxsize, self.hits, self.misses,
+            self.hit_rate, self.evictions
+        )
+
+
+def get_caches():
+    return _caches
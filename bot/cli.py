@@ -1,14 +1,28 @@
-import schedule
-
 from cmd import Cmd
 
-from . import persistence
+from . import metrics, persistence
+from .api import get_breaker
+from .cache import get_caches
+from .jobs import get_jobs
+from .outbox import get_outbox
+from .startup import get_profile
+from .workers import get_executor
+
+
+def format_bound(seconds):
+    return '>10000' if seconds == float('inf') else '<{:g}'.format(1000 * seconds)
 
 
 class BotCLI(Cmd):
     intro = 'Bot started! Type exit to stop the bot.'
     prompt = 'bot> '
 
+    def do_cache(self, arg):
+        'Print the usage statistics of the caches.'
+
+        for cache in get_caches():
+            print(' -', cache)
+
     def do_data(self, arg):
         'Print the current content of the persistent data dictionary.'
 
@@ -29,14 +43,87 @@ class BotCLI(Cmd):
         print('Persistent data flushed!!')
 
     def do_jobs(self, arg):
-        'Print the scheduled jobs.'
+        'Print the scheduled jobs with their delay (drift) and run time.'
 
-        for job in schedule.jobs:
+        for job in get_jobs():
             print(' -', job)
 
+    def do_outbox(self, arg):
+        'Print the state of the website notifications outbox.'
+
+        from django.db.models import Count
+
+        from .models import OutboxMessage
+
+        sender = get_outbox()
+
+        if sender:
+            print('Sender:', sender)
+
+        counts = OutboxMessage.objects.values_list('status').annotate(Count('pk'))
+
+        for status, count in counts.order_by('status'):
+            print('  {}: {}'.format(status, count))
+
+    def do_startup(self, arg):
+        'Print the time spent in every step of the bot startup.'
+
+        profile = get_profile()
+        print(profile if profile else 'The bot was not started from this process')
+
+    def do_stats(self, arg):
+        'Print the handler metrics (latency, queries and API calls). Use `stats reset` to clear them.'
+
+        if arg.strip() == 'reset':
+            metrics.reset()
+            print('Metrics cleared!')
+            return
+
+        print('{:30} {:>6} {:>6} {:>9} {:>9} {:>9} {:>8} {:>8}'.format(
+            'handler:action', 'calls', 'errors', 'avg (ms)', 'p50 (ms)',
+            'p99 (ms)', 'queries', 'api'
+        ))
+
+        for (handler, action), stats in metrics.get_stats():
+            print('{:30} {:>6} {:>6} {:>9.1f} {:>9} {:>9} {:>8.1f} {:>8.1f}'.format(
+                '{}:{}'.format(handler, action)[:30], stats.calls, stats.errors,
+                1000 * stats.per_call(stats.latency.sum),
+                format_bound(stats.latency.percentile(0.5)),
+                format_bound(stats.latency.percentile(0.99)),
+                stats.per_call(stats.db_queries), stats.per_call(stats.api_calls),
+            ))
+
+        print('Telegram API circuit breaker:', get_breaker())
+
+        dropped = metrics.get_dropped()
+
+        if dropped:
+            print('Dropped updates (flood control):')
+
+            for (handler, reason), count in dropped:
+                print('  {}:{} {}'.format(handler, reason, count))
+
     def do_sync(self, arg):
         'Force a persistent data sync to disk.'
 
         print('Saving persistent data...')
         persistence.sync()
         print('Done!')
+
+    def do_workers(self, arg):
+        'Print the handler worker pool queue and wait times.'
+
+        executor = get_executor()
+
+        if not executor:
+            print('The worker pool is not running')
+            return
+
+        stats = executor.stats()
+
+        print('Workers: {workers}, queue: {queue_depth}/{queue_size} (max {max_queue_depth})'.format(**stats))
+        print('Submitted: {submitted}, completed: {completed}, failed: {failed}, shed: {shed}'.format(**stats))
+        print('Wait: avg {wait_avg:.3f}s, p99 {wait_p99:.3f}s, max {wait_max:.3f}s'.format(**stats))
+
+        for name, running in stats['running'].items():
+            print('  {}: {} running'.format(name, running))
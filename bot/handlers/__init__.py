@@ -1,7 +1,19 @@
-from .handlers import get_handlers
+from importlib import import_module
 
-from .basic import *
-from .elections import *
-from .groups import *
-from .rooms import *
-from .users import *
+from .handlers import add_lazy_handler, get_handlers, get_router
+from .manifest import HANDLERS, MODULES, RESOLVER_MODULES
+
+def load_modules():
+    '''Imports all the handler modules, registering their handlers and jobs'''
+
+    for module in MODULES:
+        import_module('.' + module, __name__)
+
+def load_manifest():
+    '''Registers the handlers of the manifest without importing their modules'''
+
+    for module, name, commands, prefix in HANDLERS:
+        add_lazy_handler(module, commands, prefix, name)
+
+    for module in RESOLVER_MODULES:
+        import_module('.' + module, __name__)
@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 
 from ..utils import create_reply_markup
+from ..workers import PRIORITY_LOW
 
 from .handlers import add_handlers, BasicBotHandler
 
@@ -14,6 +15,8 @@ class MainHandler(BasicBotHandler):
     cmd = 'start'
     query_prefix = 'main'
 
+    priority = PRIORITY_LOW
+
     def command(self, update, context):
         if update.effective_chat.type != 'private':
             return
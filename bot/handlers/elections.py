@@ -1,12 +1,15 @@
+from collections import OrderedDict
+
 from telegram import ParseMode
 
 from django.contrib.auth import get_user_model
-from django.db import transaction
 from django.db.models import Q
 
 from heart.models import Group
 
 from .. import persistence
+from ..notifications import queue_message
+from ..transactions import atomic_retry
 from ..utils import create_reply_markup
 
 from .handlers import add_handlers, BasicBotHandler
@@ -14,6 +17,7 @@ from .handlers import add_handlers, BasicBotHandler
 User = get_user_model()
 
 ELECTIONS_KEY = 'elections_active'
+ELECTIONS_PENDING_KEY = 'elections_pending'
 
 
 @add_handlers
@@ -134,6 +138,8 @@ class ElectionRequestMixin(BasicBotHandler):
         if not self.notify_group(msg, reply_markup, ParseMode.MARKDOWN):
             return 'No se ha podido enviar tu solicitud ⚠️'
 
+        add_pending_request(query)
+
         return '¡Tu solicitud se ha enviado correctamente!'
 
     def callback_user_filter(self, user):
@@ -144,9 +150,7 @@ class ElectionRequestMixin(BasicBotHandler):
             return
 
         try:
-            user_id = args[0]
-            group_year, group_num = args[1].split('.')
-            is_delegate = bool(int(args[2]))
+            user_id, group_year, group_num, is_delegate = parse_request(args)
         except (IndexError, ValueError):
             return 'Formato de petición incorrecto'
 
@@ -156,44 +160,29 @@ class ElectionRequestMixin(BasicBotHandler):
             self.answer_as_reply()
             return 'El usuario no ha vinculado su cuenta'
 
-        accepted = action == 'request'
-        prefix = '' if is_delegate else 'sub'
-
-        group = Group.objects.filter(year=group_year, number=group_num).first()
-
-        if not group:
-            return 'El grupo indicado no existe'
-
-        if action == 'request':
-            query = Q(delegate=user) | Q(subdelegate=user)
-
-            with transaction.atomic():
-                groups = Group.objects.filter(query)
+        query = ':'.join(args)
 
-                for g in groups:
-                    if g.delegate == user:
-                        g.delegate = None
-                    else:
-                        g.subdelegate = None
+        # Taken before it is applied, so only one admin can answer it
+        if not pop_pending_request(query):
+            return 'La solicitud ya ha sido atendida ⚠️'
 
-                    g.save()
+        accepted = action == 'request'
 
-            if is_delegate:
-                group.delegate = user
+        try:
+            if accepted:
+                group = assign_delegate(user, group_year, group_num, is_delegate)
             else:
-                group.subdelegate = user
+                group = Group.objects.filter(year=group_year, number=group_num).first()
+        except Exception:
+            add_pending_request(query)
+            raise
 
-            group.save()
+        if not group:
+            return 'El grupo indicado no existe'
 
-        if accepted:
-            msg = (
-                'Tu petición ha sido aceptada, ahora eres {}delegado '
-                'del grupo {} del año {} 🎓'
-            ).format(prefix, group_num, group_year)
-        else:
-            msg = 'Tu petición para ser {}delegado ha sido denegada ❌'.format(prefix)
+        queue_message(user_id, request_result_message(group, is_delegate, accepted))
 
-        self.context.bot.send_message(user_id, msg)
+        prefix = '' if is_delegate else 'sub'
 
         msg = 'La solicitud de {} ha sido {} por {}'.format(
             user.get_full_name(), 'aceptada' if accepted else 'denegada',
@@ -208,3 +197,186 @@ class ElectionRequestMixin(BasicBotHandler):
             msg += ' ❌'
 
         return msg
+
+
+@add_handlers
+class PendingElectionRequests(BasicBotHandler):
+    '''Lists the pending election requests and approves all of them at once'''
+
+    cmd = 'solicitudes'
+    query_prefix = 'elections_pending'
+
+    user_required = True
+
+    def user_filter(self, user):
+        return user.has_perm('bot.can_manage_elections')
+
+    def elections_active(self):
+        return persistence.get_item(ELECTIONS_KEY, False)
+
+    def command(self, update, context):
+        pending = get_pending_requests()
+
+        if not pending:
+            return 'No hay solicitudes pendientes ✅'
+
+        msg = 'Hay {} solicitudes pendientes. ¿Quieres aprobarlas todas?'.format(len(pending))
+
+        reply_markup = create_reply_markup([
+            ('Aprobar todas ✅', 'elections_pending:approve'),
+            ('No, cancelar', 'main:okey'),
+        ])
+
+        return msg, reply_markup
+
+    def callback(self, update, action, *args):
+        if action != 'approve':
+            return
+
+        if not self.elections_active():
+            return 'No hay un periodo de elecciones activo ⚠️'
+
+        # Only the requests taken now, the ones sent meanwhile stay pending
+        queries = pop_pending_requests()
+        requests = []
+
+        for query in queries:
+            try:
+                requests.append(parse_request(query.split(':')))
+            except (IndexError, ValueError):
+                pass
+
+        users = {
+            user.telegram_id: user
+            for user in User.objects.filter(
+                telegram_id__in=[user_id for user_id, *_ in requests]
+            )
+        }
+
+        def approve_all():
+            approved = []
+
+            for user_id, group_year, group_num, is_delegate in requests:
+                user = users.get(int(user_id))
+
+                if not user:
+                    continue
+
+                group = _assign_delegate(user, group_year, group_num, is_delegate)
+
+                if group:
+                    approved.append((user_id, group, is_delegate))
+
+            return approved
+
+        # All or none, later requests win if several are for the same user
+        try:
+            approved = atomic_retry(approve_all)
+        except Exception:
+            for query in queries:
+                add_pending_request(query)
+
+            raise
+
+        for user_id, group, is_delegate in approved:
+            queue_message(user_id, request_result_message(group, is_delegate, True))
+
+        return 'Se han aprobado {} de {} solicitudes ✅'.format(len(approved), len(requests))
+
+
+def parse_request(args):
+    '''(telegram ID, group year, group number, is delegate) of the request arguments'''
+
+    user_id = args[0]
+    group_year, group_num = [int(x) for x in args[1].split('.')]
+    is_delegate = bool(int(args[2]))
+
+    return user_id, group_year, group_num, is_delegate
+
+def _assign_delegate(user, group_year, group_num, is_delegate):
+    field = 'delegate' if is_delegate else 'subdelegate'
+
+    User.objects.select_for_update().get(pk=user.pk)
+
+    groups = list(
+        Group.objects.select_for_update()
+        .filter(
+            Q(year=group_year, number=group_num) | Q(delegate=user) | Q(subdelegate=user)
+        )
+        .order_by('pk')
+    )
+
+    group = next(
+        (g for g in groups if g.year == group_year and g.number == group_num), None
+    )
+
+    if not group:
+        return None
+
+    Group.objects.filter(delegate=user).update(delegate=None)
+    Group.objects.filter(subdelegate=user).update(subdelegate=None)
+    Group.objects.filter(pk=group.pk).update(**{field: user})
+
+    group.refresh_from_db()
+
+    return group
+
+def assign_delegate(user, group_year, group_num, is_delegate):
+    '''
+    Makes the user the delegate (or subdelegate) of the group, removing them
+    from any other group, in a single transaction. The user is locked first,
+    so the approvals of the same user are applied one after the other, and
+    then all the changed groups at once in a fixed order, so approvals of
+    different users cannot deadlock. The transaction is run again if the
+    database is locked. Returns the group or None if it does not exist.
+    '''
+
+    return atomic_retry(_assign_delegate, user, group_year, group_num, is_delegate)
+
+def request_result_message(group, is_delegate, accepted):
+    prefix = '' if is_delegate else 'sub'
+
+    if accepted:
+        return (
+            'Tu petición ha sido aceptada, ahora eres {}delegado '
+            'del grupo {} del año {} 🎓'
+        ).format(prefix, group.number, group.year)
+
+    return 'Tu petición para ser {}delegado ha sido denegada ❌'.format(prefix)
+
+def get_pending_requests():
+    '''Gets a copy of the pending requests'''
+
+    with persistence.lock(ELECTIONS_PENDING_KEY):
+        return OrderedDict(persistence.get_item(ELECTIONS_PENDING_KEY, OrderedDict()))
+
+def add_pending_request(query):
+    def add(pending):
+        pending[query] = None
+        return pending
+
+    persistence.update_item(ELECTIONS_PENDING_KEY, OrderedDict(), add)
+
+def pop_pending_request(query):
+    '''Removes a pending request, returns False if it was not pending'''
+
+    with persistence.lock(ELECTIONS_PENDING_KEY):
+        pending = persistence.get_item(ELECTIONS_PENDING_KEY, OrderedDict())
+
+        if pending.pop(query, False) is False:
+            return False
+
+        persistence.set_item(ELECTIONS_PENDING_KEY, pending)
+
+    return True
+
+def pop_pending_requests():
+    '''Removes all the pending requests, returns their queries'''
+
+    with persistence.lock(ELECTIONS_PENDING_KEY):
+        pending = persistence.get_item(ELECTIONS_PENDING_KEY, OrderedDict())
+
+        if pending:
+            persistence.set_item(ELECTIONS_PENDING_KEY, OrderedDict())
+
+    return list(pending)
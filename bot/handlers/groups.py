@@ -3,46 +3,110 @@ from telegram.error import BadRequest
 
 from django.contrib.auth import get_user_model
 from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
 from heart.models import Group
 from clubs.models import Club
 
+from ..broadcast import Broadcast
+from ..cache import TTLCache
+from ..utils import MAX_MESSAGE_LENGTH, MessageBuilder, create_reply_markup, escape_markdown
+from ..workers import PRIORITY_LOW
+
 from .handlers import add_handlers, BasicBotHandler
 
 User = get_user_model()
 
+# Rendered pages of the groups list, rebuilt when a group changes. The key is
+# the version of the list, so a render that was running while a group changed
+# is never used. The signals only fire for the changes made by the bot, the
+# ones made in the website are seen when the entry expires
+_groups_pages = TTLCache('groups list', ttl=600, maxsize=4)
+_groups_version = 0
+
+
+def render_groups_pages():
+    '''Renders the list of groups with a link as one or more messages'''
+
+    groups = (
+        Group
+        .objects
+        .filter(~Q(telegram_group_link=''))
+        .order_by('course', 'year', 'number')
+    )
+
+    # Leaves room for the page number
+    builder = MessageBuilder('*~~Grupos de Telegram~~*\n', MAX_MESSAGE_LENGTH - 32)
+    y = None
+
+    for group in groups:
+        if group.year != y:
+            y = group.year
+            builder.add_line()
+
+        if group.course == group.GII:
+            name = '{} {}º {}'.format(group.course, group.year, group.name)
+        else:
+            name = group.name
+
+        builder.add('[{}]({})\n'.format(escape_markdown(name, 'link'), group.telegram_group_link))
+
+    return builder.chunks()
+
+def get_groups_pages():
+    return _groups_pages.get_or_set(_groups_version, render_groups_pages)
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def _invalidate_groups_pages(sender, **kwargs):
+    global _groups_version
+
+    _groups_version += 1
+    _groups_pages.clear()
+
 
 @add_handlers
 class GroupsList(BasicBotHandler):
     '''Returns a list of all the groups'''
 
     cmd = 'grupos'
+    query_prefix = 'grupos'
 
-    def command(self, update, context):
-        groups = (
-            Group
-            .objects
-            .filter(~Q(telegram_group_link=''))
-            .order_by('course', 'year', 'number')
-        )
+    backlog_coalesce = True
 
-        msg = '*~~Grupos de Telegram~~*\n'
+    priority = PRIORITY_LOW
 
-        y = None
+    edit_parse_mode = ParseMode.MARKDOWN
 
-        for group in groups:
-            if group.year != y:
-                y = group.year
-                msg += '\n'
+    def get_page(self, page):
+        pages = get_groups_pages()
+        page = min(max(page, 0), len(pages) - 1)
 
-            if group.course == group.GII:
-                name = '{} {}º {}'.format(group.course, group.year, group.name)
-            else:
-                name = group.name
+        if len(pages) == 1:
+            return pages[0]
 
-            msg += '[{}]({})\n'.format(name, group.telegram_group_link)
+        buttons = []
 
-        return msg
+        if page > 0:
+            buttons.append(('⬅️ Anterior', 'grupos:page:{}'.format(page - 1)))
+
+        if page < len(pages) - 1:
+            buttons.append(('Siguiente ➡️', 'grupos:page:{}'.format(page + 1)))
+
+        msg = '{}\n\n_Página {} de {}_'.format(pages[page], page + 1, len(pages))
+
+        return msg, create_reply_markup(buttons)
+
+    def command(self, update, context):
+        return self.get_page(0)
+
+    def callback(self, update, action, *args):
+        if action == 'page':
+            try:
+                return self.get_page(int(args[0]))
+            except (IndexError, ValueError):
+                pass
 
 
 @add_handlers
@@ -230,6 +294,8 @@ class GroupsBroadcast(BasicBotHandler):
 
     user_required = True
 
+    max_concurrency = 1
+
     def user_filter(self, user):
         return user.has_perm('bot.can_manage_permissions')
 
@@ -237,33 +303,41 @@ class GroupsBroadcast(BasicBotHandler):
         if not len(context.args):
             return '¡El mensaje no puede estar vacío!'
 
-        groups = Group.objects.filter(~Q(telegram_group=''))
+        groups = {
+            group.telegram_group: group
+            for group in Group.objects.filter(~Q(telegram_group=''))
+        }
 
-        if not len(groups):
+        if not groups:
             return 'No hay grupos a los que enviar el mensaje 😓'
 
         fixed_text = ' '.join(context.args).replace(r'\n', '\n')
         sent_text = '*📣 Mensaje de DAFI 📣*\n\n{}'.format(fixed_text)
 
-        sent = 0
-        fails = []
+        status = update.effective_message.reply_text(
+            'Enviando mensaje a {} grupos...'.format(len(groups))
+        )
 
-        for group in groups:
-            try:
-                context.bot.send_message(
-                    group.telegram_group, sent_text, 'MarkdownV2'
-                )
+        def progress(report):
+            status.edit_text('Enviando mensaje a {} grupos... ({}/{})'.format(
+                report.total, report.done, report.total
+            ))
+
+        report = Broadcast(
+            context.bot, groups, sent_text, 'MarkdownV2', progress
+        ).run()
 
-                sent += 1
-            except:
-                fails.append(str(group))
+        for chat_id, new_chat_id in report.migrated.items():
+            group = groups[chat_id]
+            group.telegram_group = new_chat_id
+            group.save()
 
-        msg = '`Mensaje enviado a {} grupos:`\n\n{}'.format(sent, sent_text)
+        msg = '`Mensaje enviado a {} grupos:`\n\n{}'.format(len(report.sent), sent_text)
 
-        if fails:
+        if report.failed:
             msg += '\n\nNo se pudo enviar a:'
 
-            for group in fails:
-                msg += '\n- {}'.format(group)
+            for chat_id in report.failed:
+                msg += '\n- {}'.format(groups[chat_id])
 
         return msg
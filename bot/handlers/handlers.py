@@ -1,14 +1,49 @@
-from telegram import ParseMode as _ParseMode
+from importlib import import_module as _import_module
+
+from telegram import MessageEntity as _MessageEntity, ParseMode as _ParseMode, Update as _Update
 from telegram.error import BadRequest, ChatMigrated
-from telegram.ext import CallbackQueryHandler, CommandHandler, run_async
+from telegram.ext import (
+    DispatcherHandlerStop as _DispatcherHandlerStop, Filters as _Filters, Handler as _Handler,
+    MessageHandler as _MessageHandler
+)
 
 from django.contrib.auth import get_user_model as _get_user_model
+from django.contrib.auth.models import Group as _Group, Permission as _Permission
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 
 from main.models import Config
 
+from .. import metrics as _metrics
+from .. import workers as _workers
+from ..cache import TTLCache
+from ..ratelimit import TokenBucketMap as _TokenBucketMap
+
 _user_model = _get_user_model()
 
-_handlers = []
+# Telegram ID -> user (with its permissions loaded) or None if not linked.
+# Only the changes made by the bot invalidate it, so the entries are short
+# lived: accounts unlinked and permissions revoked from the website apply
+# within this time, and the bursts of updates of a user still hit the cache
+USER_CACHE_TTL = 30
+
+_user_cache = TTLCache('users', ttl=USER_CACHE_TTL, maxsize=1024)
+
+# Telegram metadata, so the checks do not call the API on every command
+_bot_cache = TTLCache('bot identity', ttl=3600, maxsize=16)
+_chat_admin_cache = TTLCache('bot admin status', ttl=600, maxsize=1024)
+_invite_link_cache = TTLCache('invite links', ttl=3600, maxsize=1024)
+
+# Time to remember that the bot is not an admin, it is usually promoted right after
+BOT_NOT_ADMIN_TTL = 60
+
+# Dispatcher group of the flood control, before the handlers (group 0)
+FLOOD_CONTROL_GROUP = -1
+
+# Seconds between the busy replies to the shed updates of a user
+BUSY_WARNING_INTERVAL = 30
+
+_busy_warnings = _TokenBucketMap(1 / BUSY_WARNING_INTERVAL, 1)
 
 
 class BasicBotHandler():
@@ -36,6 +71,30 @@ class BasicBotHandler():
 
     keep_original_message = False
 
+    # Parse mode of the edited message when answering a callback
+    edit_parse_mode = None
+
+    # Worker pool settings: low priority handlers are the first ones to be
+    # shed when the bot is overloaded, and the number of updates of the same
+    # handler running at the same time can be limited
+    priority = _workers.PRIORITY_NORMAL
+    max_concurrency = None
+
+    # Commands whose answer without arguments only shows the current state,
+    # only the last one of every chat is answered after the bot was stopped
+    backlog_coalesce = False
+
+    busy_msg = 'Estoy recibiendo muchos mensajes, inténtalo de nuevo en un momento ⏳'
+
+    # Flood control: (updates per second, burst) allowed to every user and to
+    # every group before dropping their updates, None disables the limit
+    user_rate = (1, 5)
+    chat_rate = (2, 20)
+
+    # Reply to the dropped updates (at most once every few seconds per user),
+    # None drops them silently
+    flood_msg = 'Vas demasiado rápido, espera un momento antes de seguir ⏳'
+
     def __init__(self, update, context, cmd=None):
         self.update = update
         self.context = context
@@ -51,8 +110,7 @@ class BasicBotHandler():
 
     def get_user(self):
         if not self.user_loaded:
-            user_id = self.update.effective_user.id
-            self.user = _user_model.objects.filter(telegram_id=user_id).first()
+            self.user = get_cached_user(self.update.effective_user.id)
             self.user_loaded = True
 
         return self.user
@@ -65,6 +123,17 @@ class BasicBotHandler():
 
     def get_invite_link(self):
         chat_id = self.update.effective_chat.id
+        link = _invite_link_cache.get(chat_id)
+
+        if not link:
+            link = self.export_invite_link(chat_id)
+
+            if link[1]:
+                _invite_link_cache.set(chat_id, link)
+
+        return link
+
+    def export_invite_link(self, chat_id):
         chat = self.context.bot.get_chat(chat_id)
 
         if chat.invite_link:
@@ -73,8 +142,10 @@ class BasicBotHandler():
         try:
             return chat_id, self.context.bot.export_chat_invite_link(chat_id)
         except BadRequest:
+            invalidate_chat(chat_id)
             return None, None
         except ChatMigrated as e:
+            invalidate_chat(chat_id)
             chat_id = e.new_chat_id
 
         try:
@@ -92,9 +163,7 @@ class BasicBotHandler():
             return False
 
         if self.bot_admin_required and 'group' in chat.type:
-            bot_id = self.context.bot.get_me().id
-
-            if chat.get_member(bot_id).status != 'administrator':
+            if not is_bot_admin(self.context.bot, chat):
                 self.msg = self.bot_admin_required_msg
                 return False
 
@@ -146,18 +215,60 @@ class BasicBotHandler():
         raise NotImplementedError("Must create a `callback' method in the class")
 
     def send_answer(self):
-        if not self.is_callback or self.keep_original_message:
-            self.update.effective_message.reply_text(
-                self.msg, reply_markup=self.reply_markup,
-                parse_mode=_ParseMode.MARKDOWN
-            )
-        else:
-            self.update.callback_query.edit_message_text(
-                self.msg, reply_markup=self.reply_markup
-            )
+        # Long answers are a list of messages, the buttons go in the last one
+        messages = self.msg if isinstance(self.msg, list) else [self.msg]
+
+        for i, msg in enumerate(messages):
+            reply_markup = self.reply_markup if i == len(messages) - 1 else None
+
+            if not self.is_callback or self.keep_original_message or i:
+                self.update.effective_message.reply_text(
+                    msg, reply_markup=reply_markup,
+                    parse_mode=_ParseMode.MARKDOWN
+                )
+            else:
+                self.update.callback_query.edit_message_text(
+                    msg, reply_markup=reply_markup,
+                    parse_mode=self.edit_parse_mode
+                )
+
+    def dispatch(self):
+        '''Queues the update in the worker pool'''
+
+        accepted = _workers.submit(
+            self.run, type(self).__name__, self.priority, self.max_concurrency
+        )
+
+        if accepted:
+            return
+
+        busy_msg = self.busy_msg
+
+        if _busy_warnings.get(self.update.effective_user.id).consume():
+            # Told a moment ago
+            busy_msg = None
+
+        # Sent in the background, the bot is already overloaded
+        if self.is_callback:
+            # Always answered, or the button keeps loading in the client
+            _workers.reply(lambda: self.update.callback_query.answer(busy_msg), 'busy')
+        elif busy_msg:
+            _workers.reply(lambda: self.update.effective_message.reply_text(busy_msg), 'busy')
+
+    def get_action(self):
+        '''Name of the action in the metrics: the command or the callback action'''
+
+        if self.is_callback:
+            parts = self.update.callback_query.data.split(':')
+            return parts[1] if len(parts) > 1 else parts[0]
+
+        return self.current_command
 
-    @run_async
     def run(self):
+        with _metrics.track(type(self).__name__, self.get_action()):
+            self.handle()
+
+    def handle(self):
         if not self.run_checks():
             return self.send_answer()
 
@@ -180,7 +291,7 @@ class BasicBotHandler():
             if not answer:
                 return
 
-        if isinstance(answer, str):
+        if isinstance(answer, (str, list)):
             self.msg = answer
         elif isinstance(answer, tuple) and len(answer) == 2:
             self.msg, self.reply_markup = answer
@@ -188,45 +299,342 @@ class BasicBotHandler():
         self.send_answer()
 
     @classmethod
-    def get_handlers(cls):
-        handlers = []
-        commands = []
+    def get_flood_key(cls, name):
+        '''
+        Name of the flood control limits of the command or callback query
+        prefix, by default shared by all the routes of the class
+        '''
 
-        if cls.cmd:
-            commands.append(cls.cmd)
+        return cls.__name__
 
-        if cls.commands_available:
-            commands += cls.commands_available
+    @classmethod
+    def get_routes(cls):
+        '''Returns the commands and the query prefix handled by the class'''
 
-        if commands and callable(getattr(cls, 'command', None)):
-            for cmd in commands:
-                handlers.append(create_cmd_handler(cls, cmd))
+        commands = []
+        prefix = None
 
-        if cls.query_prefix and callable(getattr(cls, 'callback', None)):
-            def callback_handler(update, context):
-                return cls(update, context).run()
+        if callable(getattr(cls, 'command', None)):
+            if cls.cmd:
+                commands.append(cls.cmd)
 
-            handlers.append(
-                CallbackQueryHandler(callback_handler, pattern=cls.query_prefix)
-            )
+            if cls.commands_available:
+                commands += cls.commands_available
 
-        if len(handlers) == 0:
+        if cls.query_prefix and callable(getattr(cls, 'callback', None)):
+            prefix = cls.query_prefix
+
+        if not commands and not prefix:
             raise NotImplementedError('Must implement at least one handler method!')
 
-        return handlers
+        return commands, prefix
 
 
-def create_cmd_handler(cls, cmd):
-    def cmd_handler(update, context):
-        return cls(update, context, cmd).run()
+class LazyHandler():
+    '''Routes of a handler class whose module has not been imported yet'''
 
-    return CommandHandler(cmd, cmd_handler)
+    def __init__(self, module, commands, prefix, name=None):
+        self.module = module
 
-def add_handlers(cls):
-    global _handlers
+        # The name of the class, so the flood control uses the same limits
+        # before and after the module is imported
+        self.__name__ = name or 'LazyHandler({})'.format(module)
+
+        self.commands = commands
+        self.prefix = prefix
+
+    def get_routes(self):
+        return self.commands, self.prefix
+
+    def load(self):
+        # The classes of the module replace the lazy handlers when registered
+        _import_module('.' + self.module, __package__)
+
+
+class HandlerRouter(_Handler):
+    '''
+    Single dispatcher handler for all the bot handler classes. Finds the class
+    by the command name or by the callback data prefix (the text before the
+    first colon) with a dictionary lookup, so the cost does not depend on the
+    number of handlers.
+
+    The names that are not registered are passed to the resolvers, functions
+    that return the class of a handler defined by data (like the rooms) or
+    None, so those handlers do not need a route per entry.
+    '''
+
+    def __init__(self):
+        super().__init__(None)
+
+        self.commands = {}
+        self.callbacks = {}
+        self.resolvers = []
+
+    def add_resolver(self, resolver):
+        self.resolvers.append(resolver)
+
+    def resolve(self, name):
+        for resolver in self.resolvers:
+            cls = resolver(name)
+
+            if cls:
+                return cls
+
+        return None
+
+    def add(self, cls):
+        commands, prefix = cls.get_routes()
+        lazy = isinstance(cls, LazyHandler)
+
+        for cmd in commands:
+            cmd = cmd.lower()
+            current = self.commands.get(cmd)
+
+            if current and lazy and not isinstance(current, LazyHandler):
+                # The module was already imported
+                continue
+
+            if current and not isinstance(current, LazyHandler):
+                raise ValueError('Command /{} is already handled by {}'.format(
+                    cmd, self.commands[cmd].__name__
+                ))
+
+            self.commands[cmd] = cls
+
+        if prefix:
+            current = self.callbacks.get(prefix)
+
+            if current and lazy and not isinstance(current, LazyHandler):
+                return
+
+            if current and not isinstance(current, LazyHandler):
+                raise ValueError('Query prefix {} is already handled by {}'.format(
+                    prefix, self.callbacks[prefix].__name__
+                ))
+
+            self.callbacks[prefix] = cls
+
+    def check_update(self, update):
+        if not isinstance(update, _Update):
+            return None
+
+        if update.callback_query:
+            data = update.callback_query.data or ''
+            prefix = data.split(':', 1)[0]
+            cls = self.callbacks.get(prefix) or self.resolve(prefix)
+
+            return (cls, None, None) if cls else None
+
+        message = update.message or update.edited_message
+
+        if not message or not message.text or not message.entities:
+            return None
 
-    _handlers += cls.get_handlers()
+        entity = message.entities[0]
+
+        if entity.type != _MessageEntity.BOT_COMMAND or entity.offset != 0:
+            return None
+
+        cmd, _, username = message.text[1:entity.length].partition('@')
+
+        if username and username.lower() != message.bot.username.lower():
+            return None
+
+        cmd = cmd.lower()
+        cls = self.commands.get(cmd) or self.resolve(cmd)
+
+        return (cls, cmd, message.text.split()[1:]) if cls else None
+
+    def collect_additional_context(self, context, update, dispatcher, check_result):
+        context.args = check_result[2]
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        cls, cmd, _ = check_result
+
+        if isinstance(cls, LazyHandler):
+            cls.load()
+            cls = self.check_update(update)[0]
+
+            if isinstance(cls, LazyHandler):
+                raise ValueError('The module {} does not handle the update'.format(cls.module))
+
+        self.collect_additional_context(context, update, dispatcher, check_result)
+
+        return cls(update, context, cmd).dispatch()
+
+
+_router = HandlerRouter()
+
+
+class FloodControl(_Handler):
+    '''
+    Runs before the router and drops the updates of the users and groups that
+    go over the rate of the handler class, so they cannot fill the worker
+    pool. The limits of every handler class are independent.
+    '''
+
+    # Seconds between the replies to the dropped updates of a user
+    warning_interval = 30
+
+    def __init__(self, router):
+        super().__init__(None)
+
+        self.router = router
+
+        self.users = _TokenBucketMap(BasicBotHandler.user_rate[0])
+        self.chats = _TokenBucketMap(BasicBotHandler.chat_rate[0])
+        self.warnings = _TokenBucketMap(1 / self.warning_interval, 1)
+
+    def check_update(self, update):
+        route = self.router.check_update(update)
+
+        if not route or not update.effective_user:
+            return None
+
+        cls = route[0]
+
+        # The modules of lazy handlers are not imported, they use the defaults
+        user_rate = getattr(cls, 'user_rate', BasicBotHandler.user_rate)
+        chat_rate = getattr(cls, 'chat_rate', BasicBotHandler.chat_rate)
+
+        if isinstance(cls, LazyHandler):
+            handler = cls.__name__
+        else:
+            handler = cls.get_flood_key(route[1] or update.callback_query.data.split(':', 1)[0])
+
+        if user_rate and self.users.get((handler, update.effective_user.id), *user_rate).consume():
+            return cls, 'user'
+
+        chat = update.effective_chat
+
+        if chat_rate and chat and chat.type != 'private':
+            if self.chats.get((handler, chat.id), *chat_rate).consume():
+                return cls, 'chat'
+
+        return None
+
+    def handle_update(self, update, dispatcher, check_result, context=None):
+        cls, reason = check_result
+
+        _metrics.record_dropped(cls.__name__, reason)
+
+        flood_msg = getattr(cls, 'flood_msg', BasicBotHandler.flood_msg)
+
+        if flood_msg and self.warnings.get(update.effective_user.id).consume():
+            # Warned a moment ago
+            flood_msg = None
+
+        # Sent in the background, the dispatcher goes on with the next update
+        if update.callback_query:
+            # Always answered, or the button keeps loading in the client
+            _workers.reply(lambda: update.callback_query.answer(flood_msg), 'FloodControl')
+        elif flood_msg:
+            _workers.reply(lambda: update.effective_message.reply_text(flood_msg), 'FloodControl')
+
+        # The update does not reach the handlers
+        raise _DispatcherHandlerStop
+
+
+_flood_control = FloodControl(_router)
+
+
+def _load_user(telegram_id):
+    user = _user_model.objects.filter(telegram_id=telegram_id).first()
+
+    if user:
+        # Fills the user permissions cache so has_perm does not query them
+        user.get_all_permissions()
+
+    return user
+
+def get_cached_user(telegram_id):
+    '''Gets the user linked to a Telegram ID, using the process-wide cache'''
+
+    return _user_cache.get_or_set(telegram_id, lambda: _load_user(telegram_id))
+
+@receiver(post_save, sender=_user_model)
+@receiver(post_delete, sender=_user_model)
+def _invalidate_user(sender, instance, **kwargs):
+    # The Telegram ID may have changed, so look for the user too
+    _user_cache.discard(instance.telegram_id)
+    _user_cache.discard_if(lambda k, user: user is not None and user.pk == instance.pk)
+
+@receiver(m2m_changed, sender=_user_model.groups.through)
+@receiver(m2m_changed, sender=_user_model.user_permissions.through)
+@receiver(m2m_changed, sender=_Group.permissions.through)
+@receiver(post_save, sender=_Group)
+@receiver(post_delete, sender=_Group)
+@receiver(post_save, sender=_Permission)
+@receiver(post_delete, sender=_Permission)
+def _invalidate_permissions(sender, **kwargs):
+    _user_cache.clear()
+
+def get_bot_user(bot):
+    '''Gets the bot Telegram user, using the process-wide cache'''
+
+    return _bot_cache.get_or_set(bot.token, bot.get_me)
+
+def is_bot_admin(bot, chat):
+    '''Checks if the bot is an admin of the chat, using the process-wide cache'''
+
+    is_admin = _chat_admin_cache.get(chat.id)
+
+    if is_admin is None:
+        is_admin = chat.get_member(get_bot_user(bot).id).status == 'administrator'
+
+        _chat_admin_cache.set(
+            chat.id, is_admin, None if is_admin else BOT_NOT_ADMIN_TTL
+        )
+
+    return is_admin
+
+def invalidate_chat(chat_id):
+    '''Removes the cached metadata of a chat'''
+
+    _chat_admin_cache.discard(chat_id)
+    _invite_link_cache.discard(chat_id)
+
+def _chat_status_changed(update, context):
+    message = update.effective_message
+    bot_id = get_bot_user(context.bot).id
+
+    members = list(message.new_chat_members or [])
+
+    if message.left_chat_member:
+        members.append(message.left_chat_member)
+
+    if message.migrate_to_chat_id or any(member.id == bot_id for member in members):
+        invalidate_chat(message.chat.id)
+
+    if message.migrate_to_chat_id:
+        invalidate_chat(message.migrate_to_chat_id)
+
+_chat_status_handler = _MessageHandler(
+    _Filters.status_update.new_chat_members
+    | _Filters.status_update.left_chat_member
+    | _Filters.status_update.migrate,
+    _chat_status_changed
+)
+
+def add_handlers(cls):
+    _router.add(cls)
     return cls
 
+def add_lazy_handler(module, commands, prefix, name=None):
+    _router.add(LazyHandler(module, commands, prefix, name))
+
+def add_resolver(resolver):
+    _router.add_resolver(resolver)
+    return resolver
+
+def get_router():
+    return _router
+
 def get_handlers():
-    return _handlers
+    '''(dispatcher group, handler) pairs'''
+
+    return [
+        (FLOOD_CONTROL_GROUP, _flood_control),
+        (0, _router),
+        (0, _chat_status_handler),
+    ]
@@ -0,0 +1,36 @@
+'''
+Commands and callback query prefixes of every handler class, so the bot can
+route the updates without importing the handler modules. A module is
+imported when one of its handlers is used for the first time. The tests check
+that it matches the handler classes.
+
+The modules of RESOLVER_MODULES find their handlers by name (the rooms are
+stored in the database), so they are always imported.
+'''
+
+# (module, class, commands, callback query prefix)
+HANDLERS = (
+    ('basic', 'MainHandler', ('start',), 'main'),
+    ('basic', 'GetGroupID', ('getid',), None),
+    ('elections', 'ElectionsToggleHandler', ('elecciones',), 'elections_toggle'),
+    ('elections', 'ElectionRequestMixin', ('soydelegado', 'soysubdelegado'), 'elections'),
+    ('elections', 'PendingElectionRequests', ('solicitudes',), 'elections_pending'),
+    ('groups', 'GroupsList', ('grupos',), 'grupos'),
+    ('groups', 'GroupsLink', ('vinculargrupo',), None),
+    ('groups', 'GroupsUnlink', ('desvinculargrupo',), None),
+    ('groups', 'GroupsLink', ('vincularclub',), None),
+    ('groups', 'GroupsUnlink', ('desvincularclub',), None),
+    ('groups', 'GroupsBroadcast', ('broadcast',), None),
+    ('rooms', 'RoomScheduleHandler', ('horario',), None),
+    ('users', 'ViewGroupsPermissions', ('veracceso',), None),
+    ('users', 'BroadcastToGroup', ('broadcastgrupo',), None),
+    ('users', 'AddUserPermissions', ('daracceso',), None),
+    ('users', 'RemoveUserPermissions', ('quitaracceso',), None),
+    ('users', 'UsersLink', ('vincular',), None),
+    ('users', 'UsersUnlink', ('desvincular',), None),
+    ('users', 'UsersCallbackHandler', (), 'users'),
+)
+
+RESOLVER_MODULES = ('rooms',)
+
+MODULES = tuple(sorted({module for module, *_ in HANDLERS} | set(RESOLVER_MODULES)))
@@ -1,38 +1,195 @@
 import schedule
+import threading
+
+from collections import defaultdict
 
 from telegram import ParseMode
 
 from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 
-from .. import persistence
+from ..broadcast import fan_out
+from ..cache import TTLCache
 from ..jobs import add_job
-from ..utils import create_reply_markup
+from ..models import Room, RoomEvent, RoomPresence, RoomQueueEntry
+from ..occupancy import (
+    CLOSING_TIME, WEEKDAYS, add_presence, get_staffed_ranges, get_weekly_occupancy
+)
+from ..transactions import atomic_retry
+from ..utils import (
+    MessageBuilder, add_users_list, create_reply_markup, create_users_messages, escape_markdown
+)
 
-from .handlers import add_handlers, BasicBotHandler, Config
+from .handlers import add_handlers, add_resolver, BasicBotHandler
 
 User = get_user_model()
 
-ROOM_MEMBERS_LIST = 'room_members'
-ROOM_QUEUE_LIST = 'room_queue'
+# Active rooms by command. They are reloaded every minute, so the rooms added
+# from the website are available without restarting the bot
+_rooms = TTLCache('rooms', ttl=60, maxsize=1)
 
-ALT_ROOM_MEMBERS_LIST = 'alt_room_members'
-ALT_ROOM_QUEUE_LIST = 'alt_room_queue'
+# Rendered status of the rooms by (room ID, version, chat type). The entries
+# expire so changes made by other processes (like the website) and in the
+# names of the members are shown soon
+_room_status = TTLCache('room status', ttl=60, maxsize=256)
 
+# Room ID -> number of changes of the room or its members in this process
+_room_versions = {}
+_room_versions_lock = threading.Lock()
 
-@add_handlers
-class DafiRoom(BasicBotHandler):
-    '''Main room handler'''
 
-    cmd = 'dafi'
-    query_prefix = 'dafi'
+def get_rooms():
+    '''Gets the active rooms as a dict of command -> room'''
+
+    return _rooms.get_or_set('rooms', lambda: {
+        room.command: room for room in Room.objects.filter(active=True)
+    })
+
+def get_room(command):
+    return get_rooms().get(command)
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def _invalidate_rooms(sender, **kwargs):
+    _rooms.clear()
+
+
+def get_room_version(room_id):
+    return _room_versions.get(room_id, 0)
+
+def _bump_version(room_id):
+    with _room_versions_lock:
+        _room_versions[room_id] = _room_versions.get(room_id, 0) + 1
+
+def _room_changed(room_id):
+    _bump_version(room_id)
+
+    # Again when the change is visible to the other threads, in case the
+    # status was rendered in the middle of the transaction
+    transaction.on_commit(lambda: _bump_version(room_id))
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def _invalidate_room_status(sender, instance, **kwargs):
+    _room_changed(instance.pk)
+
+@receiver(post_save, sender=RoomPresence)
+@receiver(post_delete, sender=RoomPresence)
+def _invalidate_members(sender, instance, **kwargs):
+    _room_changed(instance.room_id)
+
+def get_members_users(room):
+    '''Gets the users in the room, in order of arrival, in a single query'''
+
+    return [
+        presence.user
+        for presence in RoomPresence.objects.filter(room=room).select_related('user')
+    ]
+
+def _add_member(room, user):
+    _, created = RoomPresence.objects.get_or_create(room=room, user=user)
+
+    if not created:
+        return None
+
+    RoomEvent.objects.create(room=room, user=user, kind=RoomEvent.KIND_ON)
+
+    waiting = list(
+        RoomQueueEntry.objects.filter(room=room).values_list('telegram_id', flat=True)
+    )
+
+    # Only the read entries, anyone queued meanwhile waits for the next one
+    RoomQueueEntry.objects.filter(room=room, telegram_id__in=waiting).delete()
+
+    return waiting
+
+def add_member(room, user):
+    '''
+    Adds a user to the room members and empties the queue. Returns the
+    Telegram IDs of the queue, or None if the user was already in the room.
+    '''
+
+    return atomic_retry(_add_member, room, user)
+
+def _remove_member(room, user):
+    presence = (
+        RoomPresence.objects
+        .select_for_update()
+        .filter(room=room, user=user)
+        .first()
+    )
+
+    if not presence:
+        return False
+
+    presence.delete()
+
+    event = RoomEvent.objects.create(room=room, user=user, kind=RoomEvent.KIND_OFF)
+    add_presence(room, presence.since, event.date)
+
+    return True
+
+def remove_member(room, user):
+    '''
+    Removes a user from the room members and adds the time spent to the
+    occupancy of the room. Returns False if the user was not there.
+    '''
+
+    return atomic_retry(_remove_member, room, user)
+
+def add_to_queue(room, telegram_id):
+    RoomQueueEntry.objects.get_or_create(room=room, telegram_id=telegram_id)
+
+def render_room_status(room, chat_type):
+    '''Renders the members of the room as one or more messages'''
+
+    users = get_members_users(room)
+
+    if not users:
+        reply_markup = create_reply_markup(
+            [('Avísame cuando llegue alguien ✔️', '{}:notify'.format(room.command))],
+            [('No me avises ❌', 'main:okey')]
+        )
+
+        msg = 'Ahora mismo no hay nadie en {} 😓'.format(escape_markdown(room.name))
+
+        return msg, reply_markup
+
+    header = '🏠 *{}* 🎓\nEn {} está{}...\n'.format(
+        escape_markdown(room.name, 'bold'), escape_markdown(room.name_long),
+        'n' if len(users) > 1 else ''
+    )
+
+    footer = ''
+    reply_markup = None
+
+    if chat_type == 'private':
+        footer = '\n\n¿Quieres que avise de que vas?'
+        reply_markup = create_reply_markup(
+            [('Sí, estoy de camino 🏃🏻‍♂️', '{}:omw'.format(room.command))],
+            [('No, iré luego ☕️', 'main:okey')],
+        )
+
+    return create_users_messages(users, header, footer), reply_markup
 
-    members_list_key = ROOM_MEMBERS_LIST
-    queue_list_key = ROOM_QUEUE_LIST
+def get_room_status(room, chat_type):
+    '''Rendered members of the room, cached until they change'''
 
-    management_permission = 'bot.can_change_room_state'
+    # The version is read before the members are rendered
+    key = (room.pk, get_room_version(room.pk), chat_type)
 
-    room_name = 'DAFI'
-    room_name_long = 'la delegación'
+    return _room_status.get_or_set(key, lambda: render_room_status(room, chat_type))
+
+
+class RoomHandler(BasicBotHandler):
+    '''Handler of every room, found by its command in the registry'''
+
+    backlog_coalesce = True
+
+    # The names of the rooms are escaped in the answers to the buttons too
+    edit_parse_mode = ParseMode.MARKDOWN
 
     OPTION_ON = 'on'
     OPTION_OFF = 'off'
@@ -40,38 +197,33 @@ class DafiRoom(BasicBotHandler):
 
     OPTIONS = (OPTION_ON, OPTION_OFF, OPTION_LIST)
 
-    def command(self, update, context):
-        members = persistence.get_item(self.members_list_key, [])
+    def __init__(self, update, context, cmd=None):
+        super().__init__(update, context, cmd)
 
-        if not context.args:
-            if not members:
-                reply_markup = create_reply_markup(
-                    [(
-                        'Avísame cuando llegue alguien ✔️',
-                        '{}:notify:{}'.format(self.query_prefix, update.effective_user.id)
-                    )],
-                    [('No me avises ❌', 'main:okey')]
-                )
-
-                return 'Ahora mismo no hay nadie en {} 😓'.format(self.room_name), reply_markup
-
-            msg = '🏠 *{}* 🎓\nEn {} está{}...\n'.format(
-                self.room_name, self.room_name_long, 'n' if len(members) > 1 else ''
-            )
+        name = cmd or update.callback_query.data.split(':', 1)[0]
 
-            reply_markup = None
+        self.room = get_room(name)
+        self.query_prefix = name
 
-            for user in members:
-                msg += '\n[{}](tg://user?id={})'.format(user.get_full_name(), user.telegram_id)
+    @classmethod
+    def get_flood_key(cls, name):
+        # Every room has its own limits
+        return '{}:{}'.format(cls.__name__, name)
 
-            if update.message.chat.type == 'private':
-                msg += '\n\n¿Quieres que avise de que vas?'
-                reply_markup = create_reply_markup(
-                    [('Sí, estoy de camino 🏃🏻‍♂️', '{}:omw'.format(self.query_prefix))],
-                    [('No, iré luego ☕️', 'main:okey')],
-                )
+    @classmethod
+    def resolve(cls, name):
+        '''Returns the class if there is a room with the command'''
 
-            return msg, reply_markup
+        return cls if get_room(name) else None
+
+    def command(self, update, context):
+        room = self.room
+
+        if not room:
+            return 'La sala indicada no existe'
+
+        if not context.args:
+            return get_room_status(room, update.message.chat.type)
 
         action = context.args[0].lower()
 
@@ -80,94 +232,83 @@ class DafiRoom(BasicBotHandler):
 
         user = self.get_user()
 
-        if not user or not user.has_perm(self.management_permission):
+        if not user or not user.has_perm(room.permission):
             return 'No puedes llevar a cabo esta acción'
 
         if action == self.OPTION_ON:
-            if user in members:
-                return 'Ya tenía constancia de que estás en {} ⚠️'.format(self.room_name)
-
-            members.append(user)
-
-            msg = '@{} acaba de llegar a {} 🔔'.format(
-                user.telegram_user, self.room_name
-            )
+            waiting = add_member(room, user)
 
-            queue = persistence.get_item(self.queue_list_key, [])
+            if waiting is None:
+                return 'Ya tenía constancia de que estás en {} ⚠️'.format(escape_markdown(room.name))
 
-            if queue:
-                for user_id in queue:
-                    try:
-                        context.bot.send_message(user_id, msg)
-                    except:
-                        # So many errors can occur here but it's a simple
-                        # notification, so we'll just ignore a failed one
-                        pass
+            if waiting:
+                # Sent as plain text, the names are not escaped
+                msg = '@{} acaba de llegar a {} 🔔'.format(user.telegram_user, room.name)
 
-                queue.clear()
+                # Delivered in the background, the user gets the reply first
+                fan_out(context.bot, waiting, msg)
 
             reply_markup = create_reply_markup([
-                ('Me voy 💤', '{}:off'.format(self.query_prefix))
+                ('Me voy 💤', '{}:off'.format(room.command))
             ])
 
-            return 'He anotado que estás en DAFI ✅'.format(self.room_name), reply_markup
+            msg = 'He anotado que estás en {} ✅'.format(escape_markdown(room.name))
 
-        elif action == self.OPTION_OFF:
-            if user not in members:
-                return 'No sabía que estabas en {} ⚠️'.format(self.room_name)
+            return msg, reply_markup
 
-            members.remove(user)
+        elif action == self.OPTION_OFF:
+            if not remove_member(room, user):
+                return 'No sabía que estabas en {} ⚠️'.format(escape_markdown(room.name))
 
-            return 'He anotado que has salido de {} ✅'.format(self.room_name)
+            return 'He anotado que has salido de {} ✅'.format(escape_markdown(room.name))
 
         elif action == self.OPTION_LIST:
-            queue = persistence.get_item(self.queue_list_key, [])
+            queue = list(
+                RoomQueueEntry.objects.filter(room=room).values_list('telegram_id', flat=True)
+            )
 
             if not queue:
-                return 'No hay nadie esperando para ir a {} ✅'.format(self.room_name)
+                return 'No hay nadie esperando para ir a {} ✅'.format(escape_markdown(room.name))
 
-            users = User.objects.filter(telegram_id__in=queue)
+            users = list(User.objects.filter(telegram_id__in=queue))
 
-            msg = 'Usuarios esperando para ir a {}:\n'.format(self.room_name)
+            builder = MessageBuilder(
+                'Usuarios esperando para ir a {}:\n'.format(escape_markdown(room.name))
+            )
 
-            for user in users:
-                msg += '\n[{}](tg://user?id={})'.format(
-                    user.get_full_name(), user.telegram_id
-                )
+            add_users_list(builder, users)
 
             diff = len(queue) - len(users)
 
             if diff == 1:
-                msg += '\n\nHay otra persona más esperando, pero no es un usuario registrado.'
+                builder.add('\n\nHay otra persona más esperando, pero no es un usuario registrado.')
             elif diff > 1:
-                msg += (
+                builder.add((
                     '\n\nHay otras {} personas más esperando, '
                     'pero no son usuarios registrados.'
-                ).format(diff)
+                ).format(diff))
 
-            return msg
+            return builder.chunks()
 
     def callback(self, update, action, *args):
-        members = persistence.get_item(self.members_list_key, [])
-        queue = persistence.get_item(self.queue_list_key, [])
+        room = self.room
+
+        if not room:
+            return 'La sala indicada no existe'
 
         if action == 'omw':
-            if not members:
-                return 'Ahora mismo no hay nadie en {} 😓'.format(self.room_name)
+            if not RoomPresence.objects.filter(room=room).exists():
+                return 'Ahora mismo no hay nadie en {} 😓'.format(escape_markdown(room.name))
 
-            text = '¡{} está de camino a {}!'.format(
-                update.effective_user.name, self.room_name
-            )
+            # Sent as plain text, the names are not escaped
+            text = '¡{} está de camino a {}!'.format(update.effective_user.name, room.name)
 
-            if not self.notify_group(text):
+            if not self.notify_group(text, config_key=room.notify_group):
                 return 'No he podido avisarles 😓'
 
             return 'Hecho, les he avisado 😉'
         elif action == 'notify':
-            user_id = update.effective_user.id
-
-            if user_id not in queue:
-                queue.append(user_id)
+            add_to_queue(room, update.effective_user.id)
 
             return 'Hecho, te avisaré 😉'
         elif action == 'off':
@@ -176,31 +317,70 @@ class DafiRoom(BasicBotHandler):
             if not user:
                 return 'No he encontrado una cuenta para tu usuario ⚠️'
 
-            if user not in members:
-                return 'No sabía que estabas en {} ⚠️'.format(self.room_name)
+            if not remove_member(room, user):
+                return 'No sabía que estabas en {} ⚠️'.format(escape_markdown(room.name))
+
+            return 'He anotado que has salido de {} ✅'.format(escape_markdown(room.name))
+
+
+add_resolver(RoomHandler.resolve)
+
+
+def render_schedule(room, today=None):
+    '''Hours in which the room usually has someone, from the rollups'''
+
+    data = get_weekly_occupancy(room, today)
+
+    if not data:
+        return 'Todavía no hay datos de {} 😓'.format(escape_markdown(room.name))
+
+    first, occupancy = data
+    lines = ['🕒 *Horario habitual de {}*\n'.format(escape_markdown(room.name, 'bold'))]
 
-            members.remove(user)
+    for weekday, hours in zip(WEEKDAYS, occupancy):
+        ranges = get_staffed_ranges(hours)
 
-            return 'He anotado que has salido de {} ✅'.format(self.room_name)
+        if ranges:
+            lines.append('{}: {}'.format(weekday, ', '.join(
+                '{}:00-{}:00'.format(start, end) for start, end in ranges
+            )))
+        elif weekday not in WEEKDAYS[5:]:
+            lines.append('{}: normalmente no hay nadie'.format(weekday))
+
+    lines.append('\n_Según los datos desde el {}._'.format(first.strftime('%d/%m/%Y')))
+
+    return '\n'.join(lines)
 
 
 @add_handlers
-class AltRoomHandler(DafiRoom):
-    '''Alternative room handler'''
+class RoomScheduleHandler(BasicBotHandler):
+    '''Usual schedule of the rooms'''
+
+    cmd = 'horario'
+
+    def command(self, update, context):
+        if context.args:
+            room = get_room(context.args[0].lower().lstrip('/'))
 
-    cmd = 'repro'
-    query_prefix = 'repro'
+            if not room:
+                return 'La sala indicada no existe'
 
-    members_list_key = ALT_ROOM_MEMBERS_LIST
-    queue_list_key = ALT_ROOM_QUEUE_LIST
+            return render_schedule(room)
 
-    management_permission = 'bot.can_change_alt_room_state'
+        rooms = list(get_rooms().values())
 
-    room_name = 'Reprografía'
-    room_name_long = 'reprografía'
+        if not rooms:
+            return 'No hay ninguna sala'
 
+        if len(rooms) > 1:
+            return 'Indica la sala: {}'.format(', '.join(
+                '`/horario {}`'.format(room.command) for room in rooms
+            ))
 
-@add_job(schedule.every().day.at('21:10'))
+        return render_schedule(rooms[0])
+
+
+@add_job(schedule.every().day.at(CLOSING_TIME.strftime('%H:%M')))
 def remind_remaining_room_members(bot):
     msg_pat = (
         '¡Oye! Parece que te has dejado activado el '
@@ -208,17 +388,14 @@ def remind_remaining_room_members(bot):
         'ejecutar `/{0} off` para salir.'
     )
 
-    commands = [
-        (ROOM_MEMBERS_LIST, 'dafi'),
-        (ALT_ROOM_MEMBERS_LIST, 'repro'),
-    ]
+    members = defaultdict(list)
 
-    for list_key, cmd in commands:
-        members = persistence.get_item(list_key, [])
+    for command, telegram_id in (
+        RoomPresence.objects
+        .filter(room__active=True, user__telegram_id__isnull=False)
+        .values_list('room__command', 'user__telegram_id')
+    ):
+        members[command].append(telegram_id)
 
-        msg = msg_pat.format(cmd)
-
-        for member in members:
-            bot.send_message(
-                member.telegram_id, msg, parse_mode=ParseMode.MARKDOWN
-            )
+    for command, telegram_ids in members.items():
+        fan_out(bot, telegram_ids, msg_pat.format(command), ParseMode.MARKDOWN)
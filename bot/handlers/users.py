@@ -5,7 +5,9 @@ from django.contrib.auth.models import Group
 
 from main.utils import get_url
 
-from ..utils import create_reply_markup, create_users_list
+from ..broadcast import fan_out
+from ..notifications import queue_message
+from ..utils import create_reply_markup, create_users_messages, escape_markdown
 
 from .handlers import add_handlers, BasicBotHandler
 
@@ -34,9 +36,11 @@ class ViewGroupsPermissions(BasicBotHandler):
         if not group:
             return 'No he encontrado el grupo especificado 😓'
 
-        msg = '*Usuarios en el grupo {}*:\n'.format(group.name)
+        header = '*Usuarios en el grupo {}*:\n'.format(escape_markdown(group.name, 'bold'))
 
-        return msg + create_users_list(group.user_set.all())
+        users = group.user_set.only('first_name', 'last_name', 'telegram_id')
+
+        return create_users_messages(users.iterator(), header)
 
 
 @add_handlers
@@ -47,6 +51,8 @@ class BroadcastToGroup(BasicBotHandler):
 
     user_required = True
 
+    max_concurrency = 1
+
     def user_filter(self, user):
         return user.has_perm('bot.can_manage_permissions')
 
@@ -63,30 +69,33 @@ class BroadcastToGroup(BasicBotHandler):
             return 'No he encontrado el grupo especificado 😓'
 
         sent_text = 'Mensaje para miembros de *{}*:\n\n_{}_'.format(
-            group.name, text
+            escape_markdown(group.name, 'bold'), escape_markdown(text, 'italic')
+        )
+
+        telegram_ids = list(
+            group.user_set
+            .filter(telegram_id__isnull=False)
+            .values_list('telegram_id', flat=True)
         )
 
-        sent = 0
-        fails = 0
+        if not telegram_ids:
+            return 'No hay usuarios con Telegram en el grupo especificado 😓'
+
+        chat_id = update.effective_chat.id
 
-        for user in group.user_set.all():
-            try:
-                context.bot.send_message(
-                    user.telegram_id, sent_text, ParseMode.MARKDOWN
-                )
+        def done(report):
+            msg = 'Mensaje enviado a {} usuarios:\n\n_{}_'.format(
+                len(report.sent), escape_markdown(text, 'italic')
+            )
 
-                sent += 1
-            except:
-                # So many errors can occur here but it's a simple
-                # notification, so we'll just ignore a failed one
-                fails += 1
+            if report.failed:
+                msg += '\n\nNo se pudo enviar a {} usuarios.'.format(len(report.failed))
 
-        msg = 'Mensaje enviado a {} usuarios:\n\n_{}_'.format(sent, text)
+            queue_message(chat_id, msg, ParseMode.MARKDOWN)
 
-        if fails:
-            msg += '\n\nNo se pudo enviar a {} usuarios.'.format(fails)
+        fan_out(context.bot, telegram_ids, sent_text, ParseMode.MARKDOWN, done)
 
-        return msg
+        return 'Enviando mensaje a {} usuarios...'.format(len(telegram_ids))
 
 
 class UserPermissionsMixin(BasicBotHandler):
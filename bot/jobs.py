@@ -1,24 +1,150 @@
+import heapq
+import logging
 import schedule
 import threading
 
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import count
+from time import monotonic
+
+logger = logging.getLogger(__name__)
 
 _jobs = []
 
 
+class ScheduledJob():
+    '''Job in the scheduler with its timing statistics'''
+
+    def __init__(self, timing, func, *args):
+        self.timing = timing
+
+        # Keeps the job out of the schedule default scheduler, we run it
+        timing.scheduler = _registry
+        timing.do(func, *args)
+
+        self.name = getattr(func, '__name__', repr(func))
+
+        self.runs = 0
+        self.skipped = 0
+        self.failed = 0
+        self.running = False
+
+        self.last_drift = 0
+        self.max_drift = 0
+        self.last_runtime = 0
+        self.total_runtime = 0
+
+    @property
+    def next_run(self):
+        return self.timing.next_run
+
+    def reschedule(self):
+        self.timing.last_run = datetime.now()
+        self.timing._schedule_next_run()
+
+    def run(self, due):
+        self.running = True
+        start = monotonic()
+
+        drift = (datetime.now() - due).total_seconds()
+        self.last_drift = drift
+        self.max_drift = max(self.max_drift, drift)
+
+        try:
+            self.timing.job_func()
+        except Exception:
+            self.failed += 1
+            logger.exception('Error running job %s', self.name)
+        finally:
+            self.last_runtime = monotonic() - start
+            self.total_runtime += self.last_runtime
+            self.runs += 1
+            self.running = False
+
+    def __str__(self):
+        return '{} (next: {:%Y-%m-%d %H:%M:%S}, runs: {}, skipped: {}, failed: {}, drift: {:.3f}s (max {:.3f}s), runtime: {:.3f}s (avg {:.3f}s))'.format(
+            self.name, self.next_run, self.runs, self.skipped, self.failed,
+            self.last_drift, self.max_drift, self.last_runtime,
+            self.total_runtime / self.runs if self.runs else 0
+        )
+
+
 class SchedulerThread(threading.Thread):
-    '''Thread that runs scheduled jobs'''
+    '''
+    Thread that runs scheduled jobs. It sleeps until the next job is due
+    (or a job is added or it is stopped) and runs the jobs in a worker pool
+    so a slow job does not delay the rest.
+    '''
+
+    def __init__(self, workers=4):
+        super().__init__(name='scheduler')
+
+        self.stopper = threading.Event()
+        self.jobs = []
+
+        self._workers = workers
+        self._heap = []
+        self._seq = count()
+        self._cond = threading.Condition()
 
-    stopper = threading.Event()
+    def add(self, job):
+        with self._cond:
+            self.jobs.append(job)
+            self._push(job)
+            self._cond.notify()
 
-    @classmethod
-    def run(cls):
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+
+    def stop(self):
+        with self._cond:
+            self.stopper.set()
+            self._cond.notify()
+
+    def _next_due(self):
+        '''Waits for the next due job, returns None when stopped'''
+
+        with self._cond:
+            while not self.stopper.is_set():
+                if self._heap:
+                    due, _, job = self._heap[0]
+                    wait = (due - datetime.now()).total_seconds()
+
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        return due, job
+                else:
+                    wait = None
+
+                self._cond.wait(wait)
+
+    def run(self):
         print('Scheduler thread started!')
 
-        while not cls.stopper.is_set():
-            schedule.run_pending()
-            sleep(1)
+        with ThreadPoolExecutor(self._workers, thread_name_prefix='job') as executor:
+            while True:
+                item = self._next_due()
+
+                if not item:
+                    break
+
+                due, job = item
 
+                if job.running:
+                    # Never run the same job twice at the same time
+                    job.skipped += 1
+                else:
+                    job.running = True
+                    executor.submit(job.run, due)
+
+                with self._cond:
+                    job.reschedule()
+                    self._push(job)
+
+
+_registry = schedule.Scheduler()
+_scheduler = SchedulerThread()
 
 def add_job(timing):
     '''Decorator to add a job to the scheduler'''
@@ -29,10 +155,25 @@ def add_job(timing):
 
     return decorator
 
+def schedule_job(timing, func, *args):
+    '''Adds a function to the scheduler right away'''
+
+    _scheduler.add(ScheduledJob(timing, func, *args))
+
 def load_jobs(bot):
     '''Loads all the scheduled jobs into the scheduler'''
 
     for timing, job in _jobs:
-        timing.do(job, bot)
+        schedule_job(timing, job, bot)
 
     _jobs.clear()
+
+def start_scheduler():
+    _scheduler.start()
+
+def stop_scheduler():
+    _scheduler.stop()
+    _scheduler.join()
+
+def get_jobs():
+    return list(_scheduler.jobs)
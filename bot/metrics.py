@@ -0,0 +1,332 @@
+'''
+Performance metrics of the bot handlers: calls, errors, latency and the
+database queries and Telegram API calls made by every handler action.
+'''
+
+import threading
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from time import monotonic
+
+from telegram.utils.request import Request
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+# Handler and action of the work done outside the handlers (jobs, outbox...)
+BACKGROUND = ('background', '-')
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+class Histogram():
+    '''Latency histogram with fixed buckets'''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p):
+        '''Upper bound of the bucket holding the `p` percentile'''
+
+        if not self.count:
+            return 0
+
+        target = p * self.count
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+
+            if total >= target:
+                return bound
+
+        return self.buckets[-1]
+
+    def cumulative(self):
+        '''(upper bound, observations under it) pairs, like Prometheus'''
+
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class ActionStats():
+    '''Metrics of a handler action'''
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.latency = Histogram()
+
+        self.db_queries = 0
+        self.db_time = 0
+
+        self.api_calls = 0
+        self.api_time = 0
+
+    def per_call(self, value):
+        '''Average of `value` per call (the total if there were no tracked calls)'''
+
+        return value / self.calls if self.calls else value
+
+
+_stats = {}
+
+# (handler, reason) -> updates dropped before reaching the handler
+_dropped = {}
+
+# Name -> (description, type, value) of the metrics without labels
+_values = {}
+
+def _get_stats(key):
+    stats = _stats.get(key)
+
+    if not stats:
+        with _lock:
+            stats = _stats.setdefault(key, ActionStats())
+
+    return stats
+
+def _current():
+    return getattr(_local, 'stats', None) or _get_stats(BACKGROUND)
+
+@contextmanager
+def track(handler, action):
+    '''Records the calls, errors and latency of the code in the block'''
+
+    stats = _get_stats((handler, action or '-'))
+
+    previous = getattr(_local, 'stats', None)
+    _local.stats = stats
+
+    start = monotonic()
+
+    try:
+        yield stats
+    except Exception:
+        with _lock:
+            stats.errors += 1
+
+        raise
+    finally:
+        elapsed = monotonic() - start
+        _local.stats = previous
+
+        with _lock:
+            stats.calls += 1
+            stats.latency.observe(elapsed)
+
+def record_query(elapsed):
+    stats = _current()
+
+    with _lock:
+        stats.db_queries += 1
+        stats.db_time += elapsed
+
+def record_api_call(elapsed):
+    stats = _current()
+
+    with _lock:
+        stats.api_calls += 1
+        stats.api_time += elapsed
+
+def record_dropped(handler, reason):
+    key = (handler, reason)
+
+    with _lock:
+        _dropped[key] = _dropped.get(key, 0) + 1
+
+def set_value(name, value, description, kind='gauge'):
+    with _lock:
+        _values[name] = (description, kind, value)
+
+def get_values():
+    '''Sorted list of (name, (description, type, value))'''
+
+    with _lock:
+        return sorted(_values.items())
+
+def get_stats():
+    '''Sorted list of ((handler, action), stats)'''
+
+    with _lock:
+        return sorted(_stats.items())
+
+def get_dropped():
+    '''Sorted list of ((handler, reason), dropped updates)'''
+
+    with _lock:
+        return sorted(_dropped.items())
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _dropped.clear()
+
+
+def _query_wrapper(execute, sql, params, many, context):
+    start = monotonic()
+
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record_query(monotonic() - start)
+
+def _connection_created(sender, connection, **kwargs):
+    if _query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_query_wrapper)
+
+def install():
+    '''Counts the queries of every database connection'''
+
+    from django.db import connections
+    from django.db.backends.signals import connection_created
+
+    connection_created.connect(_connection_created)
+
+    for connection in connections.all():
+        _connection_created(None, connection)
+
+
+class MetricsRequest(Request):
+    '''Telegram API request that records the number and time of the calls'''
+
+    def post(self, url, data, timeout=None):
+        start = monotonic()
+
+        try:
+            return super().post(url, data, timeout)
+        finally:
+            record_api_call(monotonic() - start)
+
+    def retrieve(self, url, timeout=None):
+        start = monotonic()
+
+        try:
+            return super().retrieve(url, timeout)
+        finally:
+            record_api_call(monotonic() - start)
+
+
+def _format_labels(**labels):
+    return ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+
+def export():
+    '''Returns the metrics in the Prometheus text format'''
+
+    counters = (
+        ('bot_handler_calls_total', 'Handler actions run', 'calls'),
+        ('bot_handler_errors_total', 'Handler actions that raised an error', 'errors'),
+        ('bot_handler_db_queries_total', 'Database queries run', 'db_queries'),
+        ('bot_handler_db_seconds_total', 'Time spent in database queries', 'db_time'),
+        ('bot_handler_api_calls_total', 'Telegram API calls made', 'api_calls'),
+        ('bot_handler_api_seconds_total', 'Time spent in Telegram API calls', 'api_time'),
+    )
+
+    stats = get_stats()
+    lines = []
+
+    for name, description, attr in counters:
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} counter'.format(name))
+
+        for (handler, action), s in stats:
+            lines.append('{}{{{}}} {}'.format(
+                name, _format_labels(handler=handler, action=action), getattr(s, attr)
+            ))
+
+    name = 'bot_handler_latency_seconds'
+
+    lines.append('# HELP {} Handler action latency'.format(name))
+    lines.append('# TYPE {} histogram'.format(name))
+
+    for (handler, action), s in stats:
+        for bound, count in s.latency.cumulative():
+            le = '+Inf' if bound == float('inf') else bound
+
+            lines.append('{}_bucket{{{}}} {}'.format(
+                name, _format_labels(handler=handler, action=action, le=le), count
+            ))
+
+        labels = _format_labels(handler=handler, action=action)
+
+        lines.append('{}_sum{{{}}} {}'.format(name, labels, s.latency.sum))
+        lines.append('{}_count{{{}}} {}'.format(name, labels, s.latency.count))
+
+    name = 'bot_updates_dropped_total'
+
+    lines.append('# HELP {} Updates dropped by the flood control'.format(name))
+    lines.append('# TYPE {} counter'.format(name))
+
+    for (handler, reason), count in get_dropped():
+        lines.append('{}{{{}}} {}'.format(
+            name, _format_labels(handler=handler, reason=reason), count
+        ))
+
+    for name, (description, kind, value) in get_values():
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        lines.append('{} {}'.format(name, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        payload = export().encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+def start_exporter(port, host='127.0.0.1'):
+    '''Serves the metrics at http://`host`:`port`/metrics'''
+
+    global _server
+
+    _server = _Server((host, port), _MetricsHandler)
+
+    threading.Thread(
+        target=_server.serve_forever, name='metrics-exporter', daemon=True
+    ).start()
+
+def stop_exporter():
+    global _server
+
+    if _server:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,25 @@
+# Generated by Django 2.1.15 on 2026-10-18 06:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0003_bot_permissions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersistentItem',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='clave')),
+                ('value', models.BinaryField(verbose_name='valor')),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='actualizado')),
+            ],
+            options={
+                'verbose_name': 'dato persistente',
+                'verbose_name_plural': 'datos persistentes',
+            },
+        ),
+    ]
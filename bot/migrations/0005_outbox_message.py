@@ -0,0 +1,38 @@
+# Generated by Django 2.1.15 on 2026-10-18 06:38
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0004_persistent_item'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='chat')),
+                ('text', models.TextField(verbose_name='texto')),
+                ('reply_markup', models.TextField(blank=True, verbose_name='botones')),
+                ('status', models.CharField(choices=[('pending', 'Pendiente'), ('sent', 'Enviado'), ('failed', 'Fallido')], default='pending', max_length=16, verbose_name='estado')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='intentos')),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='siguiente intento')),
+                ('last_error', models.TextField(blank=True, verbose_name='último error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='creado')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='enviado')),
+            ],
+            options={
+                'verbose_name': 'mensaje saliente',
+                'verbose_name_plural': 'mensajes salientes',
+                'ordering': ('pk',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'next_attempt'], name='bot_outboxm_status_928421_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-18 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_outbox_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxmessage',
+            name='parse_mode',
+            field=models.CharField(blank=True, max_length=16, verbose_name='formato'),
+        ),
+    ]
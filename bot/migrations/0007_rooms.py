@@ -0,0 +1,70 @@
+# Generated by Django 2.1.15 on 2026-10-18 07:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bot', '0006_outbox_parse_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Room',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.SlugField(help_text='Comando del bot de la sala, sin la barra (por ejemplo: dafi).', max_length=32, unique=True, verbose_name='comando')),
+                ('name', models.CharField(max_length=64, verbose_name='nombre')),
+                ('name_long', models.CharField(help_text='Usado en frases como "En la delegación están...".', max_length=64, verbose_name='nombre en frases')),
+                ('permission', models.CharField(default='bot.can_change_room_state', help_text='Permiso necesario para anotarse en la sala (app.codename).', max_length=128, verbose_name='permiso')),
+                ('notify_group', models.CharField(default='main_telegram_group', help_text='Clave de la entrada de configuración con el grupo de Telegram avisado.', max_length=64, verbose_name='grupo de avisos')),
+                ('active', models.BooleanField(default=True, verbose_name='activa')),
+            ],
+            options={
+                'verbose_name': 'sala',
+                'verbose_name_plural': 'salas',
+                'ordering': ('command',),
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomPresence',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField(default=django.utils.timezone.now, verbose_name='desde')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presences', to='bot.Room', verbose_name='sala')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='usuario')),
+            ],
+            options={
+                'verbose_name': 'presencia en sala',
+                'verbose_name_plural': 'presencias en salas',
+                'ordering': ('since', 'pk'),
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomQueueEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_id', models.BigIntegerField(verbose_name='ID de Telegram')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='creado')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queue', to='bot.Room', verbose_name='sala')),
+            ],
+            options={
+                'verbose_name': 'espera de sala',
+                'verbose_name_plural': 'esperas de salas',
+                'ordering': ('pk',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='roomqueueentry',
+            unique_together={('room', 'telegram_id')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='roompresence',
+            unique_together={('room', 'user')},
+        ),
+    ]
@@ -0,0 +1,117 @@
+import dbm
+import io
+import pickle
+
+from django.conf import settings
+from django.db import migrations
+
+# Legacy shelve storage, imported in the database by the bot when it starts,
+# so on an upgrade the state of the rooms can still be there
+SHELVE_FILE = 'botstorage'
+
+ROOMS = (
+    # command, name, name_long, permission, (members key, queue key)
+    ('dafi', 'DAFI', 'la delegación', 'bot.can_change_room_state',
+     ('room_members', 'room_queue')),
+    ('repro', 'Reprografía', 'reprografía', 'bot.can_change_alt_room_state',
+     ('alt_room_members', 'alt_room_queue')),
+)
+
+
+class RoomMember():
+    '''Stand-in for the removed class of the members saved by the bot'''
+
+
+class StateUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) == ('bot.handlers.rooms', 'RoomMember'):
+            return RoomMember
+
+        return super().find_class(module, name)
+
+
+def unpickle(data):
+    try:
+        return StateUnpickler(io.BytesIO(bytes(data))).load()
+    except Exception:
+        # The state is temporary, it is not worth failing the migration
+        return None
+
+def load_shelve():
+    '''Pickled values of the legacy shelve storage by key'''
+
+    if not dbm.whichdb(SHELVE_FILE):
+        return {}
+
+    with dbm.open(SHELVE_FILE, 'r') as db:
+        return {key.decode(): db[key] for key in db.keys()}
+
+def load_item(PersistentItem, shelf, key):
+    item = PersistentItem.objects.filter(key=key).first()
+
+    if item:
+        return unpickle(item.value)
+
+    if key in shelf:
+        return unpickle(shelf[key])
+
+    return None
+
+
+def create_rooms(apps, schema_editor):
+    PersistentItem = apps.get_model('bot', 'PersistentItem')
+    Room = apps.get_model('bot', 'Room')
+    RoomPresence = apps.get_model('bot', 'RoomPresence')
+    RoomQueueEntry = apps.get_model('bot', 'RoomQueueEntry')
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+
+    shelf = load_shelve()
+
+    for command, name, name_long, permission, keys in ROOMS:
+        room = Room.objects.create(
+            command=command, name=name, name_long=name_long, permission=permission
+        )
+
+        members_key, queue_key = keys
+        members = load_item(PersistentItem, shelf, members_key) or {}
+        queue = load_item(PersistentItem, shelf, queue_key) or {}
+
+        if isinstance(members, list):
+            # Oldest format: list of users
+            user_ids = [user.pk for user in members]
+            since = {}
+        else:
+            user_ids = [member.user_id for member in members.values()]
+            since = {member.user_id: member.since for member in members.values()}
+
+        existing = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+        for user_id in user_ids:
+            if user_id in existing:
+                presence = RoomPresence(room=room, user_id=user_id)
+
+                if since.get(user_id):
+                    presence.since = since[user_id]
+
+                presence.save()
+
+        for telegram_id in queue:
+            RoomQueueEntry.objects.create(room=room, telegram_id=telegram_id)
+
+        PersistentItem.objects.filter(key__in=keys).delete()
+
+def delete_rooms(apps, schema_editor):
+    Room = apps.get_model('bot', 'Room')
+    Room.objects.filter(command__in=[room[0] for room in ROOMS]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bot', '0007_rooms'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rooms, delete_rooms),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 2.1.15 on 2026-10-18 07:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('bot', '0008_default_rooms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('on', 'Entrada'), ('off', 'Salida')], max_length=3, verbose_name='tipo')),
+                ('date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='fecha')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='bot.Room', verbose_name='sala')),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='usuario')),
+            ],
+            options={
+                'verbose_name': 'evento de sala',
+                'verbose_name_plural': 'eventos de salas',
+                'ordering': ('date', 'pk'),
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomHourlyOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='día')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='hora')),
+                ('seconds', models.PositiveIntegerField(default=0, verbose_name='segundos')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hourly_occupancy', to='bot.Room', verbose_name='sala')),
+            ],
+            options={
+                'verbose_name': 'ocupación por hora',
+                'verbose_name_plural': 'ocupación por horas',
+                'ordering': ('date', 'hour'),
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomWeekdayOccupancy',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(verbose_name='día de la semana')),
+                ('hour', models.PositiveSmallIntegerField(verbose_name='hora')),
+                ('seconds', models.PositiveIntegerField(default=0, verbose_name='segundos')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='weekday_occupancy', to='bot.Room', verbose_name='sala')),
+            ],
+            options={
+                'verbose_name': 'ocupación por día de la semana',
+                'verbose_name_plural': 'ocupación por días de la semana',
+                'ordering': ('weekday', 'hour'),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='roomweekdayoccupancy',
+            unique_together={('room', 'weekday', 'hour')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='roomhourlyoccupancy',
+            unique_together={('room', 'date', 'hour')},
+        ),
+    ]
@@ -1,4 +1,6 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class BotPermissions(models.Model):
@@ -13,3 +15,228 @@ class BotPermissions(models.Model):
             ('can_manage_elections', 'Puede gestionar operaciones del periodo de elecciones'),
             ('can_manage_permissions', 'Puede gestionar permisos de usuarios'),
         )
+
+
+class PersistentItem(models.Model):
+    '''Bot persistent data entry'''
+
+    key = models.CharField(
+        'clave', max_length=64, primary_key=True
+    )
+
+    value = models.BinaryField('valor')
+
+    updated = models.DateTimeField('actualizado', auto_now=True)
+
+    class Meta:
+        verbose_name = 'dato persistente'
+        verbose_name_plural = 'datos persistentes'
+
+    def __str__(self):
+        return self.key
+
+
+class OutboxMessage(models.Model):
+    '''Telegram message queued by the website or the bot to be sent by the bot'''
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pendiente'),
+        (STATUS_SENT, 'Enviado'),
+        (STATUS_FAILED, 'Fallido'),
+    )
+
+    chat_id = models.BigIntegerField('chat')
+
+    text = models.TextField('texto')
+
+    reply_markup = models.TextField('botones', blank=True)
+
+    parse_mode = models.CharField('formato', max_length=16, blank=True)
+
+    status = models.CharField(
+        'estado', max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+
+    attempts = models.PositiveSmallIntegerField('intentos', default=0)
+
+    next_attempt = models.DateTimeField('siguiente intento', default=timezone.now)
+
+    last_error = models.TextField('último error', blank=True)
+
+    created = models.DateTimeField('creado', auto_now_add=True)
+
+    sent = models.DateTimeField('enviado', blank=True, null=True)
+
+    class Meta:
+        verbose_name = 'mensaje saliente'
+        verbose_name_plural = 'mensajes salientes'
+
+        ordering = ('pk',)
+
+        indexes = [
+            models.Index(fields=['status', 'next_attempt']),
+        ]
+
+    def __str__(self):
+        return '{} ({})'.format(self.chat_id, self.get_status_display())
+
+
+class Room(models.Model):
+    '''Room whose presence is tracked by the bot with its own command'''
+
+    command = models.SlugField(
+        'comando', max_length=32, unique=True,
+        help_text='Comando del bot de la sala, sin la barra (por ejemplo: dafi).'
+    )
+
+    name = models.CharField('nombre', max_length=64)
+
+    name_long = models.CharField(
+        'nombre en frases', max_length=64,
+        help_text='Usado en frases como "En la delegación están...".'
+    )
+
+    permission = models.CharField(
+        'permiso', max_length=128, default='bot.can_change_room_state',
+        help_text='Permiso necesario para anotarse en la sala (app.codename).'
+    )
+
+    notify_group = models.CharField(
+        'grupo de avisos', max_length=64, default='main_telegram_group',
+        help_text='Clave de la entrada de configuración con el grupo de Telegram avisado.'
+    )
+
+    active = models.BooleanField('activa', default=True)
+
+    class Meta:
+        verbose_name = 'sala'
+        verbose_name_plural = 'salas'
+
+        ordering = ('command',)
+
+    def __str__(self):
+        return self.name
+
+
+class RoomPresence(models.Model):
+    '''User in a room'''
+
+    room = models.ForeignKey(
+        Room, models.CASCADE, related_name='presences', verbose_name='sala'
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, models.CASCADE, verbose_name='usuario'
+    )
+
+    since = models.DateTimeField('desde', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'presencia en sala'
+        verbose_name_plural = 'presencias en salas'
+
+        ordering = ('since', 'pk')
+        unique_together = (('room', 'user'),)
+
+    def __str__(self):
+        return '{} en {}'.format(self.user, self.room)
+
+
+class RoomQueueEntry(models.Model):
+    '''Telegram user waiting to be notified when someone arrives to a room'''
+
+    room = models.ForeignKey(
+        Room, models.CASCADE, related_name='queue', verbose_name='sala'
+    )
+
+    telegram_id = models.BigIntegerField('ID de Telegram')
+
+    created = models.DateTimeField('creado', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'espera de sala'
+        verbose_name_plural = 'esperas de salas'
+
+        ordering = ('pk',)
+        unique_together = (('room', 'telegram_id'),)
+
+    def __str__(self):
+        return '{} en {}'.format(self.telegram_id, self.room)
+
+
+class RoomEvent(models.Model):
+    '''Entry or exit of a user in a room, never changed once saved'''
+
+    KIND_ON = 'on'
+    KIND_OFF = 'off'
+
+    KIND_CHOICES = (
+        (KIND_ON, 'Entrada'),
+        (KIND_OFF, 'Salida'),
+    )
+
+    room = models.ForeignKey(
+        Room, models.CASCADE, related_name='events', verbose_name='sala'
+    )
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, models.SET_NULL, null=True, verbose_name='usuario'
+    )
+
+    kind = models.CharField('tipo', max_length=3, choices=KIND_CHOICES)
+
+    date = models.DateTimeField('fecha', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'evento de sala'
+        verbose_name_plural = 'eventos de salas'
+
+        ordering = ('date', 'pk')
+
+    def __str__(self):
+        return '{} {} ({})'.format(self.user, self.get_kind_display().lower(), self.room)
+
+
+class RoomHourlyOccupancy(models.Model):
+    '''Seconds spent by the members of a room in an hour of a day'''
+
+    room = models.ForeignKey(
+        Room, models.CASCADE, related_name='hourly_occupancy', verbose_name='sala'
+    )
+
+    date = models.DateField('día')
+    hour = models.PositiveSmallIntegerField('hora')
+
+    seconds = models.PositiveIntegerField('segundos', default=0)
+
+    class Meta:
+        verbose_name = 'ocupación por hora'
+        verbose_name_plural = 'ocupación por horas'
+
+        ordering = ('date', 'hour')
+        unique_together = (('room', 'date', 'hour'),)
+
+
+class RoomWeekdayOccupancy(models.Model):
+    '''Seconds spent by the members of a room in an hour of a weekday, ever'''
+
+    room = models.ForeignKey(
+        Room, models.CASCADE, related_name='weekday_occupancy', verbose_name='sala'
+    )
+
+    # 0 is Monday
+    weekday = models.PositiveSmallIntegerField('día de la semana')
+    hour = models.PositiveSmallIntegerField('hora')
+
+    seconds = models.PositiveIntegerField('segundos', default=0)
+
+    class Meta:
+        verbose_name = 'ocupación por día de la semana'
+        verbose_name_plural = 'ocupación por días de la semana'
+
+        ordering = ('weekday', 'hour')
+        unique_together = (('room', 'weekday', 'hour'),)
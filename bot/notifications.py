@@ -1,16 +1,30 @@
-import os
+from django.db import transaction
 
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
 from main.utils import get_domain
 
-_bot = None
+from .models import OutboxMessage
+from .outbox import wake
 
-if 'BOT_TOKEN' in os.environ:
-    _bot = Bot(os.environ['BOT_TOKEN'])
+def queue_message(chat_id, text, parse_mode=None, reply_markup=None):
+    '''
+    Queues a message in the outbox. It is saved with the current transaction
+    and sent by the bot once it is committed, retrying it while the Telegram
+    API is failing. Used for the messages nobody is waiting for.
+    '''
+
+    OutboxMessage.objects.create(
+        chat_id=chat_id, text=text, parse_mode=parse_mode or '',
+        reply_markup=reply_markup.to_json() if reply_markup else ''
+    )
+
+    transaction.on_commit(wake)
 
 def telegram_notify(user, message, url=None, url_button=None):
-    if not _bot or not user.telegram_id:
+    '''Queues a Telegram message for the user'''
+
+    if not user.telegram_id:
         return False
 
     reply_markup = None
@@ -20,4 +34,6 @@ def telegram_notify(user, message, url=None, url_button=None):
             InlineKeyboardButton(url_button, url=get_domain() + str(url)),
         ]])
 
-    _bot.send_message(user.telegram_id, message, reply_markup=reply_markup)
+    queue_message(user.telegram_id, message, reply_markup=reply_markup)
+
+    return True
@@ -0,0 +1,143 @@
+'''
+Occupancy of the rooms. Every entry and exit is appended to the event log and
+the time spent by the member is added to the hourly and weekday rollups when
+they leave, so the schedules are read from at most 168 rows per room no matter
+how much history there is.
+'''
+
+from datetime import datetime, time, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from .models import RoomHourlyOccupancy, RoomWeekdayOccupancy
+
+WEEKDAYS = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+
+# Average number of members from which a room is considered staffed in an hour
+STAFFED_THRESHOLD = 0.5
+
+HOUR = timedelta(hours=1)
+
+# The faculty closes at this (local) time, the members still in a room are
+# reminded to leave it and the time after it is not counted
+CLOSING_TIME = time(21, 10)
+
+# Longest presence counted, for the ones started after the closing time
+MAX_PRESENCE = timedelta(hours=12)
+
+
+def split_hours(start, end):
+    '''
+    Splits a period in the local hours it spans. Yields (date, weekday, hour,
+    seconds) tuples.
+    '''
+
+    # Hours are split in UTC, the local time zone offsets are whole hours
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
+
+    while start < end:
+        next_hour = start.replace(minute=0, second=0, microsecond=0) + HOUR
+        chunk_end = min(next_hour, end)
+
+        local = timezone.localtime(start)
+        seconds = round((chunk_end - start).total_seconds())
+
+        if seconds:
+            yield local.date(), local.weekday(), local.hour, seconds
+
+        start = chunk_end
+
+def clamp_presence(start, end):
+    '''
+    End of the period of a presence that is counted: the presences left on
+    overnight (or for a weekend) are only counted until the closing time.
+    '''
+
+    local = timezone.localtime(start)
+    closing = timezone.make_aware(datetime.combine(local.date(), CLOSING_TIME))
+
+    if closing <= start:
+        closing = timezone.make_aware(
+            datetime.combine(local.date() + timedelta(days=1), CLOSING_TIME)
+        )
+
+    return min(end, closing, start + MAX_PRESENCE)
+
+def _add_seconds(model, seconds, **key):
+    '''Adds the seconds to the rollup row, creating it if needed'''
+
+    if model.objects.filter(**key).update(seconds=F('seconds') + seconds):
+        return
+
+    try:
+        with transaction.atomic():
+            model.objects.create(seconds=seconds, **key)
+    except IntegrityError:
+        # Created meanwhile by another exit
+        model.objects.filter(**key).update(seconds=F('seconds') + seconds)
+
+def add_presence(room, start, end):
+    '''Adds a finished presence of a member to the rollups of the room'''
+
+    for date, weekday, hour, seconds in split_hours(start, clamp_presence(start, end)):
+        _add_seconds(RoomHourlyOccupancy, seconds, room=room, date=date, hour=hour)
+        _add_seconds(RoomWeekdayOccupancy, seconds, room=room, weekday=weekday, hour=hour)
+
+def count_weekdays(first, last):
+    '''Number of times every weekday appears between two dates, both included'''
+
+    days = (last - first).days + 1
+
+    return [
+        max(0, (days - (weekday - first.weekday()) % 7 + 6) // 7)
+        for weekday in range(7)
+    ]
+
+def get_weekly_occupancy(room, today=None):
+    '''
+    Average number of members of the room in every hour of every weekday since
+    the first day recorded. Returns the first day and a list of 7 lists of 24
+    floats, or None if there is no data.
+    '''
+
+    first = (
+        RoomHourlyOccupancy.objects
+        .filter(room=room)
+        .aggregate(first=Min('date'))['first']
+    )
+
+    if not first:
+        return None
+
+    today = today or timezone.localdate()
+    counts = count_weekdays(first, max(first, today))
+
+    occupancy = [[0] * 24 for _ in range(7)]
+
+    for weekday, hour, seconds in (
+        RoomWeekdayOccupancy.objects
+        .filter(room=room)
+        .values_list('weekday', 'hour', 'seconds')
+    ):
+        if counts[weekday]:
+            occupancy[weekday][hour] = seconds / 3600 / counts[weekday]
+
+    return first, occupancy
+
+def get_staffed_ranges(hours, threshold=STAFFED_THRESHOLD):
+    '''Ranges of consecutive hours of a day with occupancy, as (start, end)'''
+
+    ranges = []
+    start = None
+
+    for hour, value in enumerate(list(hours) + [0]):
+        if value >= threshold and start is None:
+            start = hour
+        elif value < threshold and start is not None:
+            ranges.append((start, hour))
+            start = None
+
+    return ranges
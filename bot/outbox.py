@@ -0,0 +1,283 @@
+'''
+Delivery of the messages queued in the outbox by the website. The website
+saves the messages in its own transaction and, once committed, wakes the bot
+up with an UDP datagram, so the table does not need to be polled often.
+'''
+
+import json
+import logging
+import schedule
+import socket
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from os import getenv
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import (
+    BadRequest, ChatMigrated, NetworkError, RetryAfter, TelegramError
+)
+
+from .api import CircuitOpen
+from .jobs import add_job
+from .ratelimit import chat_bucket, global_bucket
+
+logger = logging.getLogger(__name__)
+
+# Days the sent messages are kept in the outbox
+SENT_RETENTION_DAYS = 30
+
+
+def get_wake_address():
+    return (
+        getenv('BOT_OUTBOX_HOST', '127.0.0.1'),
+        int(getenv('BOT_OUTBOX_PORT', 8442)),
+    )
+
+def wake(address=None):
+    '''Tells the bot there are new messages in the outbox'''
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b'1', address or get_wake_address())
+    except OSError:
+        # The bot will find the message the next time it checks the outbox
+        pass
+
+
+class OutboxSender(threading.Thread):
+    '''
+    Thread that sends the pending outbox messages in batches, keeping under
+    the Telegram rate limits. Failed messages are retried with an exponential
+    backoff and marked as failed (dead-lettered) after `max_attempts`.
+    '''
+
+    batch_size = 50
+    workers = 4
+
+    max_attempts = 5
+
+    # Seconds before the first retry, doubled on every attempt
+    backoff = 30
+
+    # Maximum seconds between checks of the outbox without being woken up
+    poll_interval = 300
+
+    def __init__(self, bot, address=None):
+        super().__init__(name='outbox', daemon=True)
+
+        self.bot = bot
+        self.address = address or get_wake_address()
+        self.stopper = threading.Event()
+
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    @property
+    def model(self):
+        from .models import OutboxMessage
+        return OutboxMessage
+
+    def send(self, message):
+        '''Sends a message, returns the error if it could not be sent'''
+
+        global_bucket.acquire()
+        chat_bucket(message.chat_id).acquire()
+
+        reply_markup = None
+
+        if message.reply_markup:
+            reply_markup = InlineKeyboardMarkup.de_json(
+                json.loads(message.reply_markup), self.bot
+            )
+
+        try:
+            self.bot.send_message(
+                message.chat_id, message.text, message.parse_mode or None,
+                reply_markup=reply_markup
+            )
+        except RetryAfter as e:
+            # Flood control is global, so every sender has to wait
+            global_bucket.pause(e.retry_after)
+            return e
+        except TelegramError as e:
+            return e
+
+    def update(self, message, error):
+        '''Saves the result of sending a message'''
+
+        from django.utils import timezone
+
+        now = timezone.now()
+
+        if isinstance(error, CircuitOpen):
+            # Not even sent, the message waits until the API works again
+            message.last_error = str(error)
+            message.next_attempt = now + timedelta(seconds=error.retry_after)
+            message.save()
+            self.retried += 1
+            return
+
+        message.attempts += 1
+
+        if error is None:
+            message.status = self.model.STATUS_SENT
+            message.sent = now
+            message.last_error = ''
+            self.sent += 1
+        else:
+            message.last_error = str(error)
+
+            if isinstance(error, ChatMigrated):
+                message.chat_id = error.new_chat_id
+                delay = 0
+            elif isinstance(error, RetryAfter):
+                delay = error.retry_after
+            elif isinstance(error, NetworkError) and not isinstance(error, BadRequest):
+                delay = self.backoff * 2 ** (message.attempts - 1)
+            else:
+                # Unauthorized, BadRequest... retrying will not help
+                delay = None
+
+            if delay is None or message.attempts >= self.max_attempts:
+                logger.warning(
+                    'Could not deliver outbox message %s to %s: %s',
+                    message.pk, message.chat_id, error
+                )
+
+                message.status = self.model.STATUS_FAILED
+                self.dead += 1
+            else:
+                message.next_attempt = now + timedelta(seconds=delay)
+                self.retried += 1
+
+        message.save()
+
+    def drain(self):
+        '''Sends all the due messages, returns the number of messages handled'''
+
+        from django.utils import timezone
+
+        handled = 0
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='outbox') as executor:
+            while not self.stopper.is_set():
+                batch = list(
+                    self.model.objects
+                    .filter(status=self.model.STATUS_PENDING, next_attempt__lte=timezone.now())
+                    [:self.batch_size]
+                )
+
+                if not batch:
+                    break
+
+                # Only the sending is concurrent, the database is always
+                # updated from this thread
+                for message, error in zip(batch, executor.map(self.send, batch)):
+                    self.update(message, error)
+
+                handled += len(batch)
+
+        return handled
+
+    def next_wait(self):
+        '''Seconds until the next pending message is due'''
+
+        from django.utils import timezone
+
+        next_attempt = (
+            self.model.objects
+            .filter(status=self.model.STATUS_PENDING)
+            .order_by('next_attempt')
+            .values_list('next_attempt', flat=True)
+            .first()
+        )
+
+        if not next_attempt:
+            return self.poll_interval
+
+        wait = (next_attempt - timezone.now()).total_seconds()
+
+        return min(max(wait, 0), self.poll_interval)
+
+    def run(self):
+        from django.db import close_old_connections, connection
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        try:
+            sock.bind(self.address)
+        except OSError as e:
+            logger.error('Could not listen for outbox wake ups on %s: %s', self.address, e)
+            sock.close()
+            sock = None
+
+        while not self.stopper.is_set():
+            close_old_connections()
+
+            try:
+                self.drain()
+                wait = self.next_wait()
+            except Exception:
+                logger.exception('Error sending the outbox messages')
+                wait = self.poll_interval
+
+            if self.stopper.is_set():
+                break
+
+            if not sock:
+                self.stopper.wait(wait)
+                continue
+
+            sock.settimeout(wait)
+
+            try:
+                sock.recv(64)
+            except socket.timeout:
+                pass
+
+        if sock:
+            sock.close()
+
+        connection.close()
+
+    def stop(self):
+        self.stopper.set()
+        wake(self.address)
+        self.join()
+
+    def __str__(self):
+        return '{} sent, {} retried, {} failed'.format(self.sent, self.retried, self.dead)
+
+
+_sender = None
+
+def start_outbox(bot):
+    global _sender
+
+    _sender = OutboxSender(bot)
+    _sender.start()
+
+def stop_outbox():
+    global _sender
+
+    if _sender:
+        _sender.stop()
+        _sender = None
+
+def get_outbox():
+    return _sender
+
+
+@add_job(schedule.every().day.at('04:00'))
+def clean_outbox(bot):
+    from django.utils import timezone
+
+    from .models import OutboxMessage
+
+    OutboxMessage.objects.filter(
+        status=OutboxMessage.STATUS_SENT,
+        sent__lt=timezone.now() - timedelta(days=SENT_RETENTION_DAYS),
+    ).delete()
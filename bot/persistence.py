@@ -1,43 +1,315 @@
+import dbm
+import pickle
 import schedule
 import shelve
+import threading
 
-_shelf = None
+from os import getenv
+from time import monotonic
 
-def load():
-    '''Loads the saved data to the memory'''
+from django.utils import timezone
 
-    global _shelf
-    _shelf = shelve.open('botstorage', writeback=True)
+from .jobs import schedule_job
+from .transactions import atomic_retry
 
-    schedule.every(5).minutes.do(_shelf.sync)
+SHELVE_FILE = 'botstorage'
+
+# Keys of the legacy storage whose data is imported in its own tables by the
+# migrations (see bot/migrations/0008_default_rooms.py)
+MIGRATED_KEYS = ('room_members', 'room_queue', 'alt_room_members', 'alt_room_queue')
+
+
+class BaseBackend():
+    '''Persistent data storage interface'''
+
+    def load(self):
+        pass
+
+    def close(self):
+        pass
+
+    def sync(self):
+        pass
+
+    def flush(self):
+        raise NotImplementedError("Must create a `flush' method in the class")
+
+    def items(self):
+        raise NotImplementedError("Must create an `items' method in the class")
+
+    def get(self, key, default):
+        raise NotImplementedError("Must create a `get' method in the class")
+
+    def set(self, key, value):
+        raise NotImplementedError("Must create a `set' method in the class")
+
+
+class ShelveBackend(BaseBackend):
+    '''Legacy storage: a single shelve file saved periodically'''
+
+    def __init__(self, filename=SHELVE_FILE):
+        self.filename = filename
+        self._shelf = None
+
+        # Shelves (and their writeback cache) are not thread safe
+        self._lock = threading.RLock()
+
+    def load(self):
+        self._shelf = shelve.open(self.filename, writeback=True)
+
+        schedule_job(schedule.every(5).minutes, self.sync)
+
+    def close(self):
+        with self._lock:
+            self._shelf.close()
+
+    def sync(self):
+        with self._lock:
+            self._shelf.sync()
+
+    def flush(self):
+        with self._lock:
+            for key in list(self._shelf.keys()):
+                del self._shelf[key]
+
+            self._shelf.sync()
+
+    def items(self):
+        with self._lock:
+            return list(self._shelf.items())
+
+    def get(self, key, default):
+        with self._lock:
+            if key not in self._shelf:
+                self._shelf[key] = default
+
+            return self._shelf[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._shelf[key] = value
+
+
+class DatabaseBackend(BaseBackend):
+    '''
+    Stores every item in its own database row. Items are loaded on first
+    use and only the changed ones are written, each one in a transaction,
+    so the data can be read from other processes at any moment.
+
+    The cached items are read again when their row was changed by another
+    process, which is checked at most every `refresh_interval` seconds, and
+    the periodic sync never overwrites those changes.
+    '''
+
+    refresh_interval = 5
+
+    def __init__(self):
+        # key -> (value, pickled value and update date as last seen in the
+        # database, time of the last check of the update date)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+        # Writes from many handler threads at once make SQLite fail with
+        # "database is locked", one row is written at a time
+        self._write_lock = threading.Lock()
+
+    @property
+    def model(self):
+        from .models import PersistentItem
+        return PersistentItem
+
+    def load(self):
+        if not self.model.objects.exists():
+            self.import_shelve()
+
+        # Catch any in place change that was not saved with `set'
+        schedule_job(schedule.every(5).minutes, self.sync)
+
+    def import_shelve(self, filename=SHELVE_FILE):
+        '''Imports the data saved by the legacy shelve storage'''
+
+        if not dbm.whichdb(filename):
+            return
+
+        with shelve.open(filename, flag='r') as shelf:
+            for key in shelf.keys():
+                if key not in MIGRATED_KEYS:
+                    self.set(key, shelf[key])
+
+    def close(self):
+        self.sync()
+        self._cache.clear()
+
+    def _write(self, key, data):
+        '''Saves the pickled value, returns the update date of the row'''
+
+        with self._write_lock:
+            item, _ = atomic_retry(
+                self.model.objects.update_or_create, key=key, defaults={'value': data}
+            )
+
+        return item.updated
+
+    def _write_unchanged(self, key, data, updated):
+        '''
+        Saves the pickled value only if the row was not changed since `updated`.
+        Returns the new update date, or None if the row was changed.
+        '''
+
+        now = timezone.now()
+
+        with self._write_lock:
+            changed = atomic_retry(
+                self.model.objects.filter(key=key, updated=updated).update,
+                value=data, updated=now
+            )
+
+        return now if changed else None
+
+    def _create(self, key, default):
+        data = pickle.dumps(default)
+
+        # Never overwrites a value set by another thread or process meanwhile
+        with self._write_lock:
+            item, created = atomic_retry(
+                self.model.objects.get_or_create, key=key, defaults={'value': data}
+            )
+
+        value = default if created else pickle.loads(item.value)
+
+        with self._lock:
+            # Another thread could have created it while reading the database
+            return self._cache.setdefault(
+                key, (value, bytes(item.value), item.updated, monotonic())
+            )[0]
+
+    def sync(self):
+        with self._lock:
+            cached = list(self._cache.items())
+
+        for key, (value, saved, updated, _) in cached:
+            data = pickle.dumps(value)
+
+            if data == saved:
+                continue
+
+            updated = self._write_unchanged(key, data, updated)
+
+            with self._lock:
+                if updated:
+                    self._cache[key] = (value, data, updated, monotonic())
+                else:
+                    # Changed by another process, its value is read again
+                    self._cache.pop(key, None)
+
+    def flush(self):
+        with self._lock:
+            self.model.objects.all().delete()
+            self._cache.clear()
+
+    def items(self):
+        return [
+            (item.key, pickle.loads(item.value))
+            for item in self.model.objects.all()
+        ]
+
+    def _is_fresh(self, key, entry):
+        '''Whether the cached item is the one in the database'''
+
+        if self.refresh_interval is None:
+            return True
+
+        if monotonic() - entry[3] < self.refresh_interval:
+            return True
+
+        updated = self.model.objects.filter(key=key).values_list('updated', flat=True).first()
+
+        if updated != entry[2]:
+            return False
+
+        with self._lock:
+            if self._cache.get(key) is entry:
+                self._cache[key] = entry[:3] + (monotonic(),)
+
+        return True
+
+    def get(self, key, default):
+        with self._lock:
+            entry = self._cache.get(key)
+
+        if entry and self._is_fresh(key, entry):
+            return entry[0]
+
+        item = self.model.objects.filter(key=key).first()
+
+        if not item:
+            with self._lock:
+                self._cache.pop(key, None)
+
+            return self._create(key, default)
+
+        value = pickle.loads(item.value)
+        entry = (value, bytes(item.value), item.updated, monotonic())
+
+        with self._lock:
+            current = self._cache.get(key)
+
+            # Another thread could have loaded it while reading the database
+            if current and current[2] == item.updated:
+                return current[0]
+
+            self._cache[key] = entry
+
+        return value
+
+    def set(self, key, value):
+        data = pickle.dumps(value)
+
+        updated = self._write(key, data)
+
+        with self._lock:
+            self._cache[key] = (value, data, updated, monotonic())
+
+        return value
+
+
+_backends = {
+    'db': DatabaseBackend,
+    'shelve': ShelveBackend,
+}
+
+_backend = None
+
+# Item key -> lock held while changing the item
+_locks = {}
+_locks_lock = threading.Lock()
+
+def load(backend=None):
+    '''Loads the persistent data backend (by default the one set in the environment)'''
+
+    global _backend
+    _backend = backend or _backends[getenv('BOT_PERSISTENCE', 'db')]()
+    _backend.load()
 
 def close():
-    '''Saves the data to the disk and closes the file'''
+    '''Saves the pending data and closes the backend'''
 
-    global _shelf
-    _shelf.close()
+    _backend.close()
 
 def sync():
-    '''Saves the data to the disk'''
+    '''Saves the pending data'''
 
-    global _shelf
-    _shelf.sync()
+    _backend.sync()
 
 def flush():
     '''Flushes the persistent data'''
 
-    global _shelf
-
-    for key in _shelf.keys():
-        del _shelf[key]
-
-    _shelf.sync()
+    _backend.flush()
 
 def get_all():
     '''Gets all the items in the persistent data dictionary'''
 
-    global _shelf
-    return _shelf.items()
+    return _backend.items()
 
 def get_item(key, default):
     '''
@@ -45,15 +317,31 @@ def get_item(key, default):
     If it does not exist, creates it.
     '''
 
-    global _shelf
-
-    if key not in _shelf:
-        _shelf[key] = default
-
-    return _shelf[key]
+    return _backend.get(key, default)
 
 def set_item(key, value):
     '''Updates an item value in the persistent data dictionary'''
 
-    global _shelf
-    _shelf[key] = value
+    _backend.set(key, value)
+
+def lock(key):
+    '''
+    Gets the (reentrant) lock of an item. The values are shared by all the
+    threads, so it must be held while reading and changing them in place or
+    concurrent changes can be lost.
+    '''
+
+    with _locks_lock:
+        return _locks.setdefault(key, threading.RLock())
+
+def update_item(key, default, func):
+    '''
+    Atomically replaces an item value with `func(value)`, which can also
+    change the value in place and return it. Returns the new value.
+    '''
+
+    with lock(key):
+        value = func(_backend.get(key, default))
+        _backend.set(key, value)
+
+    return value
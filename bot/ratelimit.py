@@ -0,0 +1,123 @@
+import threading
+
+from collections import OrderedDict
+from time import monotonic, sleep
+
+# Telegram allows about 30 messages per second overall, one message per
+# second to the same chat and 20 messages per minute to the same group
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+GROUP_RATE = 20 / 60
+
+
+class TokenBucket():
+    '''Thread safe token bucket rate limiter'''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._blocked_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def consume(self, tokens=1):
+        '''
+        Takes the tokens if they are available. Returns the number of
+        seconds to wait before trying again (0 if they were taken).
+        '''
+
+        with self._lock:
+            now = monotonic()
+
+            if now < self._blocked_until:
+                return self._blocked_until - now
+
+            self._refill(now)
+
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, stopper=None):
+        '''
+        Blocks until the tokens are taken. Returns False if the stopper
+        event was set while waiting.
+        '''
+
+        while True:
+            wait = self.consume(tokens)
+
+            if not wait:
+                return True
+
+            if stopper:
+                if stopper.wait(wait):
+                    return False
+            else:
+                sleep(wait)
+
+    def pause(self, seconds):
+        '''Blocks the bucket for the given seconds (e.g. flood control)'''
+
+        with self._lock:
+            now = monotonic()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = 0
+            self._updated = self._blocked_until
+
+
+class TokenBucketMap():
+    '''Lazily created token buckets by key, keeping only the most recent ones'''
+
+    def __init__(self, rate, capacity=None, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, rate=None, capacity=None):
+        with self._lock:
+            bucket = self._buckets.get(key)
+
+            if bucket:
+                self._buckets.move_to_end(key)
+                return bucket
+
+            bucket = TokenBucket(rate or self.rate, capacity or self.capacity)
+            self._buckets[key] = bucket
+
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+            return bucket
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+def chat_bucket(chat_id):
+    '''Returns the bucket limiting the messages sent to the given chat'''
+
+    if str(chat_id).startswith('-'):
+        return chat_buckets.get(chat_id, GROUP_RATE, 3)
+
+    return chat_buckets.get(chat_id)
+
+
+# Shared by everything that sends messages from the bot process so the
+# global limit holds no matter how many senders are running at once
+global_bucket = TokenBucket(GLOBAL_RATE)
+chat_buckets = TokenBucketMap(CHAT_RATE, 1)
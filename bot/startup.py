@@ -0,0 +1,56 @@
+from contextlib import contextmanager
+from time import monotonic
+
+# Seconds the bot can take since it is started until it receives updates
+STARTUP_BUDGET = 3
+
+
+class StartupProfile():
+    '''Time spent in every step of the bot startup'''
+
+    def __init__(self, started=None):
+        self.started = started or monotonic()
+        self.steps = []
+        self.ready = None
+
+    @contextmanager
+    def step(self, name):
+        start = monotonic()
+
+        try:
+            yield
+        finally:
+            self.steps.append((name, monotonic() - start))
+
+    def add_step(self, name, elapsed):
+        self.steps.append((name, elapsed))
+
+    def set_ready(self):
+        '''Marks the moment the bot starts receiving updates'''
+
+        self.ready = monotonic() - self.started
+
+    def __str__(self):
+        lines = ['Startup profile:']
+
+        for name, elapsed in self.steps:
+            lines.append('  {:32} {:8.1f}ms'.format(name, 1000 * elapsed))
+
+        if self.ready is not None:
+            lines.append('Receiving updates after {:.1f}ms (budget {}s)'.format(
+                1000 * self.ready, STARTUP_BUDGET
+            ))
+
+        return '\n'.join(lines)
+
+
+_profile = None
+
+def start_profile(started=None):
+    global _profile
+
+    _profile = StartupProfile(started)
+    return _profile
+
+def get_profile():
+    return _profile
@@ -1,9 +1,68 @@
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+import pickle
+import schedule
+import shelve
+import tempfile
+import threading
 
+from datetime import date, datetime, timedelta
+from importlib import import_module
+from os import path
+from queue import Queue
+from time import monotonic, sleep, time
+from unittest.mock import patch
+
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, ChatMigrated, RetryAfter, TimedOut, Unauthorized
+from telegram.ext import DispatcherHandlerStop
+
+from django.apps import apps
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.contrib.auth.models import Group, Permission
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
-from .utils import create_reply_markup, create_users_list
+from heart.models import Group as StudentsGroup
+
+from . import metrics, persistence, workers
+from .api import CircuitBreaker, CircuitOpen, ProtectedRequest
+from .backlog import drain_backlog, filter_backlog
+from .broadcast import Broadcast, fan_out, stop_fan_out
+from .benchmarks.environment import callback_update, message_update
+from .benchmarks.fake_api import FakeBotAPI
+from .benchmarks.startup import create_database, measure_startup
+from .handlers import load_modules
+from .handlers import elections
+from .handlers.elections import (
+    ELECTIONS_KEY, ElectionRequestMixin, ElectionsToggleHandler, PendingElectionRequests,
+    add_pending_request, assign_delegate, get_pending_requests, pop_pending_request
+)
+from .handlers.handlers import (
+    USER_CACHE_TTL, BasicBotHandler, FloodControl, HandlerRouter, LazyHandler, _bot_cache,
+    _chat_admin_cache, _chat_status_changed, _router, _user_cache, is_bot_admin
+)
+from .handlers.groups import GroupsList, get_groups_pages
+from .handlers.manifest import HANDLERS
+from .handlers.rooms import (
+    RoomHandler, _room_status, _rooms, add_member, add_to_queue, get_members_users, get_room,
+    get_room_status, get_room_version, remove_member, render_schedule
+)
+from .jobs import ScheduledJob, SchedulerThread
+from .models import (
+    OutboxMessage, PersistentItem, Room, RoomEvent, RoomHourlyOccupancy, RoomPresence,
+    RoomWeekdayOccupancy
+)
+from .notifications import telegram_notify
+from .occupancy import clamp_presence, count_weekdays, get_staffed_ranges, get_weekly_occupancy, split_hours
+from .outbox import OutboxSender
+from .persistence import DatabaseBackend
+from .startup import STARTUP_BUDGET
+from .transactions import atomic_retry
+from .utils import (
+    MessageBuilder, create_reply_markup, create_users_list, create_users_messages,
+    escape_markdown
+)
+from .workers import PRIORITY_LOW, HandlerExecutor
 
 User = get_user_model()
 
@@ -18,6 +77,28 @@ class StubUser():
         return self.name
 
 
+class StubBot():
+    username = 'dafi_bot'
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+
+    def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        errors = self.errors.get(chat_id)
+
+        if errors:
+            raise errors.pop(0)
+
+        self.sent.append(chat_id)
+
+
+class StubUpdate():
+    def __init__(self, user_id, chat_id=None, chat_type='private'):
+        self.effective_user = type('StubTelegramUser', (), {'id': user_id})
+        self.effective_chat = type('StubChat', (), {'id': chat_id or user_id, 'type': chat_type})
+
+
 class BotUtilitiesTests(TestCase):
     def setUp(self):
         self.u1 = StubUser('u1', 'u1', '1111')
@@ -138,3 +219,1398 @@ class BotUtilitiesTests(TestCase):
         l2 = create_users_list(users)
 
         self.assertEqual(l1, l2, 'multiple users generated string not working')
+
+    def test_escape_markdown(self):
+        '''Markdown entities in names are escaped'''
+
+        self.assertEqual(escape_markdown('a_b*c`d[e]'), 'a\\_b\\*c\\`d\\[e]')
+
+        # Escapes are not processed inside entities, only the closer is replaced
+        self.assertEqual(escape_markdown('a_b*c[d]', 'link'), 'a_b*c[d］')
+        self.assertEqual(escape_markdown('a_b*c', 'bold'), 'a_b∗c')
+
+        users = [StubUser('user_name [*]', 'u', 1)]
+
+        self.assertEqual(create_users_list(users), '\n[user_name [*］](tg://user?id=1)')
+
+    def test_message_builder(self):
+        '''Long messages are split in chunks under the limit without losing text'''
+
+        users = [StubUser('User {}'.format(i), 'u', i) for i in range(1000)]
+
+        chunks = create_users_messages(users, 'Header\n', '\nFooter')
+
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+        self.assertTrue(all(chunk.startswith('Header\n') for chunk in chunks))
+        self.assertTrue(chunks[-1].endswith('\nFooter'))
+        self.assertEqual(
+            ''.join(chunk[len('Header\n'):] for chunk in chunks),
+            create_users_list(users) + '\nFooter'
+        )
+
+        # A piece longer than the limit is split
+        chunks = MessageBuilder('', 10).add('x' * 25).chunks()
+
+        self.assertEqual(chunks, ['x' * 10, 'x' * 10, 'x' * 5])
+
+
+class BroadcastTests(TestCase):
+    def broadcast(self, bot, chat_ids):
+        broadcast = Broadcast(bot, chat_ids, 'text')
+        broadcast.backoff = 0
+        return broadcast.run()
+
+    def test_broadcast_delivers_all(self):
+        '''Broadcast sends the message once to every chat'''
+
+        bot = StubBot()
+        report = self.broadcast(bot, ['1', '2', '3'])
+
+        self.assertCountEqual(bot.sent, ['1', '2', '3'])
+        self.assertCountEqual(report.sent, ['1', '2', '3'])
+        self.assertFalse(report.failed)
+
+    def test_broadcast_retries(self):
+        '''Broadcast retries on flood control and network errors'''
+
+        bot = StubBot({
+            '1': [RetryAfter(0.01)],
+            '2': [TimedOut(), TimedOut()],
+        })
+
+        report = self.broadcast(bot, ['1', '2'])
+
+        self.assertCountEqual(report.sent, ['1', '2'])
+        self.assertEqual(report.retries, 3)
+
+    def test_broadcast_report_failures(self):
+        '''Broadcast reports failed and migrated chats'''
+
+        bot = StubBot({
+            '1': [BadRequest('Chat not found')],
+            '2': [TimedOut()] * (Broadcast.max_retries + 1),
+            '3': [ChatMigrated(4)],
+        })
+
+        report = self.broadcast(bot, ['1', '2', '3'])
+
+        self.assertCountEqual(report.failed, ['1', '2'])
+        self.assertEqual(report.sent, ['3'])
+        self.assertEqual(report.migrated, {'3': 4})
+        self.assertEqual(bot.sent, [4])
+
+    def test_fan_out(self):
+        '''Fan-out delivers in the background and reports when finished'''
+
+        bot = StubBot({'2': [BadRequest('Chat not found')]})
+        reports = []
+
+        future = fan_out(bot, ['1', '2', '3'], 'text', done=reports.append)
+        report = future.result(5)
+
+        stop_fan_out()
+
+        self.assertEqual(reports, [report])
+        self.assertCountEqual(report.sent, ['1', '3'])
+        self.assertCountEqual(report.failed, ['2'])
+
+
+class DatabaseBackendTests(TestCase):
+    def test_get_creates_default(self):
+        '''get stores the default value when the key does not exist'''
+
+        backend = DatabaseBackend()
+
+        self.assertEqual(backend.get('key', [1]), [1])
+        self.assertTrue(PersistentItem.objects.filter(key='key').exists())
+
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get('key', []), [1])
+
+    def test_shared_state(self):
+        '''Values set in a backend are readable from another one'''
+
+        DatabaseBackend().set('key', {'a': 1})
+
+        self.assertEqual(DatabaseBackend().get('key', None), {'a': 1})
+
+    def test_sync_writes_changed_items(self):
+        '''sync only writes the items changed in place'''
+
+        backend = DatabaseBackend()
+        changed = backend.get('changed', [])
+        backend.get('unchanged', [])
+
+        changed.append(1)
+
+        with self.assertNumQueries(0):
+            backend.get('unchanged', [])
+
+        backend.sync()
+
+        self.assertEqual(DatabaseBackend().get('changed', None), [1])
+
+        # Nothing else to write
+        with self.assertNumQueries(0):
+            backend.sync()
+
+
+    def test_changes_from_other_processes(self):
+        '''Values written by another process are read again and never overwritten'''
+
+        backend = DatabaseBackend()
+        other = DatabaseBackend()
+
+        other.set('key', [1])
+
+        # Created by the other process, its value is the one cached
+        self.assertEqual(backend.get('key', []), [1])
+
+        other.set('key', [2])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(backend.get('key', None), [1])
+
+        backend.refresh_interval = 0
+
+        self.assertEqual(backend.get('key', None), [2])
+
+        # Unchanged rows only cost a query of their update date
+        with self.assertNumQueries(1):
+            self.assertEqual(backend.get('key', None), [2])
+
+        # In place change of a value changed meanwhile by the other process
+        backend.get('key', None).append(3)
+        other.set('key', [4])
+        backend.sync()
+
+        self.assertEqual(DatabaseBackend().get('key', None), [4])
+        self.assertEqual(backend.get('key', None), [4])
+
+
+class AtomicRetryTests(TestCase):
+    def test_retries_lock_conflicts(self):
+        '''Only the transactions that conflict with another one are run again'''
+
+        calls = []
+
+        def locked_twice():
+            calls.append(1)
+
+            if len(calls) < 3:
+                raise OperationalError('database is locked')
+
+            return 'done'
+
+        self.assertEqual(atomic_retry(locked_twice), 'done')
+        self.assertEqual(len(calls), 3)
+
+        def broken():
+            calls.append(1)
+            raise OperationalError('no such table: bot_room')
+
+        calls.clear()
+
+        with self.assertRaises(OperationalError):
+            atomic_retry(broken)
+
+        self.assertEqual(len(calls), 1)
+
+
+class ConcurrentStateTests(TestCase):
+    class MemoryBackend(DatabaseBackend):
+        '''Database backend that writes the pickled values to a dictionary'''
+
+        # The rows are not in the database, there is nothing to read again
+        refresh_interval = None
+
+        def __init__(self):
+            super().__init__()
+            self.rows = {}
+
+        def _write(self, key, data):
+            # Lets other threads run in the middle of the change, like a query
+            sleep(0.0001)
+            self.rows[key] = data
+
+    class StubUser():
+        def __init__(self, i):
+            self.pk = i
+            self.telegram_id = i
+
+    def setUp(self):
+        self.backend = self.MemoryBackend()
+        persistence._backend = self.backend
+
+        self.backend.set('counter', 0)
+
+    def tearDown(self):
+        persistence._backend = None
+
+    def run_threads(self, target, count=16):
+        errors = []
+
+        def run(i):
+            try:
+                target(i)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def test_update_item(self):
+        '''Concurrent read-modify-write changes are not lost'''
+
+        self.run_threads(lambda i: [
+            persistence.update_item('counter', 0, lambda value: value + 1)
+            for _ in range(200)
+        ])
+
+        self.assertEqual(persistence.get_item('counter', 0), 16 * 200)
+        self.assertEqual(pickle.loads(self.backend.rows['counter']), 16 * 200)
+
+
+class RoomStateTests(TestCase):
+    def setUp(self):
+        _rooms.clear()
+
+        self.room = get_room('dafi')
+
+        self.u1 = User.objects.create(username='u1', first_name='u1', telegram_id=1111)
+        self.u2 = User.objects.create(username='u2', first_name='u2', telegram_id=2222)
+
+    def tearDown(self):
+        # The rooms created by the tests are rolled back without signals
+        _rooms.clear()
+
+    def test_default_rooms(self):
+        '''The rooms that were defined in the code are created by the migrations'''
+
+        self.assertEqual(self.room.name, 'DAFI')
+        self.assertEqual(get_room('repro').permission, 'bot.can_change_alt_room_state')
+        self.assertIsNone(get_room('unknown'))
+
+    def test_members(self):
+        '''Entering a room empties its queue, the members are kept in order'''
+
+        add_to_queue(self.room, 3333)
+        add_to_queue(self.room, 3333)
+
+        self.assertEqual(add_member(self.room, self.u2), [3333])
+        self.assertIsNone(add_member(self.room, self.u2))
+        self.assertEqual(add_member(self.room, self.u1), [])
+
+        User.objects.filter(pk=self.u1.pk).update(first_name='new')
+
+        with self.assertNumQueries(1):
+            users = get_members_users(self.room)
+
+        self.assertEqual([u.get_full_name() for u in users], ['u2', 'new'])
+        self.assertEqual(get_members_users(get_room('repro')), [])
+
+        self.assertTrue(remove_member(self.room, self.u2))
+        self.assertFalse(remove_member(self.room, self.u2))
+        self.assertEqual(get_members_users(self.room), [self.u1])
+
+    def test_status_cached_by_version(self):
+        '''The room status is rendered again only when the members change'''
+
+        _room_status.clear()
+
+        add_member(self.room, self.u1)
+
+        msg, reply_markup = get_room_status(self.room, 'private')
+
+        self.assertIn('u1', msg[0])
+        self.assertIsNotNone(reply_markup)
+        self.assertIsNone(get_room_status(self.room, 'group')[1])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_room_status(self.room, 'private'), (msg, reply_markup))
+
+        version = get_room_version(self.room.pk)
+
+        add_member(self.room, self.u2)
+
+        self.assertEqual(get_room_version(self.room.pk), version + 1)
+        self.assertIn('u2', get_room_status(self.room, 'private')[0][0])
+
+        # Changes made outside the bot commands, like in the admin site
+        RoomPresence.objects.filter(user=self.u1).delete()
+        self.assertNotIn('u1', get_room_status(self.room, 'private')[0][0])
+
+        RoomPresence.objects.create(room=self.room, user=self.u1)
+        self.assertIn('u1', get_room_status(self.room, 'private')[0][0])
+
+        self.room.name = 'Delegación'
+        self.room.save()
+        self.assertIn('Delegación', get_room_status(get_room('dafi'), 'private')[0][0])
+
+        # The names set in the website are escaped
+        self.room.name = 'Sala_1'
+        self.room.name_long = 'la sala_1'
+        self.room.save()
+
+        msg = get_room_status(get_room('dafi'), 'private')[0][0]
+
+        self.assertIn('*Sala_1*', msg)
+        self.assertIn('En la sala\\_1', msg)
+
+    def test_new_room(self):
+        '''Rooms added to the database are handled without code changes'''
+
+        update = Update.de_json(dict(message_update('/biblio on', 1), update_id=1), StubBot())
+
+        self.assertIsNone(_router.check_update(update))
+
+        Room.objects.create(command='biblio', name='Biblioteca', name_long='la biblioteca')
+
+        self.assertEqual(_router.check_update(update), (RoomHandler, 'biblio', ['on']))
+
+        update = Update.de_json(dict(callback_update('biblio:notify', 1), update_id=2), StubBot())
+        self.assertEqual(_router.check_update(update)[0], RoomHandler)
+
+
+class ConcurrentRoomsTests(TransactionTestCase):
+    def test_enter_and_leave(self):
+        '''Users entering and leaving a room at the same time do not lose changes'''
+
+        _rooms.clear()
+
+        room = Room.objects.create(command='sala', name='Sala', name_long='la sala')
+        users = [
+            User.objects.create(username='u{}'.format(i), telegram_id=i)
+            for i in range(8)
+        ]
+
+        errors = []
+
+        def enter_and_leave(user):
+            try:
+                for _ in range(5):
+                    self.assertIsNotNone(add_member(room, user))
+                    self.assertTrue(remove_member(room, user))
+
+                add_member(room, user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=enter_and_leave, args=(user,)) for user in users]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertCountEqual(get_members_users(room), users)
+
+        events = RoomEvent.objects.filter(room=room)
+
+        self.assertEqual(events.filter(kind=RoomEvent.KIND_ON).count(), 8 * 6)
+        self.assertEqual(events.filter(kind=RoomEvent.KIND_OFF).count(), 8 * 5)
+
+        _rooms.clear()
+
+
+class RoomMigrationTests(TestCase):
+    def test_import_from_shelve(self):
+        '''The rooms state still in the legacy shelve is imported only by the migration'''
+
+        migration = import_module('bot.migrations.0008_default_rooms')
+        user = User.objects.create(username='u1', first_name='u1', telegram_id=1111)
+
+        filename = path.join(tempfile.mkdtemp(), 'botstorage')
+
+        with shelve.open(filename) as shelf:
+            shelf['room_members'] = [user]
+            shelf['room_queue'] = [3333]
+            shelf['other'] = 1
+
+        Room.objects.all().delete()
+
+        with patch.object(migration, 'SHELVE_FILE', filename):
+            migration.create_rooms(apps, None)
+
+        room = Room.objects.get(command='dafi')
+
+        self.assertEqual(list(room.presences.values_list('user', flat=True)), [user.pk])
+        self.assertEqual(list(room.queue.values_list('telegram_id', flat=True)), [3333])
+
+        DatabaseBackend().import_shelve(filename)
+
+        self.assertEqual(
+            list(PersistentItem.objects.values_list('key', flat=True)), ['other']
+        )
+
+
+class OccupancyTests(TestCase):
+    def setUp(self):
+        _rooms.clear()
+
+        self.room = get_room('dafi')
+        self.user = User.objects.create(username='u1', first_name='u1', telegram_id=1111)
+
+    def tearDown(self):
+        _rooms.clear()
+
+    def local(self, *args):
+        return timezone.make_aware(datetime(*args))
+
+    def test_split_hours(self):
+        '''Periods are split in the local hours they span'''
+
+        self.assertEqual(list(split_hours(self.local(2026, 3, 1, 23, 30), self.local(2026, 3, 2, 1, 15))), [
+            (date(2026, 3, 1), 6, 23, 1800),
+            (date(2026, 3, 2), 0, 0, 3600),
+            (date(2026, 3, 2), 0, 1, 900),
+        ])
+
+        # Presences left on overnight are counted until the closing time
+        start = self.local(2026, 3, 2, 20, 0)
+
+        self.assertEqual(
+            clamp_presence(start, self.local(2026, 3, 2, 21, 0)), self.local(2026, 3, 2, 21, 0)
+        )
+        self.assertEqual(
+            clamp_presence(start, self.local(2026, 3, 5, 9, 0)), self.local(2026, 3, 2, 21, 10)
+        )
+        self.assertEqual(
+            clamp_presence(self.local(2026, 3, 2, 22, 0), self.local(2026, 3, 5, 9, 0)),
+            self.local(2026, 3, 3, 10, 0)
+        )
+
+        self.assertEqual(count_weekdays(date(2026, 3, 2), date(2026, 3, 16)), [3, 2, 2, 2, 2, 2, 2])
+        self.assertEqual(get_staffed_ranges([0, 1, 0.5, 0.2] + [0] * 19 + [1]), [(1, 3), (23, 24)])
+
+    def test_rollups(self):
+        '''Leaving a room appends the event and adds the time to the rollups'''
+
+        self.assertFalse(remove_member(self.room, self.user))
+        self.assertFalse(RoomEvent.objects.exists())
+
+        since = timezone.now() - timedelta(minutes=90)
+
+        add_member(self.room, self.user)
+        RoomPresence.objects.update(since=since)
+
+        self.assertTrue(remove_member(self.room, self.user))
+
+        self.assertEqual(
+            list(RoomEvent.objects.values_list('kind', flat=True)),
+            [RoomEvent.KIND_ON, RoomEvent.KIND_OFF]
+        )
+
+        # Less than 90 minutes if the tests run right after the closing time
+        until = RoomEvent.objects.get(kind=RoomEvent.KIND_OFF).date
+        expected = (clamp_presence(since, until) - since).total_seconds()
+
+        for model in (RoomHourlyOccupancy, RoomWeekdayOccupancy):
+            rows = model.objects.filter(room=self.room)
+
+            self.assertAlmostEqual(sum(row.seconds for row in rows), expected, delta=2)
+
+    def test_schedule(self):
+        '''The schedule is read from the weekday rollups only'''
+
+        self.assertIn('no hay datos', render_schedule(self.room))
+
+        # Two Mondays with someone from 10:00 to 12:00 the first one
+        RoomHourlyOccupancy.objects.create(room=self.room, date=date(2026, 3, 2), hour=10, seconds=3600)
+        RoomHourlyOccupancy.objects.create(room=self.room, date=date(2026, 3, 2), hour=11, seconds=3600)
+        RoomWeekdayOccupancy.objects.create(room=self.room, weekday=0, hour=10, seconds=7200)
+        RoomWeekdayOccupancy.objects.create(room=self.room, weekday=0, hour=11, seconds=3600)
+
+        with self.assertNumQueries(2):
+            first, occupancy = get_weekly_occupancy(self.room, date(2026, 3, 9))
+
+        self.assertEqual(first, date(2026, 3, 2))
+        self.assertEqual(occupancy[0][10:12], [1, 0.5])
+        self.assertEqual(sum(occupancy[1]), 0)
+
+        msg = render_schedule(self.room, date(2026, 3, 9))
+
+        self.assertIn('Lunes: 10:00-12:00', msg)
+        self.assertIn('Martes: normalmente no hay nadie', msg)
+        self.assertNotIn('Domingo', msg)
+
+    @override_settings(
+        STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage'
+    )
+    def test_schedule_page(self):
+        '''The website shows the schedule of the active rooms'''
+
+        RoomHourlyOccupancy.objects.create(room=self.room, date=date(2026, 3, 2), hour=10, seconds=3600)
+        RoomWeekdayOccupancy.objects.create(room=self.room, weekday=0, hour=10, seconds=3600)
+
+        response = self.client.get('/salas/dafi/horario/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Horario de DAFI')
+        self.assertContains(response, '02/03/2026')
+
+        self.assertEqual(self.client.get('/salas/unknown/horario/').status_code, 404)
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        _user_cache.clear()
+
+        self.user = User.objects.create(username='u1', telegram_id=1111)
+        self.group = Group.objects.create(name='group')
+        self.group.permissions.add(
+            Permission.objects.get(codename='can_manage_permissions')
+        )
+
+    def get_user(self, telegram_id=1111):
+        return BasicBotHandler(StubUpdate(telegram_id), None).get_user()
+
+    def test_cached_user(self):
+        '''Users and permissions are loaded once'''
+
+        self.assertEqual(self.get_user(), self.user)
+        self.assertIsNone(self.get_user(2222))
+
+        with self.assertNumQueries(0):
+            user = self.get_user()
+            self.assertFalse(user.has_perm('bot.can_manage_permissions'))
+            self.assertIsNone(self.get_user(2222))
+
+    def test_invalidation(self):
+        '''Cached users are invalidated when they or their permissions change'''
+
+        self.assertFalse(self.get_user().has_perm('bot.can_manage_permissions'))
+
+        self.group.user_set.add(self.user)
+
+        self.assertTrue(self.get_user().has_perm('bot.can_manage_permissions'))
+
+        self.user.telegram_id = 2222
+        self.user.save()
+
+        self.assertIsNone(self.get_user())
+        self.assertEqual(self.get_user(2222), self.user)
+
+    def test_external_changes(self):
+        '''Changes made by other processes apply once the entry expires'''
+
+        self.assertFalse(self.get_user().has_perm('bot.can_manage_permissions'))
+
+        # Like the website, without the signals of this process
+        self.group.user_set.through.objects.create(user=self.user, group=self.group)
+
+        self.assertFalse(self.get_user().has_perm('bot.can_manage_permissions'))
+
+        with patch('bot.cache.monotonic', return_value=monotonic() + USER_CACHE_TTL):
+            self.assertTrue(self.get_user().has_perm('bot.can_manage_permissions'))
+
+
+class HandlerExecutorTests(TestCase):
+    def test_queue_limits(self):
+        '''Tasks are shed when the queue is full, low priority ones first'''
+
+        executor = HandlerExecutor(workers=1, max_queue=4)
+
+        self.assertTrue(executor.submit(lambda: None, 'a'))
+        self.assertTrue(executor.submit(lambda: None, 'a', PRIORITY_LOW))
+        self.assertFalse(executor.submit(lambda: None, 'a', PRIORITY_LOW))
+        self.assertTrue(executor.submit(lambda: None, 'a'))
+        self.assertTrue(executor.submit(lambda: None, 'a'))
+        self.assertFalse(executor.submit(lambda: None, 'a'))
+
+        self.assertEqual(executor.stats()['shed'], 2)
+
+        executor.start()
+        executor.stop()
+
+    def test_handler_concurrency(self):
+        '''Handlers never run more tasks than their limit at the same time'''
+
+        executor = HandlerExecutor(workers=4, max_queue=100)
+        lock = threading.Lock()
+        running = []
+        peak = []
+        finished = []
+        done = threading.Event()
+
+        def task():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+
+            threading.Event().wait(0.01)
+
+            with lock:
+                running.pop()
+                finished.append(1)
+
+                if len(finished) == 10:
+                    done.set()
+
+        executor.start()
+
+        for _ in range(10):
+            executor.submit(task, 'limited', limit=2)
+
+        self.assertTrue(done.wait(5))
+
+        executor.stop()
+
+        stats = executor.stats()
+
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['completed'], 10)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_busy_replies(self):
+        '''Shed updates are told the bot is busy, at most once in a while'''
+
+        workers._executor = HandlerExecutor(workers=1, max_queue=0)
+        self.addCleanup(setattr, workers, '_executor', None)
+
+        bot = StubBot()
+
+        for _ in range(2):
+            update = Update.de_json(dict(message_update('/grupos', 4242), update_id=1), bot)
+            BasicBotHandler(update, None, 'grupos').dispatch()
+
+        self.assertEqual(bot.sent, [4242])
+
+    def test_replies_in_background(self):
+        '''Replies do not block the caller and are sent before stopping'''
+
+        workers.start_executor(1, 10)
+
+        sending = threading.Event()
+        sent = []
+
+        def send():
+            sending.wait(5)
+            sent.append(1)
+
+        try:
+            self.assertTrue(workers.reply(send, 'test'))
+            self.assertEqual(sent, [])
+        finally:
+            sending.set()
+            workers.stop_executor()
+
+        self.assertEqual(sent, [1])
+
+
+class SchedulerTests(TestCase):
+    def test_runs_due_jobs(self):
+        '''Due jobs are run and rescheduled, recording their drift'''
+
+        scheduler = SchedulerThread(workers=1)
+        done = threading.Event()
+        runs = []
+
+        def job():
+            runs.append(1)
+
+            if len(runs) == 2:
+                done.set()
+
+        scheduled = ScheduledJob(schedule.every(1).seconds, job)
+        scheduler.add(scheduled)
+        scheduler.start()
+
+        self.assertTrue(done.wait(5))
+
+        scheduler.stop()
+        scheduler.join()
+
+        self.assertGreaterEqual(scheduled.runs, 2)
+        self.assertEqual(scheduled.failed, 0)
+        self.assertGreaterEqual(scheduled.last_drift, 0)
+        self.assertLess(scheduled.max_drift, 1)
+
+    def test_stop_wakes_thread(self):
+        '''Stopping does not wait until the next job is due'''
+
+        scheduler = SchedulerThread(workers=1)
+        scheduler.add(ScheduledJob(schedule.every().day, lambda: None))
+        scheduler.start()
+
+        scheduler.stop()
+        scheduler.join(1)
+
+        self.assertFalse(scheduler.is_alive())
+
+
+class OutboxTests(TestCase):
+    def test_notify_queues_message(self):
+        '''Notifications are saved in the outbox instead of being sent'''
+
+        user = User.objects.create(username='u1', telegram_id=1111)
+
+        self.assertTrue(telegram_notify(user, 'Hola'))
+        self.assertFalse(telegram_notify(User.objects.create(username='u2'), 'Hola'))
+
+        message = OutboxMessage.objects.get()
+
+        self.assertEqual(message.chat_id, 1111)
+        self.assertEqual(message.status, OutboxMessage.STATUS_PENDING)
+
+    def test_drain(self):
+        '''Due messages are sent, retried or dead-lettered'''
+
+        for chat_id in (1, 2, 3, 4, 5):
+            OutboxMessage.objects.create(chat_id=chat_id, text='text')
+
+        OutboxMessage.objects.filter(chat_id__in=(4, 5)).update(
+            attempts=OutboxSender.max_attempts - 1
+        )
+
+        bot = StubBot({
+            2: [TimedOut()],
+            3: [Unauthorized('Forbidden: bot was blocked by the user')],
+            4: [TimedOut()],
+            5: [CircuitOpen(60)],
+        })
+
+        sender = OutboxSender(bot)
+
+        self.assertEqual(sender.drain(), 5)
+        self.assertEqual(sender.drain(), 0)
+
+        messages = {m.chat_id: m for m in OutboxMessage.objects.all()}
+
+        self.assertEqual(bot.sent, [1])
+        self.assertEqual(messages[1].status, OutboxMessage.STATUS_SENT)
+        self.assertEqual(messages[2].status, OutboxMessage.STATUS_PENDING)
+        self.assertEqual(messages[2].attempts, 1)
+        self.assertEqual(messages[3].status, OutboxMessage.STATUS_FAILED)
+        self.assertEqual(messages[4].status, OutboxMessage.STATUS_FAILED)
+
+        # Rejected by the circuit breaker, it does not count as an attempt
+        self.assertEqual(messages[5].status, OutboxMessage.STATUS_PENDING)
+        self.assertEqual(messages[5].attempts, OutboxSender.max_attempts - 1)
+
+        self.assertGreater(sender.next_wait(), 0)
+
+
+class CircuitBreakerTests(TestCase):
+    def test_states(self):
+        '''The breaker opens after the failures and lets a single call through later'''
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+        breaker.failure()
+        breaker.before_call()
+        breaker.failure()
+
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+        sleep(0.05)
+        breaker.before_call()
+
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        with self.assertRaises(CircuitOpen):
+            breaker.before_call()
+
+        breaker.success()
+        breaker.before_call()
+
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual((breaker.opened, breaker.rejected), (1, 2))
+        self.assertIn('bot_api_circuit_state 0', metrics.export())
+
+    def test_request(self):
+        '''Calls fail fast without reaching the API while the circuit is open'''
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+        with FakeBotAPI(latency=0.2) as api:
+            bot = Bot(
+                '1000:test', base_url=api.base_url,
+                request=ProtectedRequest(breaker=breaker)
+            )
+
+            for _ in range(2):
+                with self.assertRaises(TimedOut):
+                    bot.send_message(1, 'text', timeout=0.05)
+
+            with self.assertRaises(CircuitOpen):
+                bot.send_message(1, 'text')
+
+            # Long polling is not affected
+            self.assertEqual(bot.get_updates(timeout=0), [])
+
+        self.assertEqual(breaker.rejected, 1)
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        metrics.install()
+
+    def test_track(self):
+        '''Calls, errors, latency and queries are recorded per handler action'''
+
+        with metrics.track('Handler', 'cmd'):
+            list(User.objects.all())
+
+        with self.assertRaises(ValueError):
+            with metrics.track('Handler', 'cmd'):
+                raise ValueError
+
+        (key, stats), = metrics.get_stats()
+
+        self.assertEqual(key, ('Handler', 'cmd'))
+        self.assertEqual(stats.calls, 2)
+        self.assertEqual(stats.errors, 1)
+        self.assertEqual(stats.latency.count, 2)
+        self.assertEqual(stats.db_queries, 1)
+
+    def test_export(self):
+        '''Metrics are exported in the Prometheus text format'''
+
+        with metrics.track('Handler', 'cmd'):
+            pass
+
+        text = metrics.export()
+
+        self.assertIn('# TYPE bot_handler_calls_total counter', text)
+        self.assertIn('bot_handler_calls_total{handler="Handler",action="cmd"} 1', text)
+        self.assertIn('bot_handler_latency_seconds_bucket{handler="Handler",action="cmd",le="+Inf"} 1', text)
+        self.assertIn('bot_handler_latency_seconds_count{handler="Handler",action="cmd"} 1', text)
+
+
+class GroupsListTests(TestCase):
+    def create_groups(self, count):
+        for i in range(count):
+            StudentsGroup.objects.create(
+                name='Grupo {}'.format(i), year=1 + i % 4, number=i, subgroups=1,
+                telegram_group_link='https://t.me/joinchat/{}'.format('x' * 40)
+            )
+
+    def test_cached_until_groups_change(self):
+        '''The list is rendered once and rebuilt when a group is saved or deleted'''
+
+        self.create_groups(3)
+
+        pages = get_groups_pages()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_groups_pages(), pages)
+
+        group = StudentsGroup.objects.first()
+        group.name = 'Nuevo nombre'
+        group.save()
+
+        self.assertIn('Nuevo nombre', get_groups_pages()[0])
+
+        group.delete()
+
+        self.assertNotIn('Nuevo nombre', get_groups_pages()[0])
+
+    def test_pagination(self):
+        '''Long lists are split in pages under the Telegram limit'''
+
+        self.create_groups(100)
+
+        pages = get_groups_pages()
+
+        self.assertGreater(len(pages), 1)
+        self.assertTrue(all(len(page) <= 4096 for page in pages))
+        self.assertEqual(sum(page.count('](') for page in pages), 100)
+
+        msg, reply_markup = GroupsList(None, None, 'grupos').get_page(1)
+
+        self.assertIn('Página 2 de {}'.format(len(pages)), msg)
+        self.assertEqual(reply_markup.inline_keyboard[0][0].callback_data, 'grupos:page:0')
+
+
+class ElectionsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='u1', telegram_id=1111)
+
+        self.g1 = StudentsGroup.objects.create(name='1.1', year=1, number=1, subgroups=1)
+        self.g2 = StudentsGroup.objects.create(name='1.2', year=1, number=2, subgroups=1)
+
+    def test_assign_delegate(self):
+        '''The user is removed from any other position of any group'''
+
+        StudentsGroup.objects.filter(pk=self.g1.pk).update(subdelegate=self.user)
+
+        group = assign_delegate(self.user, 1, 2, True)
+
+        self.assertEqual(group, self.g2)
+        self.assertEqual(group.delegate, self.user)
+
+        self.g1.refresh_from_db()
+        self.assertIsNone(self.g1.subdelegate)
+
+        group = assign_delegate(self.user, 1, 1, False)
+
+        self.assertEqual(group.subdelegate, self.user)
+        self.assertFalse(StudentsGroup.objects.filter(delegate=self.user).exists())
+
+        self.assertIsNone(assign_delegate(self.user, 9, 9, True))
+
+    def test_request_answered_once(self):
+        '''A request is applied only by the first admin that answers it'''
+
+        persistence._backend = ConcurrentStateTests.MemoryBackend()
+        self.addCleanup(setattr, persistence, '_backend', None)
+
+        admin = User.objects.create(username='admin', telegram_id=2222)
+        handler = ElectionRequestMixin(StubUpdate(admin.telegram_id), None, 'soydelegado')
+
+        add_pending_request('1111:1.2:1')
+
+        msg = handler.callback(None, 'request', '1111', '1.2', '1')
+
+        self.assertIn('aceptada', msg)
+        self.assertEqual(StudentsGroup.objects.get(pk=self.g2.pk).delegate, self.user)
+
+        msg = handler.callback(None, 'deny', '1111', '1.2', '1')
+
+        self.assertIn('ya ha sido atendida', msg)
+        self.assertFalse(pop_pending_request('1111:1.2:1'))
+
+    def test_approve_pending_requests(self):
+        '''Only the requests pending when approving them all are removed'''
+
+        persistence._backend = ConcurrentStateTests.MemoryBackend()
+        self.addCleanup(setattr, persistence, '_backend', None)
+
+        admin = User.objects.create(username='admin', telegram_id=2222)
+        handler = PendingElectionRequests(StubUpdate(admin.telegram_id), None, 'solicitudes')
+
+        add_pending_request('1111:1.1:0')
+
+        self.assertIn('No hay un periodo', handler.callback(None, 'approve'))
+        self.assertEqual(list(get_pending_requests()), ['1111:1.1:0'])
+
+        persistence.set_item(ELECTIONS_KEY, True)
+
+        approve = elections._assign_delegate
+
+        def approve_and_request(*args):
+            # A new request sent while the others are being approved
+            add_pending_request('3333:1.2:1')
+            return approve(*args)
+
+        with patch.object(elections, '_assign_delegate', approve_and_request):
+            msg = handler.callback(None, 'approve')
+
+        self.assertIn('1 de 1', msg)
+        self.assertEqual(StudentsGroup.objects.get(pk=self.g1.pk).subdelegate, self.user)
+        self.assertEqual(list(get_pending_requests()), ['3333:1.2:1'])
+
+
+class AssignDelegateTests(TestCase):
+    def test_single_position(self):
+        '''A user holds at most one position after any sequence of approvals'''
+
+        users = [
+            User.objects.create(username='u{}'.format(i), telegram_id=i)
+            for i in range(3)
+        ]
+
+        for number in range(3):
+            StudentsGroup.objects.create(name=str(number), year=1, number=number, subgroups=1)
+
+        approvals = [
+            (user, number, is_delegate)
+            for number in range(3)
+            for is_delegate in (True, False)
+            for user in users
+        ]
+
+        for user, number, is_delegate in approvals + approvals[::-1]:
+            group = assign_delegate(user, 1, number, is_delegate)
+
+            self.assertEqual(getattr(group, 'delegate' if is_delegate else 'subdelegate'), user)
+
+            for other in users:
+                positions = (
+                    StudentsGroup.objects.filter(delegate=other).count() +
+                    StudentsGroup.objects.filter(subdelegate=other).count()
+                )
+
+                self.assertLessEqual(positions, 1)
+
+        self.assertIsNone(assign_delegate(users[0], 1, 9, True))
+        self.assertEqual(StudentsGroup.objects.filter(delegate=users[0]).count(), 1)
+
+
+class ElectionsConcurrencyTests(TransactionTestCase):
+    def test_parallel_approvals(self):
+        '''Parallel approvals never leave a user with more than one position'''
+
+        users = [
+            User.objects.create(username='u{}'.format(i), telegram_id=i)
+            for i in range(4)
+        ]
+
+        for number in range(4):
+            StudentsGroup.objects.create(name=str(number), year=1, number=number, subgroups=1)
+
+        errors = []
+
+        def approve(user, number, is_delegate):
+            try:
+                assign_delegate(user, 1, number, is_delegate)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=approve, args=(user, number, bool(is_delegate)))
+            for user in users
+            for number in range(4)
+            for is_delegate in range(2)
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+        for user in users:
+            positions = (
+                StudentsGroup.objects.filter(delegate=user).count() +
+                StudentsGroup.objects.filter(subdelegate=user).count()
+            )
+
+            self.assertLessEqual(positions, 1)
+
+
+class HandlerRouterTests(TestCase):
+    def route(self, data):
+        update = Update.de_json(dict(data, update_id=1), StubBot())
+        return _router.check_update(update)
+
+    def test_commands(self):
+        '''Commands are routed to their class with their arguments'''
+
+        self.assertEqual(
+            self.route(message_update('/dafi on', 1)), (RoomHandler, 'dafi', ['on'])
+        )
+        self.assertEqual(
+            self.route(message_update('/DAFI@dafi_bot', 1, -1)), (RoomHandler, 'dafi', [])
+        )
+        self.assertEqual(
+            self.route(message_update('/soysubdelegado 3.1', 1))[:2],
+            (ElectionRequestMixin, 'soysubdelegado')
+        )
+
+        self.assertIsNone(self.route(message_update('/dafi@other_bot', 1, -1)))
+        self.assertIsNone(self.route(message_update('/unknown', 1)))
+        self.assertIsNone(self.route(message_update('dafi', 1)))
+
+    def test_callbacks(self):
+        '''Callbacks are routed by their exact prefix'''
+
+        self.assertEqual(
+            self.route(callback_update('elections_toggle:on', 1))[0], ElectionsToggleHandler
+        )
+        self.assertEqual(
+            self.route(callback_update('elections:request:1:3.1:1', 1))[0], ElectionRequestMixin
+        )
+
+        self.assertIsNone(self.route(callback_update('elections_unknown:on', 1)))
+
+    def test_manifest(self):
+        '''The manifest has the routes of every handler class'''
+
+        load_modules()
+
+        expected_commands = {}
+        expected_callbacks = {}
+
+        for module, name, commands, prefix in HANDLERS:
+            for cmd in commands:
+                expected_commands[cmd] = (module, name)
+
+            if prefix:
+                expected_callbacks[prefix] = (module, name)
+
+        def routes(classes):
+            return {
+                key: (cls.__module__.rsplit('.', 1)[1], cls.__name__)
+                for key, cls in classes.items()
+            }
+
+        self.assertEqual(routes(_router.commands), expected_commands)
+        self.assertEqual(routes(_router.callbacks), expected_callbacks)
+
+    def test_lazy_handlers(self):
+        '''Lazy handlers are replaced by the classes, never the other way round'''
+
+        router = HandlerRouter()
+        router.add(LazyHandler('groups', ('grupos',), 'grupos'))
+
+        update = Update.de_json(dict(message_update('/grupos', 1), update_id=1), StubBot())
+        route = router.check_update(update)
+
+        self.assertIsInstance(route[0], LazyHandler)
+        self.assertEqual(route[1:], ('grupos', []))
+
+        router.add(GroupsList)
+        router.add(LazyHandler('groups', ('grupos',), 'grupos'))
+
+        self.assertIs(router.commands['grupos'], GroupsList)
+        self.assertIs(router.callbacks['grupos'], GroupsList)
+
+        with self.assertRaises(ValueError):
+            router.add(GroupsList)
+
+
+class StartupTests(TestCase):
+    def test_startup_budget(self):
+        '''The bot answers its first update within the startup budget'''
+
+        elapsed = measure_startup(create_database())
+
+        self.assertIsNotNone(elapsed)
+        self.assertLess(elapsed, STARTUP_BUDGET)
+
+
+class BacklogTests(TestCase):
+    class StubUpdater():
+        def __init__(self, bot):
+            self.bot = bot
+            self.dispatcher = type('StubDispatcher', (), {'update_queue': Queue()})
+            self.last_update_id = 0
+
+    def backlog(self, *updates):
+        return [
+            Update.de_json(dict(data, update_id=i), StubBot())
+            for i, data in enumerate(updates, 1)
+        ]
+
+    def old_callback(self, data, user_id, age):
+        update = callback_update(data, user_id)
+        update['callback_query']['message']['date'] = int(time()) - age
+        return update
+
+    def test_filter(self):
+        '''Old updates, old button presses and repeated room queries are dropped'''
+
+        old = message_update('/dafi on', 1)
+        old['message']['date'] = int(time()) - 3600
+
+        updates = self.backlog(
+            message_update('/dafi', 1),
+            old,
+            callback_update('dafi:omw', 1),
+            self.old_callback('dafi:omw', 1, 300),
+            message_update('/dafi on', 2),
+            message_update('/dafi', 2),
+            message_update('/dafi', 1),
+            message_update('/dafi', 1, -1),
+        )
+
+        kept = filter_backlog(updates, _router, timedelta(minutes=10))
+
+        self.assertEqual([update.update_id for update in kept], [3, 5, 6, 7, 8])
+
+    def test_drain(self):
+        '''The backlog is fetched in batches and polling continues after it'''
+
+        with FakeBotAPI() as api:
+            for i in range(250):
+                api.add_update(message_update('/dafi', 1 + i % 10))
+
+            api.add_update(message_update('/dafi off', 1))
+            api.add_update(self.old_callback('dafi:omw', 1, 3600))
+
+            updater = self.StubUpdater(Bot('1000:test', base_url=api.base_url))
+            stats = drain_backlog(updater, _router)
+
+            answers = [call for call in api.calls if call[0] == 'answerCallbackQuery']
+
+        self.assertEqual(stats.received, 252)
+        self.assertEqual(stats.coalesced, 240)
+        self.assertEqual(stats.callbacks, 1)
+        self.assertEqual(stats.answered, 1)
+        self.assertEqual(len(answers), 1)
+        self.assertEqual(updater.dispatcher.update_queue.qsize(), 11)
+        self.assertEqual(updater.last_update_id, 253)
+
+
+class FloodControlTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def update(self, data):
+        return Update.de_json(dict(data, update_id=1), StubBot())
+
+    def test_user_limit(self):
+        '''Updates over the user rate are dropped, warning the user once'''
+
+        flood_control = FloodControl(_router)
+        burst = RoomHandler.user_rate[1]
+
+        for _ in range(burst):
+            self.assertIsNone(flood_control.check_update(self.update(message_update('/dafi', 1))))
+
+        update = self.update(message_update('/dafi', 1))
+        check_result = flood_control.check_update(update)
+
+        self.assertEqual(check_result, (RoomHandler, 'user'))
+
+        for _ in range(2):
+            with self.assertRaises(DispatcherHandlerStop):
+                flood_control.handle_update(update, None, check_result)
+
+        self.assertEqual(update.message.bot.sent, [1])
+        self.assertEqual(metrics.get_dropped(), [(('RoomHandler', 'user'), 2)])
+        self.assertIn(
+            'bot_updates_dropped_total{handler="RoomHandler",reason="user"} 2', metrics.export()
+        )
+
+        # Other handlers and users have their own limits
+        self.assertIsNone(flood_control.check_update(self.update(message_update('/grupos', 1))))
+        self.assertIsNone(flood_control.check_update(self.update(message_update('/dafi', 2))))
+
+        # And every room
+        self.assertIsNone(flood_control.check_update(self.update(message_update('/repro', 1))))
+
+    def test_lazy_handlers(self):
+        '''Lazy handlers and their classes share the limits'''
+
+        router = HandlerRouter()
+        router.add(LazyHandler('groups', ('grupos',), 'grupos', 'GroupsList'))
+
+        flood_control = FloodControl(router)
+
+        for _ in range(GroupsList.user_rate[1]):
+            self.assertIsNone(flood_control.check_update(self.update(message_update('/grupos', 1))))
+
+        router.add(GroupsList)
+
+        self.assertEqual(
+            flood_control.check_update(self.update(message_update('/grupos', 1))),
+            (GroupsList, 'user')
+        )
+
+    def test_callbacks_answered(self):
+        '''Dropped button presses are always answered, the warning only once'''
+
+        class CallbackBot(StubBot):
+            def __init__(self):
+                super().__init__()
+                self.answers = []
+
+            def answerCallbackQuery(self, query_id, text=None, **kwargs):
+                self.answers.append(text)
+
+        bot = CallbackBot()
+        flood_control = FloodControl(_router)
+
+        for _ in range(RoomHandler.user_rate[1]):
+            update = Update.de_json(dict(callback_update('dafi:omw', 1), update_id=1), bot)
+            self.assertIsNone(flood_control.check_update(update))
+
+        for _ in range(2):
+            update = Update.de_json(dict(callback_update('dafi:omw', 1), update_id=1), bot)
+
+            with self.assertRaises(DispatcherHandlerStop):
+                flood_control.handle_update(update, None, flood_control.check_update(update))
+
+        self.assertEqual(bot.answers, [RoomHandler.flood_msg, None])
+
+    def test_chat_limit(self):
+        '''Updates over the group rate are dropped even from different users'''
+
+        flood_control = FloodControl(_router)
+        burst = RoomHandler.chat_rate[1]
+
+        for i in range(burst):
+            self.assertIsNone(flood_control.check_update(self.update(message_update('/dafi', i, -1))))
+
+        self.assertEqual(
+            flood_control.check_update(self.update(message_update('/dafi', burst, -1))),
+            (RoomHandler, 'chat')
+        )
+
+
+class ChatMetadataCacheTests(TestCase):
+    class StubChat():
+        def __init__(self, chat_id, status):
+            self.id = chat_id
+            self.status = status
+            self.calls = 0
+
+        def get_member(self, user_id):
+            self.calls += 1
+            return type('StubMember', (), {'status': self.status})
+
+    class StubBot():
+        token = '1000:test'
+        id = 1000
+
+        def __init__(self):
+            self.calls = 0
+
+        def get_me(self):
+            self.calls += 1
+            return self
+
+    def setUp(self):
+        _bot_cache.clear()
+        _chat_admin_cache.clear()
+
+    def test_admin_status_cached(self):
+        '''The bot identity and admin status are requested once'''
+
+        bot = self.StubBot()
+        chat = self.StubChat(-1, 'administrator')
+
+        self.assertTrue(is_bot_admin(bot, chat))
+        self.assertTrue(is_bot_admin(bot, chat))
+        self.assertFalse(is_bot_admin(bot, self.StubChat(-2, 'member')))
+
+        self.assertEqual(bot.calls, 1)
+        self.assertEqual(chat.calls, 1)
+
+    def test_invalidation(self):
+        '''The admin status is requested again after the bot joins the chat'''
+
+        bot = self.StubBot()
+        chat = self.StubChat(-1, 'member')
+
+        self.assertFalse(is_bot_admin(bot, chat))
+
+        update = Update.de_json({
+            'update_id': 1,
+            'message': {
+                'message_id': 1, 'date': 0,
+                'chat': {'id': -1, 'type': 'group'},
+                'new_chat_members': [{'id': 1000, 'is_bot': True, 'first_name': 'bot'}],
+            },
+        }, bot)
+
+        _chat_status_changed(update, type('StubContext', (), {'bot': bot}))
+
+        chat.status = 'administrator'
+
+        self.assertTrue(is_bot_admin(bot, chat))
+        self.assertEqual(chat.calls, 2)
@@ -0,0 +1,44 @@
+'''
+Transactions run again when they conflict with another one. SQLite reports
+"database is locked" right away when two transactions that read the same
+tables try to write at the same time, and PostgreSQL can abort a transaction
+in a deadlock, so the bot threads retry instead of losing the change.
+'''
+
+import random
+
+from time import sleep
+
+from django.db import OperationalError, transaction
+
+# Attempts of a transaction, and maximum random delay before the next one (in
+# seconds, it grows with every attempt, so the waiting transactions do not
+# collide again)
+ATTEMPTS = 10
+RETRY_DELAY = 0.05
+
+# PostgreSQL errors of transactions that can be run again
+LOCK_ERROR_CODES = ('40001', '40P01')
+
+
+def is_lock_conflict(error):
+    '''Whether the error is a lock conflict with another transaction'''
+
+    # SQLite only has a message, PostgreSQL a deadlock or serialization code
+    return (
+        'locked' in str(error)
+        or getattr(error.__cause__, 'pgcode', None) in LOCK_ERROR_CODES
+    )
+
+def atomic_retry(func, *args, **kwargs):
+    '''Runs the function in a transaction, again if it conflicts with another one'''
+
+    for attempt in range(ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as e:
+            if attempt == ATTEMPTS - 1 or not is_lock_conflict(e):
+                raise
+
+            sleep(random.uniform(0, RETRY_DELAY * (attempt + 1)))
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'bot'
+
+urlpatterns = [
+    path('<slug:command>/horario/', views.RoomScheduleView.as_view(), name='room_schedule'),
+]
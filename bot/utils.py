@@ -1,5 +1,103 @@
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+# Maximum length of the text of a Telegram message
+MAX_MESSAGE_LENGTH = 4096
+
+def message_length(text):
+    '''Length of a text as counted by Telegram (UTF-16 code units)'''
+
+    return len(text.encode('utf-16-le')) // 2
+
+# Character that closes every Markdown (legacy mode) entity and a lookalike
+# that replaces it inside the entity, where escapes are not processed
+ENTITY_CLOSERS = {
+    'bold': ('*', '∗'),
+    'italic': ('_', 'ˍ'),
+    'code': ('`', 'ˋ'),
+    'link': (']', '］'),
+}
+
+def escape_markdown(text, entity=None):
+    '''
+    Escapes the Markdown (legacy mode) entities of a text. The text inside an
+    `entity` (bold, italic, code or link) is shown as is by Telegram, so only
+    the character that would close the entity is replaced.
+    '''
+
+    if entity:
+        closer, replacement = ENTITY_CLOSERS[entity]
+        return text.replace(closer, replacement)
+
+    # Much faster than a translation table or a regex for short texts
+    return (
+        text
+        .replace('_', '\\_')
+        .replace('*', '\\*')
+        .replace('`', '\\`')
+        .replace('[', '\\[')
+    )
+
+
+class MessageBuilder():
+    '''
+    Builds long messages piece by piece, splitting them in chunks that fit in
+    a Telegram message. Every chunk starts with `header` and a piece is never
+    split between two chunks unless it does not fit in one by itself.
+    '''
+
+    def __init__(self, header='', limit=MAX_MESSAGE_LENGTH):
+        self.header = header
+        self.limit = limit
+
+        self._header_length = message_length(header)
+        self._chunks = []
+        self._parts = [header]
+        self._length = self._header_length
+
+    def __len__(self):
+        '''Number of chunks'''
+
+        return len(self._chunks) + 1
+
+    def _flush(self):
+        self._chunks.append(''.join(self._parts))
+        self._parts = [self.header]
+        self._length = self._header_length
+
+    def add(self, text):
+        length = message_length(text)
+
+        if self._length + length > self.limit and len(self._parts) > 1:
+            self._flush()
+
+        while self._length + length > self.limit:
+            # The piece does not fit in a chunk by itself: split it
+            room = max(self.limit - self._length, 1)
+            piece = text[:room]
+
+            while message_length(piece) > room and len(piece) > 1:
+                piece = piece[:-1]
+
+            self._parts.append(piece)
+            self._flush()
+
+            text = text[len(piece):]
+            length = message_length(text)
+
+        self._parts.append(text)
+        self._length += length
+
+        return self
+
+    def add_line(self, text=''):
+        return self.add('\n' + text)
+
+    def chunks(self):
+        return self._chunks + [''.join(self._parts)]
+
+    def __str__(self):
+        return ''.join(self.chunks())
+
 def create_reply_markup(*lines):
     buttons = []
 
@@ -17,15 +115,32 @@ def create_reply_markup(*lines):
 
     return InlineKeyboardMarkup(buttons)
 
-def create_users_list(users):
-    if not users:
-        return '\nNo hay usuarios para mostrar...'
+def add_users_list(builder, users):
+    '''Adds a line with a mention for every user to a message builder'''
 
-    msg = ''
+    empty = True
 
     for user in users:
-        msg += '\n[{}](tg://user?id={})'.format(
-            user.get_full_name(), user.telegram_id
-        )
+        builder.add_line('[{}](tg://user?id={})'.format(
+            escape_markdown(user.get_full_name(), 'link'), user.telegram_id
+        ))
+
+        empty = False
+
+    if empty:
+        builder.add_line('No hay usuarios para mostrar...')
+
+    return builder
+
+def create_users_list(users):
+    return ''.join(add_users_list(MessageBuilder(limit=float('inf')), users).chunks())
+
+def create_users_messages(users, header='', footer=''):
+    '''List of messages with a mention for every user'''
+
+    builder = add_users_list(MessageBuilder(header), users)
+
+    if footer:
+        builder.add(footer)
 
-    return msg
+    return builder.chunks()
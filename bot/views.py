@@ -0,0 +1,50 @@
+from django.views.generic import DetailView
+
+from meta.views import MetadataMixin
+
+from .models import Room
+from .occupancy import WEEKDAYS, get_staffed_ranges, get_weekly_occupancy
+
+
+class RoomScheduleView(MetadataMixin, DetailView):
+    model = Room
+    template_name = 'bot/room_schedule.html'
+
+    slug_field = 'command'
+    slug_url_kwarg = 'command'
+
+    description = 'Horas en las que normalmente hay alguien en la sala'
+    image = 'images/favicon.png'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(active=True)
+
+    def get_meta_title(self, context=None):
+        return 'Horario de {} - DAFI'.format(self.object.name)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+
+        # Only the rollups are read, never the event log
+        data = get_weekly_occupancy(self.object)
+
+        if data:
+            first, occupancy = data
+            shown = [i for i, hours in enumerate(occupancy) if any(hours) or i < 5]
+            used = [hour for hour in range(24) if any(occupancy[i][hour] for i in shown)]
+
+            context['first_date'] = first
+            context['hours'] = list(range(min(used), max(used) + 1)) if used else []
+            context['days'] = [
+                {
+                    'name': WEEKDAYS[i],
+                    'cells': [
+                        {'value': occupancy[i][hour], 'opacity': min(occupancy[i][hour], 1)}
+                        for hour in context['hours']
+                    ],
+                    'ranges': get_staffed_ranges(occupancy[i]),
+                }
+                for i in shown
+            ]
+
+        return context
@@ -0,0 +1,269 @@
+import heapq
+import logging
+import threading
+
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Threads sending the short replies of the updates that are not run (flood
+# control and busy answers), and most replies waiting to be sent, the rest
+# are dropped
+REPLY_WORKERS = 2
+MAX_PENDING_REPLIES = 500
+
+
+class _Task():
+    __slots__ = ('func', 'name', 'priority', 'limit', 'submitted')
+
+    def __init__(self, func, name, priority, limit):
+        self.func = func
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.submitted = monotonic()
+
+
+class HandlerExecutor():
+    '''
+    Worker pool for the bot handlers with a bounded queue. Low priority tasks
+    are shed when the queue is getting full and every handler can have a
+    maximum number of tasks running at the same time.
+    '''
+
+    # Fraction of the queue from which low priority tasks are shed
+    low_priority_threshold = 0.5
+
+    # Number of wait times kept to compute the statistics
+    wait_samples = 1000
+
+    def __init__(self, workers=8, max_queue=200):
+        self.workers = workers
+        self.max_queue = max_queue
+
+        self._queue = []
+        self._waiting = defaultdict(deque)
+        self._waiting_count = 0
+        self._running = defaultdict(int)
+        self._seq = count()
+
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.shed = 0
+        self.max_depth = 0
+        self._wait_times = deque(maxlen=self.wait_samples)
+
+    @property
+    def depth(self):
+        '''Tasks queued, including the ones waiting for their handler limit'''
+
+        return len(self._queue) + self._waiting_count
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name='handler-worker-{}'.format(i), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+        self._threads.clear()
+
+    def submit(self, func, name, priority=PRIORITY_NORMAL, limit=None):
+        '''
+        Queues a task. Returns False if it was shed because the queue
+        is full, in which case it will never run.
+        '''
+
+        with self._cond:
+            depth = self.depth
+
+            if priority >= PRIORITY_LOW and depth >= self.max_queue * self.low_priority_threshold:
+                self.shed += 1
+                return False
+
+            if depth >= self.max_queue:
+                self.shed += 1
+                return False
+
+            heapq.heappush(
+                self._queue,
+                (priority, next(self._seq), _Task(func, name, priority, limit))
+            )
+
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            self._cond.notify()
+
+        return True
+
+    def _next_task(self):
+        with self._cond:
+            while True:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+
+                if self._stopped:
+                    return None
+
+                task = heapq.heappop(self._queue)[2]
+
+                if task.limit and self._running[task.name] >= task.limit:
+                    # It will be queued again when one of the running ones ends
+                    self._waiting[task.name].append(task)
+                    self._waiting_count += 1
+                    continue
+
+                self._running[task.name] += 1
+                self._wait_times.append(monotonic() - task.submitted)
+
+                return task
+
+    def _task_done(self, task, failed):
+        with self._cond:
+            self._running[task.name] -= 1
+            self.completed += 1
+
+            if failed:
+                self.failed += 1
+
+            waiting = self._waiting[task.name]
+
+            if waiting:
+                waiting_task = waiting.popleft()
+                self._waiting_count -= 1
+
+                heapq.heappush(
+                    self._queue,
+                    (waiting_task.priority, next(self._seq), waiting_task)
+                )
+                self._cond.notify()
+
+    def _work(self):
+        while True:
+            task = self._next_task()
+
+            if not task:
+                return
+
+            failed = False
+
+            try:
+                task.func()
+            except Exception:
+                failed = True
+                logger.exception('Error running %s', task.name)
+
+            self._task_done(task, failed)
+
+    def stats(self):
+        with self._cond:
+            waits = sorted(self._wait_times)
+
+            return {
+                'workers': self.workers,
+                'queue_depth': self.depth,
+                'max_queue_depth': self.max_depth,
+                'queue_size': self.max_queue,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'shed': self.shed,
+                'wait_avg': sum(waits) / len(waits) if waits else 0,
+                'wait_p99': waits[int(len(waits) * 0.99)] if waits else 0,
+                'wait_max': waits[-1] if waits else 0,
+                'running': {k: v for k, v in self._running.items() if v},
+            }
+
+
+_executor = None
+
+_reply_executor = None
+_pending_replies = threading.BoundedSemaphore(MAX_PENDING_REPLIES)
+
+def start_executor(workers, max_queue):
+    '''Starts the worker pool used to run the handlers'''
+
+    global _executor, _reply_executor
+    _executor = HandlerExecutor(workers, max_queue)
+    _executor.start()
+
+    _reply_executor = ThreadPoolExecutor(REPLY_WORKERS, thread_name_prefix='replies')
+
+def stop_executor():
+    global _executor, _reply_executor
+
+    if _executor:
+        _executor.stop()
+        _executor = None
+
+    if _reply_executor:
+        _reply_executor.shutdown(wait=True)
+        _reply_executor = None
+
+def get_executor():
+    return _executor
+
+def submit(func, name, priority=PRIORITY_NORMAL, limit=None):
+    '''Runs the function in the worker pool, or right away if it is not running'''
+
+    if not _executor:
+        func()
+        return True
+
+    return _executor.submit(func, name, priority, limit)
+
+def _send_reply(func, name):
+    try:
+        func()
+    except Exception:
+        logger.exception('Error sending the reply of %s', name)
+    finally:
+        _pending_replies.release()
+
+def reply(func, name):
+    '''
+    Sends a reply in the background, so the dispatcher thread does not wait
+    for the Bot API, or right away if the worker pool is not running. Returns
+    False if it was dropped because too many replies are waiting.
+    '''
+
+    executor = _reply_executor
+
+    if not executor:
+        func()
+        return True
+
+    if not _pending_replies.acquire(blocking=False):
+        logger.warning('Too many pending replies, dropped the reply of %s', name)
+        return False
+
+    try:
+        executor.submit(_send_reply, func, name)
+    except RuntimeError:
+        # Stopped meanwhile
+        _pending_replies.release()
+        return False
+
+    return True
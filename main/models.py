@@ -1,4 +1,46 @@
+import threading
+
+from time import monotonic
+
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+
+class ConfigCache():
+    '''In-process cache of all the configuration entries'''
+
+    # Changes made from other processes are seen after this many seconds
+    timeout = 60
+
+    def __init__(self):
+        self._values = None
+        self._loaded = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        values = dict(Config.objects.values_list('key', 'value'))
+
+        with self._lock:
+            self._values = values
+            self._loaded = monotonic()
+
+        return values
+
+    def get_all(self):
+        values = self._values
+
+        if values is None or monotonic() - self._loaded > self.timeout:
+            values = self.load()
+
+        return values
+
+    def invalidate(self):
+        with self._lock:
+            self._values = None
+
+
+_cache = ConfigCache()
 
 
 class Config(models.Model):
@@ -32,7 +74,39 @@ class Config(models.Model):
         return '{}: {}'.format(self.key, self.name)
 
     @classmethod
-    def get(cls, key):
-        entry = cls.objects.filter(key=key).first()
+    def preload(cls):
+        '''Loads all the entries in the cache'''
+
+        _cache.load()
+
+    @classmethod
+    def get(cls, key, default=None):
+        return _cache.get_all().get(key, default)
+
+    @classmethod
+    def get_many(cls, *keys):
+        values = _cache.get_all()
+
+        return {key: values.get(key) for key in keys}
+
+    @classmethod
+    def get_int(cls, key, default=None):
+        try:
+            return int(cls.get(key))
+        except (TypeError, ValueError):
+            return default
+
+    @classmethod
+    def get_bool(cls, key, default=False):
+        value = cls.get(key)
+
+        if value is None:
+            return default
+
+        return value.strip().lower() in ('1', 'true', 'yes', 'on', 'si', 'sí')
+
 
-        return entry.value if entry else None
+@receiver(post_save, sender=Config)
+@receiver(post_delete, sender=Config)
+def _invalidate_config(sender, **kwargs):
+    _cache.invalidate()
@@ -0,0 +1,47 @@
+from django.test import TestCase
+
+from .models import Config
+
+
+class ConfigTests(TestCase):
+    def setUp(self):
+        Config.objects.create(key='text', value='hello', name='text')
+        Config.objects.create(key='number', value='42', name='number')
+        Config.objects.create(key='flag', value='Sí', name='flag')
+
+    def test_cached_reads(self):
+        '''All the entries are loaded with a single query'''
+
+        with self.assertNumQueries(1):
+            self.assertEqual(Config.get('text'), 'hello')
+            self.assertEqual(Config.get('number'), '42')
+            self.assertIsNone(Config.get('missing'))
+
+    def test_typed_accessors(self):
+        '''Typed accessors convert the values or return the default'''
+
+        self.assertEqual(Config.get_int('number'), 42)
+        self.assertEqual(Config.get_int('text', 0), 0)
+        self.assertTrue(Config.get_bool('flag'))
+        self.assertFalse(Config.get_bool('text'))
+        self.assertTrue(Config.get_bool('missing', True))
+
+        self.assertEqual(
+            Config.get_many('text', 'missing'),
+            {'text': 'hello', 'missing': None}
+        )
+
+    def test_invalidation(self):
+        '''Saved and deleted entries are seen at once'''
+
+        self.assertEqual(Config.get('text'), 'hello')
+
+        Config.objects.filter(key='text').update(value='stale')
+        self.assertEqual(Config.get('text'), 'hello')
+
+        Config.objects.create(key='new', value='value', name='new')
+        self.assertEqual(Config.get('text'), 'stale')
+        self.assertEqual(Config.get('new'), 'value')
+
+        Config.objects.get(key='new').delete()
+        self.assertIsNone(Config.get('new'))
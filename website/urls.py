@@ -13,6 +13,7 @@ urlpatterns = [
     path('blog/', include('blog.urls')),
     path('clubs/', include('clubs.urls')),
     path('cuenta/', include('users.urls')),
+    path('salas/', include('bot.urls')),
     path('admin/', admin.site.urls),
     path('p/<path:url>', views.flatpage),
 ]